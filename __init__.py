@@ -15,6 +15,7 @@
 import subprocess
 import platform
 import os
+import queue
 import tkinter as tk
 from datetime import date, datetime, timedelta
 from tkinter.filedialog import askopenfilename
@@ -22,11 +23,15 @@ from tkinter import ttk
 from pathlib import Path
 
 import osgeo.ogr as ogr
-from sentinel import ler_envelope, import_img, processa, geometry
+from sentinel import ler_envelope, import_img, processa, geometry, selecao_cenas
+from sentinel.trabalhos import FilaTrabalhos
 
 #Variável do número de imagens que mostra antes e depois da data do incêndio
 NUMERO_DE_IMAGENS = 10
 
+#Intervalo (em mili-segundos) em que a janela lê os eventos dos trabalhos que correm em segundo plano
+INTERVALO_EVENTOS = 100
+
 #Definir a pasta raiz da ferramenta
 pasta_raiz = Path(__file__).parent.parent
 pasta_downloads = pasta_raiz / "downloads"
@@ -108,13 +113,58 @@ class SentinelMixin:
         self.progress_label.pack()
         self.progressbar = ttk.Progressbar(frame)
         self.progressbar.pack(fill="x", expand=True)
-
-    #Atualiza a barra de progresso que é chamada diretamente das funções em "processa.py"
+        #Cria o botão para cancelar os trabalhos e a indicação dos trabalhos em espera
+        fr_fila = tk.Frame(frame)
+        fr_fila.pack()
+        self.botao_cancelar = tk.Button(fr_fila, text="Cancelar", command=self.cancela_trabalhos, state="disabled")
+        self.botao_cancelar.pack(side="left", **pack_style)
+        self.fila_label = tk.Label(fr_fila, text="")
+        self.fila_label.pack(side="left")
+
+    #Atualiza a barra de progresso com os eventos enviados pelas funções em "processa.py"
     #para atualizar a barra de acordo com o passo que a ferramenta está a realizar
     def update_progress(self, valor, mensagem):
         self.progress_label["text"] = mensagem
         self.progressbar["value"] = valor
-        self.top.update()
+
+    #Acrescenta um trabalho à fila que corre em segundo plano; "ao_terminar" é chamado na janela com o resultado
+    def adiciona_trabalho(self, nome, funcao, *args, ao_terminar=None, **kwargs):
+        identificador = self.fila.adiciona(nome, funcao, *args, **kwargs)
+        if ao_terminar is not None:
+            self._ao_terminar[identificador] = ao_terminar
+        return identificador
+
+    #Cancela o trabalho que está a correr e os que estão à espera
+    def cancela_trabalhos(self):
+        self.fila.cancela_todos()
+        self.update_progress(self.progressbar["value"], "A cancelar...")
+
+    #Lê os eventos dos trabalhos em segundo plano e atualiza a janela; corre de INTERVALO_EVENTOS em INTERVALO_EVENTOS ms
+    def le_eventos(self):
+        while True:
+            try:
+                evento = self.fila.eventos.get_nowait()
+            except queue.Empty:
+                break
+            tipo, identificador, nome = evento[:3]
+            if tipo == "inicio":
+                self.update_progress(0, f"A iniciar: {nome}")
+            elif tipo == "progresso":
+                self.update_progress(*evento[3:])
+            elif tipo == "fim":
+                ao_terminar = self._ao_terminar.pop(identificador, None)
+                if ao_terminar is not None:
+                    ao_terminar(evento[3])
+            elif tipo == "erro":
+                self._ao_terminar.pop(identificador, None)
+                self.update_progress(0, f"Erro em {nome}: {evento[3]}")
+            elif tipo == "cancelado":
+                self._ao_terminar.pop(identificador, None)
+                self.update_progress(0, f"Cancelado: {nome}")
+        pendentes = self.fila.pendentes()
+        self.fila_label["text"] = f"{pendentes} trabalho(s) em espera" if pendentes else ""
+        self.botao_cancelar["state"] = "normal" if self.fila.ocupada() else "disabled"
+        self.top.after(INTERVALO_EVENTOS, self.le_eventos)
 
     #Cria uma barra de rolagem para ajudar na ListBox do tkinter e ao selecionar uma data da imagem esta fica a azul
     def list_with_scrollbar(self, fr, **pack_options):
@@ -145,8 +195,12 @@ class SentinelParametrosMixin:
         if len(codigo) != 4:
             self.erro("Código DICO precisa ter 4 dígitos")
             return
+        try:
+            self.coords_municipio = geometry.obter_coords_municipio(codigo)
+        except ValueError as erro:
+            self.erro(str(erro))
+            return
         self.exibe_titulo()
-        self.coords_municipio = geometry.obter_coords_municipio(codigo)
 
  #Define a cobertura máxima de nuvens para pesquisa das imagens Sentinel2 que por defeito é de 5%
     @property
@@ -161,13 +215,17 @@ class SentinelParametrosMixin:
     #Permite escolher a shapefile de recorte com a geometria do município
     def seleciona_ficheiro_recorte(self):
         ficheiro = askopenfilename(parent=self.top, defaultextension=".shp", title="Ficheiro de recorte", filetypes=[("shapefile", "*shp"), ("All files", "*")])
+        if not ficheiro:
+            # seleção cancelada: mantém o recorte anterior (ou o limite da CAOP)
+            return
         ficheiro = Path(ficheiro)
         self.ficheiro_recorte = ficheiro
         self.nome_ficheiro_recorte["text"] = ficheiro.name
         self.verifica_imagens_selecionadas()
 
     #Habilita o botão para processar as imagens, mas somente se já foi escolhida a
-    #shapefile de recorte e se estarem selecionadas duas imagens, já descarregadas
+    #shapefile de recorte (ou o código DICO é válido, para usar o limite da CAOP)
+    #e se estarem selecionadas duas imagens, já descarregadas
     def verifica_imagens_selecionadas(self, evento=None):
         if evento is not None:
             # quando é chamado por evento do tkinter, a imagem
@@ -178,12 +236,14 @@ class SentinelParametrosMixin:
             self.top.after(20, self.verifica_imagens_selecionadas, None)
             return
         imagens_pre, imagens_pos, imagens_a_descarregar = self.verifica_selecao()
-        if not imagens_a_descarregar and imagens_pre and imagens_pos and hasattr(self, "ficheiro_recorte"):
+        tem_recorte = hasattr(self, "ficheiro_recorte") or getattr(self, "coords_municipio", None)
+        if not imagens_a_descarregar and imagens_pre and imagens_pos and tem_recorte:
             state = "normal"
         else:
             state = "disabled"
         self.botao_dndvi["state"] = state
         self.botao_dnbr["state"] = state
+        self.botao_dndvi_dnbr["state"] = state
         self.botao_descarregar["state"] = "normal" if imagens_a_descarregar else "disabled"
 
     #Cria a lista das imagens para que possa ser realizado o download
@@ -194,6 +254,9 @@ class SentinelParametrosMixin:
         fr.pack(side=tk.LEFT)
         self.lista = self.list_with_scrollbar(fr, **pack_style)
         self.lista.bind("<Button-1>", lambda ev=None: (self.desenha_contorno_imagem(ev), self.verifica_imagens_selecionadas(ev)))
+        #cria o botão para selecionar automaticamente as imagens que cobrem o município com o menor número de produtos
+        botao_automatico = tk.Button(fr, text="Selecionar automaticamente", command=self.seleciona_automaticamente)
+        botao_automatico.pack(**pack_style)
         #cria o botão para efetuar o download das imagens selecionadas
         self.botao_descarregar = tk.Button(fr, text="Download das imagens selecionadas", command=self.descarrega_novas_imagens, state="disabled")
         self.botao_descarregar.pack(**pack_style)
@@ -201,6 +264,27 @@ class SentinelParametrosMixin:
         fr_preview.pack(side=tk.RIGHT)
         self.fr_preview = fr_preview
 
+    #Seleciona na lista, para a data mais próxima antes e depois do incêndio, só os produtos necessários para cobrir o município
+    def seleciona_automaticamente(self):
+        if not getattr(self, "indice_de_imagens", None):
+            self.erro("Veja primeiro as imagens disponiveis")
+            return
+        produtos = [imagem for imagem, ficheiro in self.indice_de_imagens.values()]
+        try:
+            antes, depois = selecao_cenas.seleciona_cenas(produtos, self.codigo.get(), self.data_inicio.get_as_datetime(), self.cobertura_maxima)
+        except ValueError as erro:
+            self.erro(str(erro))
+            return
+        if not antes or not depois:
+            self.erro("Não há imagens que cubram o município antes e depois do incêndio")
+            return
+        escolhidos = {id(imagem) for imagem in antes + depois}
+        self.lista.selection_clear(0, tk.END)
+        for posicao, (imagem, ficheiro) in self.indice_de_imagens.items():
+            if id(imagem) in escolhidos:
+                self.lista.selection_set(posicao)
+        self.verifica_imagens_selecionadas()
+
     #Mostra os contornos da imagem de satélite em relação ao contorno do município, de acordo com o código DICO
     def desenha_contorno_imagem(self, evento=None, selecionadas_anteriores=None):
         selecionadas = self.lista.curselection()
@@ -257,6 +341,9 @@ class MainApp(SentinelMixin, SentinelParametrosMixin):
         fr_cobertura = tk.Frame(fr)
         fr_cobertura.pack(side=tk.TOP)
         self._cobertura_nuvens = self.add_entry(fr_cobertura, "Cobertura de nuvens até (%)", default="5", width=3)
+        #Sem ligação à internet, a pesquisa mostra só as imagens já guardadas na cache das pesquisas anteriores
+        self.offline = tk.BooleanVar(fr_cobertura, value=import_img.MODO_OFFLINE)
+        tk.Checkbutton(fr_cobertura, text="Sem ligação (usar só a cache das pesquisas)", variable=self.offline).pack()
 
         #Cria o botão para "Ver as imagens disponiveis antes e depois do incêndio"
         obter_imagens = tk.Button(top, text="Ver as imagens disponiveis antes e depois do incêndio", command=self.selecionar_imagens)
@@ -268,7 +355,7 @@ class MainApp(SentinelMixin, SentinelParametrosMixin):
         #Criar quadro para selecionar a Shapefile de recorte pelo município
         fr_recorte = tk.Frame(self.top, **pack_style)
         fr_recorte.pack()
-        lb = tk.Label(fr_recorte, text="Selecione a Shapefile de recorte do município:")
+        lb = tk.Label(fr_recorte, text="Selecione a Shapefile de recorte do município (opcional, por defeito usa o limite da CAOP):")
         lb.pack()
         fr2 = tk.Frame(fr_recorte)
         fr2.pack()
@@ -289,10 +376,24 @@ class MainApp(SentinelMixin, SentinelParametrosMixin):
         frame_botoes.pack(**pack_style)
         self.botao_dndvi = tk.Button(frame_botoes, text="Criar o dNDVI", command=self.processa_imagens, state="disabled")
         self.botao_dnbr = tk.Button(frame_botoes, text="Criar o dNBR", command=(lambda: self.processa_imagens(alvo="dnbr")), state="disabled")
+        self.botao_dndvi_dnbr = tk.Button(frame_botoes, text="Criar o dNDVI e o dNBR", command=(lambda: self.processa_imagens(alvo="dndvi_dnbr")), state="disabled")
         self.botao_dndvi.pack()
         self.botao_dnbr.pack()
+        self.botao_dndvi_dnbr.pack()
+        #Modo rápido: triagem a 20 m e recorte a 10 m só à volta das áreas candidatas a ardidas
+        #As composições RGB e os índices sem limiar ficam a 20 m, com "_20m" no nome
+        self.modo_rapido = tk.BooleanVar(frame_botoes, value=processa.MODO_RAPIDO)
+        tk.Checkbutton(
+            frame_botoes, text="Modo rápido (10 m só nas áreas candidatas; RGB a 20 m, ficheiros com _20m)",
+            variable=self.modo_rapido,
+        ).pack()
         self.create_progress_bar()
 
+        #Os processamentos e os downloads correm em segundo plano, para a janela não ficar bloqueada
+        self.fila = FilaTrabalhos()
+        self._ao_terminar = {}
+        self.le_eventos()
+
     #Inicia o processo principal que extrair as imagens pelas bandas corretas de dentro do ficheiro ZIP e criar os ficheiros finais na pasta "resultados"
     def processa_imagens(self, alvo="dndvi"):
         imagens_pre, imagens_pos, imagens_nao_baixadas = self.verifica_selecao()
@@ -301,26 +402,42 @@ class MainApp(SentinelMixin, SentinelParametrosMixin):
             print("Imagens ainda não estão prontas para processamento")
             return
 
-        funcao = processa.processa_dndvi if alvo == "dndvi" else processa.processa_dnbr
-        destino = f"{self.prefixo_de_destino.get()}_{self.data_inicio.get().strftime('%Y%m%d') }_{alvo}"
-        ficheiro_qgis = funcao(imagens_pre, imagens_pos, destino, self.ficheiro_recorte, self.update_progress)
-
-    #Função para descarregar as imagens do Sentinel2 e atualiza a barra de progresso
+        #Índices espectrais a calcular para cada botão; com um só índice a shapefile tem o nome do destino, como antes,
+        #e com os dois o nome de cada shapefile termina com o índice (ex: "_dndvi")
+        indices = {"dndvi": ("ndvi",), "dnbr": ("nbr",), "dndvi_dnbr": ("ndvi", "nbr")}[alvo]
+        destino = f"{self.prefixo_de_destino.get()}_{self.data_inicio.get().strftime('%Y%m%d') }"
+        nomes_saida = {indices[0]: destino} if len(indices) == 1 else None
+        #Se não foi escolhida uma shapefile de recorte, o processo usa o limite do município com o código DICO
+        ficheiro_recorte = getattr(self, "ficheiro_recorte", None)
+        dico = self.codigo.get()
+        modo_rapido = self.modo_rapido.get()
+        self.adiciona_trabalho(
+            f"{destino} ({alvo})",
+            lambda update: processa.processa(
+                imagens_pre, imagens_pos, destino, ficheiro_recorte, indices=indices, update=update, dico=dico,
+                modo_rapido=modo_rapido, nomes_saida=nomes_saida,
+            ),
+        )
+
+    #Função para descarregar as imagens do Sentinel2 em segundo plano; no fim atualiza a lista de imagens
     def descarrega_novas_imagens(self):
         imagens = self.verifica_selecao()[2]
+        self.adiciona_trabalho(f"download de {len(imagens)} imagens", self.descarrega, imagens, ao_terminar=self.descarregamento_terminado)
 
-        passos = 100 // len(imagens)
-        self.update_progress(0, f"A realizar o download das {len(imagens)} imagens")
-        baixou_imagem_nova = False
-        for indice, imagem in enumerate(imagens):
-            uuid=imagem['properties']['uuid']
-            title=imagem['properties']['title']
-            print(f"\nA descarregar: {title} com identificador {uuid}")
-            baixou_imagem_nova |= import_img.download(uuid,title, self.update_progress)
-            self.update_progress(passos * indice, f"A realizar o download das imagens ")
-        self.update_progress(100, f"Imagens já descarregadas - pronto para criar o dNVI e ou dNBR")
+    #Corre na thread de fundo: não pode usar a janela, só o "update" da fila
+    @staticmethod
+    def descarrega(update, imagens):
+        update(0, f"A realizar o download das {len(imagens)} imagens")
+        for imagem in imagens:
+            print(f"\nA descarregar: {imagem['properties']['title']} com identificador {imagem['properties']['uuid']}")
+        # Os produtos são descarregados em simultâneo, com o progresso total de todos na barra
+        baixou_imagem_nova = bool(import_img.download_varios([imagem['properties']['uuid'] for imagem in imagens], update))
+        update(100, f"Imagens já descarregadas - pronto para criar o dNVI e ou dNBR")
+        return baixou_imagem_nova
+
+    def descarregamento_terminado(self, baixou_imagem_nova):
         if not baixou_imagem_nova:
-            self.error("Imagens selecionadas já descarregadas")
+            self.erro("Imagens selecionadas já descarregadas")
         self.selecionar_imagens()
 
     # Verifica quais das imagens selecioandas já estão baixadas, e se há alguma por descarregar
@@ -344,7 +461,11 @@ class MainApp(SentinelMixin, SentinelParametrosMixin):
             self.erro("Preencha o código do município")#se não existir código DICO preenchido corretamente (4 dígitos) mostra mensagem de erro
             return
         #Chama a api do sentinel2 para obter a lista de imagens disponíveis
-        features = self.obter_imagens(data_inicio, codigo)
+        try:
+            features = self.obter_imagens(data_inicio, codigo)
+        except ValueError as erro:
+            self.erro(str(erro))#se o código DICO não existir na CAOP mostra mensagem de erro
+            return
         #Mostra as datas imagens do sentinel2 diponiveis e se existir mais que uma para a mesma mostra a mesma data mais 1, 2, 3...
         datas = {}
         repetidas = {}
@@ -417,7 +538,7 @@ class MainApp(SentinelMixin, SentinelParametrosMixin):
         print(bbox)
         data_inicio=(data_incendio - timedelta(days=60)).strftime("%Y%m%d")
         data_fim=(data_incendio + timedelta(days=60)).strftime("%Y%m%d")
-        lista=import_img.lerimagens(bbox,data_inicio,data_fim, self.cobertura_maxima)
+        lista=import_img.lerimagens(bbox,data_inicio,data_fim, self.cobertura_maxima, offline=self.offline.get())
         return lista["features"]
 
 
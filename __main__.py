@@ -12,6 +12,20 @@
 #-------------------------------------------------------------------------------
 
 # Iniciar a ferramenta
+# "python -m sentinel lote <ficheiro>" corre o processamento em lote sem interface gráfica
+# "python -m sentinel desempenho" mede o desempenho de cada fase com produtos sintéticos
+
+import sys
+
+if len(sys.argv) > 1 and sys.argv[1] == "lote":
+    from sentinel import lote
+
+    sys.exit(lote.main(sys.argv[2:]))
+
+if len(sys.argv) > 1 and sys.argv[1] == "desempenho":
+    from sentinel import desempenho
+
+    sys.exit(desempenho.main(sys.argv[2:]))
 
 from sentinel import main
 
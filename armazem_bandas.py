@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Importar as bibliotecas
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import osgeo.gdal as gdal
+from osgeo import gdal_array
+
+# Memória (em MB) que as bandas inteiras podem ocupar: se todas as bandas da execução couberem, cada banda é lida
+# inteira uma única vez; senão, cada janela é lida do ficheiro quando é pedida (ver MEMORIA_JANELAS_MB)
+MEMORIA_BANDAS_MB = 1024
+
+# Memória (em MB) das janelas já lidas, guardadas para o caso de voltarem a ser pedidas (as menos usadas saem primeiro),
+# quando as bandas não cabem inteiras em MEMORIA_BANDAS_MB
+MEMORIA_JANELAS_MB = 256
+
+
+# Guarda as bandas recortadas de uma execução, para que cada banda seja descodificada uma única vez
+# e partilhada pelas composições RGB, pelo cálculo dos índices e por qualquer outra fase do processo
+# Se as bandas não couberem inteiras na memória indicada, só as janelas pedidas são lidas, com uma cache limitada:
+# as composições RGB e os índices pedem as mesmas janelas (a mesma grelha de blocos), mas percorrem a imagem
+# uma a seguir à outra, por isso só as janelas que ainda estão na cache são partilhadas e, numa imagem maior
+# que MEMORIA_JANELAS_MB, cada fase volta a ler as bandas do ficheiro (uma vez por bloco)
+class ArmazemBandas:
+
+    def __init__(self, ficheiros_recortados, memoria_mb=MEMORIA_BANDAS_MB, memoria_janelas_mb=MEMORIA_JANELAS_MB):
+        # ficheiros_recortados: {"pre": {banda: caminho}, "pos": {banda: caminho}}, como devolvido por realiza_recorte
+        self.ficheiros = ficheiros_recortados
+        self.memoria_maxima = memoria_mb * 1024 * 1024
+        self.memoria_janelas_maxima = memoria_janelas_mb * 1024 * 1024
+        self.memoria_janelas = 0
+        self.entradas = {}
+        self.bandas = {}
+        self.janelas = OrderedDict()
+        self.maximos = {}
+        self.leituras = 0
+        self.bytes_lidos = 0
+        self.leituras_poupadas = 0
+        self.bytes_poupados = 0
+        self._trinco = threading.Lock()
+        tamanho_total = sum(
+            self._tamanho(prefixo, banda) for prefixo, bandas in self.ficheiros.items() for banda in bandas
+        )
+        self.bandas_inteiras = tamanho_total <= self.memoria_maxima
+
+    # Banda 1 do ficheiro recortado, aberto uma única vez
+    def _entrada(self, prefixo, banda):
+        chave = (prefixo, banda)
+        if chave not in self.entradas:
+            self.entradas[chave] = gdal.Open(str(self.ficheiros[prefixo][banda]))
+        return self.entradas[chave].GetRasterBand(1)
+
+    # Tamanho em bytes da banda inteira, no tipo original do ficheiro (uint16 no Sentinel2)
+    def _tamanho(self, prefixo, banda):
+        entrada = self._entrada(prefixo, banda)
+        tipo = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(entrada.DataType))
+        return entrada.XSize * entrada.YSize * tipo.itemsize
+
+    # Devolve a janela (xoff, yoff, xsize, ysize) da banda, convertida para o tipo pedido
+    # Cada janela servida sem voltar ao ficheiro conta como uma leitura poupada com o tamanho da janela
+    def janela(self, prefixo, banda, janela, tipo=None):
+        xoff, yoff, xsize, ysize = janela
+        if self.bandas_inteiras:
+            dados, ja_lida = self._obtem(prefixo, banda)
+            dados = dados[yoff:yoff + ysize, xoff:xoff + xsize]
+        else:
+            dados, ja_lida = self._obtem_janela(prefixo, banda, tuple(janela))
+        if ja_lida:
+            self._conta_poupada(dados.nbytes)
+        if tipo is None:
+            return dados
+        return dados.astype(tipo)
+
+    # Devolve a banda e se já estava no armazém; lê-a do ficheiro se ainda não estiver
+    def _obtem(self, prefixo, banda):
+        chave = (prefixo, banda)
+        with self._trinco:
+            if chave in self.bandas:
+                return self.bandas[chave], True
+            dados = self.bandas[chave] = self._le(prefixo, banda)
+            return dados, False
+
+    # Devolve a janela e se já estava no armazém; lê-a do ficheiro se ainda não estiver e guarda-a se couber,
+    # retirando as janelas usadas há mais tempo
+    def _obtem_janela(self, prefixo, banda, janela):
+        chave = (prefixo, banda, janela)
+        with self._trinco:
+            if chave in self.janelas:
+                self.janelas.move_to_end(chave)
+                return self.janelas[chave], True
+            dados = self._le(prefixo, banda, janela)
+            if dados.nbytes <= self.memoria_janelas_maxima:
+                self.janelas[chave] = dados
+                self.memoria_janelas += dados.nbytes
+                while self.memoria_janelas > self.memoria_janelas_maxima:
+                    _, retirada = self.janelas.popitem(last=False)
+                    self.memoria_janelas -= retirada.nbytes
+            return dados, False
+
+    def _conta_poupada(self, n_bytes):
+        with self._trinco:
+            self.leituras_poupadas += 1
+            self.bytes_poupados += n_bytes
+
+    # Valor máximo da banda (usado para esticar as composições RGB), calculado uma única vez
+    # Sem as bandas inteiras em memória, é o GDAL que percorre o ficheiro
+    def maximo(self, prefixo, banda):
+        chave = (prefixo, banda)
+        if chave not in self.maximos:
+            if self.bandas_inteiras:
+                self.maximos[chave] = self._obtem(prefixo, banda)[0].max()
+            else:
+                with self._trinco:
+                    self.maximos[chave] = self._entrada(prefixo, banda).ComputeRasterMinMax(False)[1]
+        return self.maximos[chave]
+
+    # Lê a banda inteira ou a janela (xoff, yoff, xsize, ysize) no tipo original do ficheiro
+    # Chamado com o trinco adquirido: o mesmo dataset do GDAL não pode ser lido por várias threads ao mesmo tempo
+    def _le(self, prefixo, banda, janela=None):
+        entrada = self._entrada(prefixo, banda)
+        dados = entrada.ReadAsArray() if janela is None else entrada.ReadAsArray(*janela)
+        self.leituras += 1
+        self.bytes_lidos += dados.nbytes
+        return dados
+
+    # Liberta as bandas e as janelas guardadas e fecha os ficheiros
+    def fecha(self):
+        with self._trinco:
+            self.bandas.clear()
+            self.janelas.clear()
+            self.memoria_janelas = 0
+            self.entradas.clear()
+
+    # Resumo das leituras feitas e das que foram evitadas por a banda (ou a janela) já estar no armazém
+    def relatorio(self):
+        return {
+            "leituras": self.leituras,
+            "bytes_lidos": self.bytes_lidos,
+            "leituras_poupadas": self.leituras_poupadas,
+            "bytes_poupados": self.bytes_poupados,
+            "bandas_inteiras": self.bandas_inteiras,
+        }
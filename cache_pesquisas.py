@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Cache persistente das pesquisas de imagens no Copernicus (SQLite), por dia de aquisição:
+# para cada pesquisa (footprint, plataforma e nível de processamento) guarda os produtos encontrados
+# e os dias já consultados, para só pedir ao Copernicus os dias em falta ou já fora de validade.
+# A cobertura de nuvens não faz parte da chave: os produtos são guardados todos e filtrados localmente
+
+# Importar as bibliotecas
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sentinel.pastas import pasta_cache
+
+ficheiro_cache = pasta_cache / "pesquisas.sqlite"
+
+# Tempo (em segundos) durante o qual um dia já consultado não é pedido de novo ao Copernicus
+VALIDADE_PESQUISA = 6 * 3600
+
+# Uma ligação por thread (as ligações do sqlite3 não devem ser partilhadas entre threads)
+_ligacoes = threading.local()
+
+_TABELAS = """
+CREATE TABLE IF NOT EXISTS dias_consultados (
+    chave TEXT NOT NULL,
+    dia TEXT NOT NULL,
+    consultado_em REAL NOT NULL,
+    PRIMARY KEY (chave, dia)
+);
+CREATE TABLE IF NOT EXISTS produtos (
+    chave TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    dia TEXT NOT NULL,
+    ingestao TEXT,
+    cobertura_nuvens REAL,
+    geojson TEXT NOT NULL,
+    PRIMARY KEY (chave, uuid)
+);
+CREATE INDEX IF NOT EXISTS produtos_chave_dia ON produtos (chave, dia);
+"""
+
+
+def ligacao():
+    con = getattr(_ligacoes, "con", None)
+    if con is None:
+        ficheiro_cache.parent.mkdir(parents=True, exist_ok=True)
+        con = _ligacoes.con = sqlite3.connect(str(ficheiro_cache), timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        with con:
+            con.executescript(_TABELAS)
+    return con
+
+
+# Chave da pesquisa: o footprint e os restantes critérios, exceto as datas e a cobertura de nuvens
+def chave_pesquisa(footprint, **criterios):
+    return hashlib.sha256(json.dumps([footprint, sorted(criterios.items())]).encode()).hexdigest()[:32]
+
+
+# Dias (AAAAMMDD) entre duas datas AAAAMMDD, inclusive
+def dias_entre(data_inicio, data_fim):
+    dia = datetime.strptime(data_inicio, "%Y%m%d")
+    fim = datetime.strptime(data_fim, "%Y%m%d")
+    while dia <= fim:
+        yield dia.strftime("%Y%m%d")
+        dia += timedelta(days=1)
+
+
+# Devolve os intervalos [(primeiro dia, último dia)] de dias seguidos que ainda não foram consultados
+# ou cuja consulta já passou da validade
+def intervalos_em_falta(chave, data_inicio, data_fim, validade=VALIDADE_PESQUISA):
+    limite = time.time() - validade
+    consultados = {
+        dia for (dia,) in ligacao().execute(
+            "SELECT dia FROM dias_consultados WHERE chave = ? AND dia BETWEEN ? AND ? AND consultado_em >= ?",
+            (chave, data_inicio, data_fim, limite),
+        )
+    }
+    intervalos = []
+    for dia in dias_entre(data_inicio, data_fim):
+        if dia in consultados:
+            continue
+        anterior = (datetime.strptime(dia, "%Y%m%d") - timedelta(days=1)).strftime("%Y%m%d")
+        if intervalos and intervalos[-1][1] == anterior:
+            intervalos[-1][1] = dia
+        else:
+            intervalos.append([dia, dia])
+    return [tuple(intervalo) for intervalo in intervalos]
+
+
+# Guarda os produtos (features GeoJSON) encontrados no intervalo e marca os dias como consultados,
+# numa única transação; os produtos que já não são devolvidos nesse intervalo são apagados
+def guarda(chave, data_inicio, data_fim, features):
+    agora = time.time()
+    con = ligacao()
+    with con:
+        con.execute("DELETE FROM produtos WHERE chave = ? AND dia BETWEEN ? AND ?", (chave, data_inicio, data_fim))
+        for feature in features:
+            propriedades = feature["properties"]
+            dia = str(propriedades["beginposition"])[:10].replace("-", "")
+            con.execute(
+                "INSERT OR REPLACE INTO produtos (chave, uuid, dia, ingestao, cobertura_nuvens, geojson) VALUES (?, ?, ?, ?, ?, ?)",
+                (chave, propriedades["uuid"], dia, str(propriedades.get("ingestiondate")),
+                 propriedades.get("cloudcoverpercentage"), json.dumps(feature, default=str)),
+            )
+        con.executemany(
+            "INSERT OR REPLACE INTO dias_consultados (chave, dia, consultado_em) VALUES (?, ?, ?)",
+            [(chave, dia, agora) for dia in dias_entre(data_inicio, data_fim)],
+        )
+
+
+# Devolve as features guardadas no intervalo com cobertura de nuvens até ao máximo, da mais recente para a mais antiga
+# Os produtos sem cobertura de nuvens indicada também são devolvidos, tal como na pesquisa ao Copernicus
+def procura(chave, data_inicio, data_fim, cobertura_maxima=100):
+    linhas = ligacao().execute(
+        "SELECT geojson FROM produtos WHERE chave = ? AND dia BETWEEN ? AND ? "
+        "AND (cobertura_nuvens IS NULL OR cobertura_nuvens <= ?) "
+        "ORDER BY ingestao DESC",
+        (chave, data_inicio, data_fim, cobertura_maxima),
+    )
+    return [json.loads(geojson) for (geojson,) in linhas]
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Importar as bibliotecas
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import osgeo.gdal as gdal
+
+from sentinel import catalogo
+from sentinel.descarregamentos import md5_do_ficheiro
+from sentinel.pastas import pasta_cache
+
+# Tamanho máximo da cache em MB; quando é ultrapassado são apagados os recortes usados há mais tempo
+TAMANHO_MAXIMO_CACHE_MB = 5000
+
+# Ficheiros que compõem uma shapefile e que influenciam o resultado do recorte
+EXTENSOES_SHAPEFILE = (".shp", ".shx", ".dbf", ".prj")
+
+
+# Lê o conteúdo de um ficheiro, seja do disco ou de um sistema de ficheiros virtual do GDAL (/vsimem/, /vsizip/...)
+def le_bytes(caminho):
+    caminho = str(caminho)
+    if not caminho.startswith("/vsi"):
+        with open(caminho, "rb") as ficheiro:
+            return ficheiro.read()
+    ficheiro = gdal.VSIFOpenL(caminho, "rb")
+    try:
+        gdal.VSIFSeekL(ficheiro, 0, 2)
+        tamanho = gdal.VSIFTellL(ficheiro)
+        gdal.VSIFSeekL(ficheiro, 0, 0)
+        return gdal.VSIFReadL(1, tamanho, ficheiro)
+    finally:
+        gdal.VSIFCloseL(ficheiro)
+
+
+# Calcula o hash do conteúdo da shapefile de recorte (geometria, atributos e sistema de referência)
+def hash_do_recorte(shapefile):
+    resumo = hashlib.sha256()
+    # Recortes em memória (ex: os limites municipais em /vsimem/) são um único ficheiro
+    if str(shapefile).startswith("/vsi"):
+        resumo.update(le_bytes(shapefile))
+        return resumo.hexdigest()
+    for extensao in EXTENSOES_SHAPEFILE:
+        ficheiro = Path(shapefile).with_suffix(extensao)
+        if ficheiro.exists():
+            resumo.update(extensao.encode())
+            resumo.update(ficheiro.read_bytes())
+    return resumo.hexdigest()
+
+
+# MD5 dos ficheiros fora do catálogo, por (caminho, tamanho, data de modificação), para só ler cada ficheiro uma vez
+_md5_ficheiros = {}
+
+
+# Identifica um produto do satélite pelo uuid no catálogo ou, se não estiver no catálogo, pelo MD5 do ficheiro
+# (o nome e o tamanho não chegam: um produto reprocessado ou um download parcial pode ter o mesmo nome)
+def identificador_produto(ficheiro_satelite):
+    ficheiro_satelite = Path(ficheiro_satelite)
+    uuid = catalogo.uuid_do_ficheiro(ficheiro_satelite)
+    if uuid is not None:
+        return f"uuid:{uuid}"
+    estado = ficheiro_satelite.stat()
+    chave = (str(ficheiro_satelite.resolve()), estado.st_size, estado.st_mtime_ns)
+    if chave not in _md5_ficheiros:
+        _md5_ficheiros[chave] = md5_do_ficheiro(ficheiro_satelite)
+    return f"md5:{_md5_ficheiros[chave]}"
+
+
+# Cria a chave de uma banda recortada a partir dos produtos usados no mosaico, da banda,
+# do hash da shapefile de recorte, do sistema de referência de destino, da resolução e da forma de leitura
+# (do ZIP ou extraída, numa só passagem pela pilha de bandas ou banda a banda), que mudam o tratamento do nodata
+# Os produtos não são ordenados: nas sobreposições do mosaico prevalece o último, por isso a ordem muda o resultado
+def chave_recorte(ficheiros_satelite, banda, hash_shapefile, epsg, resolucao, uma_passagem, ler_do_zip):
+    dados = {
+        "produtos": [identificador_produto(ficheiro) for ficheiro in ficheiros_satelite],
+        "banda": banda,
+        "recorte": hash_shapefile,
+        "epsg": epsg,
+        "resolucao": resolucao,
+        "uma_passagem": bool(uma_passagem),
+        "ler_do_zip": bool(ler_do_zip),
+    }
+    return hashlib.sha256(json.dumps(dados, sort_keys=True).encode()).hexdigest()
+
+
+# Devolve o caminho da banda recortada guardada na cache, ou None se ainda não existir
+# Ao ser usada, a data de modificação é atualizada para que fique como a mais recente (LRU)
+# Com "destino", a banda é ligada (hard link) a esse caminho, normalmente na pasta temporária da execução, e é
+# esse caminho que é devolvido: se outro processo apagar o recorte da cache (limita_tamanho), a execução
+# continua a ter o ficheiro. Se o recorte desaparecer antes de ser ligado, devolve None e a banda é recortada de novo
+def obtem(chave, destino=None):
+    caminho = pasta_cache / f"{chave}.tif"
+    try:
+        os.utime(caminho)
+        if destino is None:
+            return caminho
+        try:
+            os.link(caminho, destino)
+        except OSError as erro:
+            if isinstance(erro, FileNotFoundError):
+                raise
+            # sistema de ficheiros sem hard links ou noutro disco
+            shutil.copyfile(caminho, destino)
+    except FileNotFoundError:
+        return None
+    return Path(destino)
+
+
+# Copia a banda 1 do ficheiro recortado para a cache e devolve o caminho na cache
+# A cópia é feita para um ficheiro temporário e só depois renomeada, para que outra execução nunca leia um ficheiro incompleto
+def guarda(chave, ficheiro_recortado):
+    pasta_cache.mkdir(exist_ok=True)
+    caminho = pasta_cache / f"{chave}.tif"
+    caminho_temp = pasta_cache / f"{chave}.{os.getpid()}.tmp.tif"
+    gdal.Translate(
+        str(caminho_temp),
+        str(ficheiro_recortado),
+        format="GTiff",
+        bandList=[1],
+        creationOptions=["TILED=YES", "COMPRESS=DEFLATE", "PREDICTOR=2"],
+    )
+    os.replace(caminho_temp, caminho)
+    return caminho
+
+
+# Apaga os recortes usados há mais tempo até a cache ficar abaixo do tamanho máximo
+def limita_tamanho(tamanho_maximo_mb=TAMANHO_MAXIMO_CACHE_MB):
+    if not pasta_cache.exists():
+        return
+    # Outro processo pode estar a limitar a cache ao mesmo tempo e apagar ficheiros entre a listagem e o stat
+    ficheiros = []
+    for caminho in pasta_cache.glob("*.tif"):
+        if ".tmp." in caminho.name:
+            continue
+        try:
+            ficheiros.append((caminho.stat(), caminho))
+        except FileNotFoundError:
+            pass
+    ficheiros.sort(key=lambda item: item[0].st_mtime)
+    tamanho_total = sum(estado.st_size for estado, _ in ficheiros)
+    limite = tamanho_maximo_mb * 1024 * 1024
+    for estado, caminho in ficheiros:
+        if tamanho_total <= limite:
+            break
+        caminho.unlink(missing_ok=True)
+        tamanho_total -= estado.st_size
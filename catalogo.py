@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Catálogo local dos produtos Sentinel2 já descarregados, numa base de dados SQLite em modo WAL:
+# procura por uuid pela chave primária (sem ler um ficheiro de texto a cada imagem da lista) e
+# registos atómicos, que podem ser feitos por várias threads e processos ao mesmo tempo
+
+# Importar as bibliotecas
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+# Caminho da pasta das imagens e do catálogo; o antigo ficheiro de texto é importado uma única vez
+pasta_imagens_satelite = Path(__file__).parent.parent / "imagens"
+ficheiro_catalogo = pasta_imagens_satelite / "catalogo.sqlite"
+ficheiro_texto_antigo = pasta_imagens_satelite / "ficheiros_descarregados.txt"
+
+# Tempo (em segundos) que uma escrita espera enquanto outro processo está a escrever
+TEMPO_ESPERA_ESCRITA = 30
+
+# Uma ligação por thread e por ficheiro de catálogo (as ligações do sqlite3 não devem ser partilhadas entre threads)
+_ligacoes = threading.local()
+
+_TABELAS = """
+CREATE TABLE IF NOT EXISTS produtos (
+    uuid TEXT PRIMARY KEY,
+    ficheiro TEXT NOT NULL,
+    titulo TEXT,
+    tamanho INTEGER,
+    md5 TEXT,
+    footprint TEXT,
+    data_aquisicao TEXT,
+    cobertura_nuvens REAL,
+    registado_em TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS produtos_data_aquisicao ON produtos (data_aquisicao);
+CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+
+# Devolve a ligação desta thread ao catálogo, criando as tabelas e importando o ficheiro de texto na primeira vez
+def ligacao(caminho=None):
+    caminho = Path(caminho or ficheiro_catalogo)
+    ligacoes = getattr(_ligacoes, "abertas", None)
+    if ligacoes is None:
+        ligacoes = _ligacoes.abertas = {}
+    if caminho not in ligacoes:
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(caminho), timeout=TEMPO_ESPERA_ESCRITA)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        with con:
+            con.executescript(_TABELAS)
+        ligacoes[caminho] = con
+        importa_ficheiro_texto(ficheiro_texto_antigo if caminho == ficheiro_catalogo else None, con)
+    return ligacoes[caminho]
+
+
+# Importa (uma única vez) as linhas "uuid=nome do ficheiro" do antigo ficheiros_descarregados.txt
+def importa_ficheiro_texto(caminho_texto, con):
+    if caminho_texto is None or not Path(caminho_texto).exists():
+        return 0
+    with con:
+        # BEGIN IMMEDIATE: só um processo faz a importação; os outros esperam e encontram-na já feita
+        con.execute("BEGIN IMMEDIATE")
+        if con.execute("SELECT 1 FROM meta WHERE chave = 'importado_texto'").fetchone():
+            return 0
+        importados = 0
+        for linha in Path(caminho_texto).read_text().split("\n"):
+            if "=" not in linha:
+                continue
+            uuid, nome_ficheiro = linha.split("=", 1)
+            ficheiro = Path(caminho_texto).parent / nome_ficheiro
+            con.execute(
+                "INSERT OR IGNORE INTO produtos (uuid, ficheiro, titulo, tamanho, registado_em) VALUES (?, ?, ?, ?, ?)",
+                (uuid, str(ficheiro), ficheiro.stem, ficheiro.stat().st_size if ficheiro.exists() else None,
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+            importados += 1
+        con.execute("INSERT INTO meta (chave, valor) VALUES ('importado_texto', ?)", (str(importados),))
+    return importados
+
+
+# Regista (ou atualiza) o produto com o uuid numa única transação
+def regista(uuid, ficheiro, titulo=None, tamanho=None, md5=None, footprint=None, data_aquisicao=None,
+            cobertura_nuvens=None, caminho=None):
+    ficheiro = Path(ficheiro)
+    if tamanho is None and ficheiro.exists():
+        tamanho = ficheiro.stat().st_size
+    if isinstance(data_aquisicao, datetime):
+        data_aquisicao = data_aquisicao.isoformat()
+    con = ligacao(caminho)
+    with con:
+        con.execute(
+            "INSERT OR REPLACE INTO produtos "
+            "(uuid, ficheiro, titulo, tamanho, md5, footprint, data_aquisicao, cobertura_nuvens, registado_em) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (uuid, str(ficheiro), titulo or ficheiro.stem, tamanho, md5, footprint, data_aquisicao,
+             cobertura_nuvens, datetime.now().isoformat(timespec="seconds")),
+        )
+
+
+# Devolve o registo do produto (sqlite3.Row) ou None se não estiver no catálogo
+def produto(uuid, caminho=None):
+    return ligacao(caminho).execute("SELECT * FROM produtos WHERE uuid = ?", (uuid,)).fetchone()
+
+
+# Devolve o caminho do ficheiro do produto, se está no catálogo e o ficheiro ainda existe
+def ficheiro_do_produto(uuid, caminho=None):
+    registo = produto(uuid, caminho)
+    if registo is None:
+        return None
+    ficheiro = Path(registo["ficheiro"])
+    return ficheiro if ficheiro.exists() else None
+
+
+# Devolve o uuid do produto gravado no ficheiro, ou None se o ficheiro não estiver no catálogo
+def uuid_do_ficheiro(ficheiro, caminho=None):
+    registo = ligacao(caminho).execute(
+        "SELECT uuid FROM produtos WHERE ficheiro IN (?, ?)", (str(ficheiro), str(Path(ficheiro).resolve()))
+    ).fetchone()
+    return registo["uuid"] if registo is not None else None
+
+
+# Remove o produto do catálogo (ex: o ficheiro foi apagado)
+def remove(uuid, caminho=None):
+    con = ligacao(caminho)
+    with con:
+        con.execute("DELETE FROM produtos WHERE uuid = ?", (uuid,))
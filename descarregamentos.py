@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Gestor de downloads dos produtos Sentinel2: vários produtos em simultâneo (com um limite), retoma de
+# downloads interrompidos (pedidos HTTP com "Range"), verificação do MD5 e do tamanho indicados nos
+# metadados do produto e progresso por produto. Só usa a biblioteca padrão, por isso pode ser testado
+# com um servidor HTTP local (ex: http.server) no lugar do Copernicus
+#
+# No download parcial, o ZIP do produto é lido remotamente (também com pedidos "Range"): do diretório
+# central do ZIP obtém-se a lista de ficheiros, e só as bandas .jp2 necessárias são descarregadas para
+# um ZIP local pequeno, com os mesmos caminhos internos do SAFE
+
+# Importar as bibliotecas
+import base64
+import hashlib
+import io
+import os
+import shutil
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Número de produtos descarregados ao mesmo tempo (o Copernicus limita os downloads em simultâneo por utilizador)
+DOWNLOADS_SIMULTANEOS = 2
+
+# Número de tentativas de cada produto; cada tentativa continua a partir do que já foi descarregado
+TENTATIVAS_DOWNLOAD = 3
+
+# Tamanho (em bytes) de cada bloco lido da ligação e escrito no ficheiro
+TAMANHO_BLOCO_DOWNLOAD = 1024 * 1024
+
+# Sufixo dos ficheiros ainda incompletos, o mesmo do sentinelsat
+SUFIXO_INCOMPLETO = ".incomplete"
+
+# Sufixo dos ZIP com só algumas bandas, para não se confundirem com o produto completo
+SUFIXO_PARCIAL = "_bandas"
+
+
+# Erro de verificação do produto descarregado (MD5 ou tamanho diferentes dos metadados)
+class ErroVerificacao(Exception):
+    pass
+
+
+# Calcula o MD5 de um ficheiro, lendo-o por blocos
+def md5_do_ficheiro(caminho, tamanho_bloco=TAMANHO_BLOCO_DOWNLOAD):
+    md5 = hashlib.md5()
+    with open(caminho, "rb") as ficheiro:
+        for bloco in iter(lambda: ficheiro.read(tamanho_bloco), b""):
+            md5.update(bloco)
+    return md5.hexdigest()
+
+
+# Pedido HTTP com a autenticação (utilizador, palavra-passe) do Copernicus, se indicada
+def cria_pedido(url, autenticacao=None):
+    pedido = urllib.request.Request(url)
+    if autenticacao is not None:
+        credenciais = base64.b64encode(":".join(autenticacao).encode()).decode()
+        pedido.add_header("Authorization", f"Basic {credenciais}")
+    return pedido
+
+
+# Descarrega o url para "destino", continuando o ficheiro ".incomplete" de uma tentativa anterior se existir
+# progresso(bytes_descarregados, tamanho_total) é chamado a cada bloco; no fim verifica o tamanho e o MD5 (se indicados)
+def descarrega_ficheiro(url, destino, tamanho=None, md5=None, autenticacao=None, progresso=None,
+                        tamanho_bloco=TAMANHO_BLOCO_DOWNLOAD, timeout=60):
+    destino = Path(destino)
+    incompleto = destino.with_name(destino.name + SUFIXO_INCOMPLETO)
+    ja_descarregado = incompleto.stat().st_size if incompleto.exists() else 0
+    if tamanho is not None and ja_descarregado > tamanho:
+        incompleto.unlink()
+        ja_descarregado = 0
+
+    pedido = cria_pedido(url, autenticacao)
+    if ja_descarregado and ja_descarregado != tamanho:
+        pedido.add_header("Range", f"bytes={ja_descarregado}-")
+
+    if tamanho is None or ja_descarregado < tamanho:
+        try:
+            resposta = urllib.request.urlopen(pedido, timeout=timeout)
+        except urllib.error.HTTPError as erro:
+            # 416: o ficheiro incompleto já tem todos os bytes (o tamanho não era conhecido)
+            if erro.code != 416:
+                raise
+            resposta = None
+        if resposta is not None:
+            with resposta:
+                # Se o servidor não aceitar o "Range" devolve o ficheiro todo (200) e começa-se do início
+                modo = "ab" if resposta.status == 206 else "wb"
+                if modo == "wb":
+                    ja_descarregado = 0
+                if tamanho is None and resposta.headers.get("Content-Length"):
+                    tamanho = ja_descarregado + int(resposta.headers["Content-Length"])
+                with open(incompleto, modo) as ficheiro:
+                    for bloco in iter(lambda: resposta.read(tamanho_bloco), b""):
+                        ficheiro.write(bloco)
+                        ja_descarregado += len(bloco)
+                        if progresso is not None:
+                            progresso(ja_descarregado, tamanho)
+
+    if tamanho is not None and ja_descarregado != tamanho:
+        raise ErroVerificacao(f"{destino.name}: descarregados {ja_descarregado} de {tamanho} bytes")
+    if md5 is not None and md5_do_ficheiro(incompleto).lower() != md5.lower():
+        # Um ficheiro corrompido não pode ser retomado: apaga-se para a próxima tentativa começar do início
+        incompleto.unlink()
+        raise ErroVerificacao(f"{destino.name}: o MD5 não corresponde ao dos metadados do produto")
+    os.replace(incompleto, destino)
+    return destino
+
+
+# Ficheiro remoto só de leitura, em que cada leitura é um pedido HTTP com "Range"; permite ao zipfile
+# ler o diretório central e os ficheiros escolhidos sem descarregar o ZIP inteiro
+class FicheiroHttp(io.RawIOBase):
+
+    def __init__(self, url, autenticacao=None, timeout=60):
+        self.url = url
+        self.autenticacao = autenticacao
+        self.timeout = timeout
+        self.posicao = 0
+        self.bytes_lidos = 0
+        # O tamanho total vem no cabeçalho Content-Range da resposta ao pedido do primeiro byte
+        with self._abre(0, 0) as resposta:
+            if resposta.status != 206:
+                raise OSError(f"O servidor não aceita pedidos parciais (Range) para {url}")
+            self.tamanho = int(resposta.headers["Content-Range"].rsplit("/", 1)[1])
+
+    def _abre(self, inicio, fim):
+        pedido = cria_pedido(self.url, self.autenticacao)
+        pedido.add_header("Range", f"bytes={inicio}-{fim}")
+        return urllib.request.urlopen(pedido, timeout=self.timeout)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.posicao
+
+    def seek(self, deslocamento, origem=io.SEEK_SET):
+        if origem == io.SEEK_CUR:
+            deslocamento += self.posicao
+        elif origem == io.SEEK_END:
+            deslocamento += self.tamanho
+        self.posicao = deslocamento
+        return self.posicao
+
+    def readinto(self, destino):
+        n_bytes = min(len(destino), self.tamanho - self.posicao)
+        if n_bytes <= 0:
+            return 0
+        with self._abre(self.posicao, self.posicao + n_bytes - 1) as resposta:
+            dados = resposta.read(n_bytes)
+        destino[:len(dados)] = dados
+        self.posicao += len(dados)
+        self.bytes_lidos += len(dados)
+        return len(dados)
+
+
+# Descarrega do ZIP remoto só os ficheiros escolhidos por escolhe(zipfile) -> [nomes], para um ZIP local
+# "destino" com os mesmos caminhos internos. Cada ficheiro é guardado numa pasta ".parcial" à medida que
+# termina, para que uma nova tentativa continue a partir dos que já estão completos. O zipfile verifica
+# o CRC32 de cada ficheiro no fim da leitura
+def descarrega_membros_zip(url, destino, escolhe, autenticacao=None, progresso=None,
+                           tamanho_bloco=TAMANHO_BLOCO_DOWNLOAD):
+    destino = Path(destino)
+    pasta_parcial = destino.with_name(destino.name + ".parcial")
+    remoto = io.BufferedReader(FicheiroHttp(url, autenticacao), buffer_size=tamanho_bloco)
+    with zipfile.ZipFile(remoto) as dados:
+        membros = [dados.getinfo(nome) for nome in escolhe(dados)]
+        total = sum(membro.file_size for membro in membros)
+        descarregado = 0
+        for membro in membros:
+            local = pasta_parcial / membro.filename
+            if not local.exists() or local.stat().st_size != membro.file_size:
+                local.parent.mkdir(parents=True, exist_ok=True)
+                temporario = local.with_name(local.name + SUFIXO_INCOMPLETO)
+                with dados.open(membro) as origem, open(temporario, "wb") as saida:
+                    for bloco in iter(lambda: origem.read(tamanho_bloco), b""):
+                        saida.write(bloco)
+                        if progresso is not None:
+                            progresso(descarregado + saida.tell(), total)
+                os.replace(temporario, local)
+            descarregado += membro.file_size
+            if progresso is not None:
+                progresso(descarregado, total)
+
+    # As bandas .jp2 já estão comprimidas: o ZIP local é criado sem compressão
+    incompleto = destino.with_name(destino.name + SUFIXO_INCOMPLETO)
+    with zipfile.ZipFile(incompleto, "w", zipfile.ZIP_STORED) as saida:
+        for membro in membros:
+            saida.write(pasta_parcial / membro.filename, membro.filename)
+    os.replace(incompleto, destino)
+    shutil.rmtree(pasta_parcial)
+    return destino
+
+
+class GestorDescarregamentos:
+
+    # api: SentinelAPI do sentinelsat, usada para obter os metadados (url, tamanho, MD5) e as credenciais
+    # Sem api, os metadados têm de ser indicados em "descarrega" (ex: para testar com um servidor local)
+    # escolhe_membros: se indicado, faz o download parcial só dos ficheiros do ZIP que escolhe_membros(zipfile) devolve
+    def __init__(self, pasta, api=None, n_simultaneos=DOWNLOADS_SIMULTANEOS, tentativas=TENTATIVAS_DOWNLOAD,
+                 escolhe_membros=None):
+        self.pasta = Path(pasta)
+        self.api = api
+        self.escolhe_membros = escolhe_membros
+        self.n_simultaneos = n_simultaneos
+        self.tentativas = tentativas
+        self.progresso = {}
+        self._trinco = threading.Lock()
+
+    # Devolve o título, o url, o tamanho e o MD5 do produto, a partir da API do Copernicus,
+    # e ainda o footprint, a data de aquisição e a cobertura de nuvens, para o catálogo local
+    def metadados(self, uuid):
+        odata = self.api.get_product_odata(uuid, full=True)
+        return {
+            "title": odata["title"],
+            "url": odata["url"],
+            "size": odata.get("size"),
+            "md5": odata.get("md5"),
+            "footprint": odata.get("footprint"),
+            "data_aquisicao": odata.get("Sensing start"),
+            "cobertura_nuvens": odata.get("Cloud cover percentage"),
+        }
+
+    def _autenticacao(self):
+        sessao = getattr(self.api, "session", None)
+        return getattr(sessao, "auth", None)
+
+    # Descarrega um produto, com várias tentativas; devolve o caminho do ficheiro ZIP
+    def descarrega_produto(self, uuid, metadados=None, progresso=None):
+        metadados = metadados or self.metadados(uuid)
+        if self.escolhe_membros is not None:
+            destino = self.pasta / f"{metadados['title']}{SUFIXO_PARCIAL}.zip"
+            if destino.exists():
+                return destino
+        else:
+            destino = self.pasta / f"{metadados['title']}.zip"
+            if destino.exists() and (metadados.get("size") is None or destino.stat().st_size == metadados["size"]):
+                return destino
+
+        def _progresso(descarregado, total):
+            with self._trinco:
+                self.progresso[uuid] = (descarregado, total)
+            if progresso is not None:
+                progresso(uuid, descarregado, total)
+
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        for tentativa in range(1, self.tentativas + 1):
+            try:
+                if self.escolhe_membros is not None:
+                    return descarrega_membros_zip(
+                        metadados["url"], destino, self.escolhe_membros, self._autenticacao(), _progresso
+                    )
+                return descarrega_ficheiro(
+                    metadados["url"], destino, metadados.get("size"), metadados.get("md5"),
+                    self._autenticacao(), _progresso,
+                )
+            except (OSError, ErroVerificacao, zipfile.BadZipFile) as erro:
+                print(f"Download de {metadados['title']} falhou (tentativa {tentativa} de {self.tentativas}): {erro}")
+                if tentativa == self.tentativas:
+                    raise
+
+    # Descarrega vários produtos em simultâneo (no máximo n_simultaneos); devolve {uuid: caminho}
+    # produtos: lista de uuid, ou dicionário {uuid: metadados}
+    # progresso(uuid, bytes_descarregados, tamanho_total) é chamado a partir das threads dos downloads
+    # concluido(uuid, caminho, metadados) é chamado logo que cada produto termina, para que fique registado mesmo que outro falhe
+    def descarrega(self, produtos, progresso=None, concluido=None):
+        if not isinstance(produtos, dict):
+            produtos = {uuid: None for uuid in produtos}
+        # Todos os produtos contam para o progresso total desde o início, mesmo os que ainda estão à espera
+        with self._trinco:
+            for uuid in produtos:
+                self.progresso.setdefault(uuid, (0, None))
+
+        def _descarrega(uuid, metadados):
+            metadados = metadados or self.metadados(uuid)
+            caminho = self.descarrega_produto(uuid, metadados, progresso)
+            with self._trinco:
+                self.progresso[uuid] = (1, 1)
+            if concluido is not None:
+                if self.escolhe_membros is not None:
+                    # o tamanho e o MD5 dos metadados são os do produto completo, não os do ZIP parcial
+                    metadados = dict(metadados, size=None, md5=None)
+                concluido(uuid, caminho, metadados)
+            return caminho
+
+        with ThreadPoolExecutor(max_workers=self.n_simultaneos) as executor:
+            futuros = {uuid: executor.submit(_descarrega, uuid, metadados) for uuid, metadados in produtos.items()}
+            return {uuid: futuro.result() for uuid, futuro in futuros.items()}
+
+    # Progresso total (0 a 100) de todos os produtos pedidos, a média da fração descarregada de cada produto
+    # Os produtos à espera (ou de tamanho ainda desconhecido) contam com 0 e os já existentes com 1, por isso o
+    # progresso não recua quando começa um produto novo; no download parcial o tamanho só se sabe quando começa
+    def percentagem(self):
+        with self._trinco:
+            valores = list(self.progresso.values())
+        if not valores:
+            return 0
+        fracoes = [min(descarregado / tamanho, 1) if tamanho else 0 for descarregado, tamanho in valores]
+        return int(100 * sum(fracoes) / len(fracoes))
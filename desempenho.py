@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Medição do desempenho de cada fase do processo com produtos sintéticos (ver safe_sintetico.py):
+# extração e descodificação das bandas, recorte, composições RGB, cálculo dos índices com o filtro e a
+# reclassificação (processa.calcula_blocos, com os tempos de cada passo) e conversão em vetorial.
+# Cada fase chama as mesmas funções do processo, por isso as máscaras medidas são as do processo.
+# Para cada fase mede o tempo e o pico de memória, e no fim compara as máscaras das áreas ardidas com as
+# de referência, para garantir que uma otimização não muda os resultados.
+# Corre também o processo completo (processa.processa), normal e no modo rápido (triagem e refinamento, ver
+# refinamento.py), e verifica que as shapefiles do modo rápido diferem das do processo normal em menos de
+# refinamento.TOLERANCIA_REFINAMENTO dos pixeis ardidos
+#
+# Exemplo: python -m sentinel desempenho --colunas 2048 --linhas 2048 --quadriculas 2
+
+# Importar as bibliotecas
+import argparse
+import hashlib
+import json
+import shutil
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import osgeo.gdal as gdal
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from sentinel import processa, refinamento, safe_sintetico
+from sentinel.armazem_bandas import ArmazemBandas
+from sentinel.filtros import FILTROS, FILTRO_RECLASSIFICACAO
+from sentinel.indices import INDICES, bandas_necessarias
+from sentinel.instrumentacao import Instrumentacao
+from sentinel.mascara_scl import BANDA_SCL
+
+# Pasta dos produtos sintéticos, dos relatórios e das máscaras de referência
+pasta_desempenho = Path(__file__).parent.parent / "desempenho"
+
+# Índices calculados na medição (com limiar, para haver máscaras a comparar)
+INDICES_DESEMPENHO = ("ndvi", "nbr")
+
+
+# Pico de memória residente do processo (MB), desde o início; no Linux o ru_maxrss vem em KB
+def pico_memoria_processo():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Executa funcao(*args) e devolve (resultado, medição): tempo, pico de memória alocada pelo Python e pelo numpy
+# durante a fase (tracemalloc) e pico de memória residente do processo no fim da fase
+def mede(nome, funcao, *args, **kwargs):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        resultado = funcao(*args, **kwargs)
+    finally:
+        duracao = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    medicao = {
+        "fase": nome,
+        "segundos": round(duracao, 3),
+        "pico_python_mb": round(pico / 2**20, 1),
+        "pico_processo_mb": pico_memoria_processo(),
+    }
+    print(f"{nome:<16} {medicao['segundos']:>8.2f} s {medicao['pico_python_mb']:>9.1f} MB")
+    return resultado, medicao
+
+
+# Extrai as bandas dos produtos como o processo (normalmente só abre os .jp2 dentro do ZIP) e descodifica-as
+# por inteiro, para que a fase meça também a descodificação, que no processo acontece dentro do recorte
+# Devolve {banda: [checksum de cada imagem]}
+def _extrai(zips, bandas, pasta, resolucao=None):
+    imagens_de_bandas = processa.extrai_bandas_do_zip_do_satelite(zips, bandas, pasta, resolucao=resolucao)
+    return {
+        banda: [gdal.Open(str(imagem)).GetRasterBand(1).Checksum() for imagem in imagens]
+        for banda, imagens in imagens_de_bandas.items()
+    }
+
+
+# Calcula os índices, o filtro e a reclassificação com processa.calcula_blocos sobre um ArmazemBandas, como o processo
+# Devolve ({índice: caminho /vsimem/ da imagem reclassificada}, extensão dos blocos válidos, resumo dos passos)
+def _indices(fich_recortados, indices, filtro, usar_scl, nome):
+    bandas = bandas_necessarias(indices)
+    referencia = processa.obtem_georreferencia(fich_recortados["pre"][bandas[0]])
+    limiares = {indice: INDICES[indice]["limiar"] for indice in indices}
+    caminhos = {indice: f"/vsimem/desempenho_{nome}_{indice}.tif" for indice in indices}
+    reclassificadas = {
+        indice: processa.cria_imagem_geo(
+            caminho, referencia, tipo=gdal.GDT_Byte, nodata=None, opcoes=["SPARSE_OK=TRUE", "TILED=YES"]
+        )
+        for indice, caminho in caminhos.items()
+    }
+    janelas = list(processa.janelas_de_blocos(
+        referencia["colunas"], referencia["linhas"], processa.TAMANHO_BLOCO, processa.HALO_FILTRO
+    ))
+    instrumentacao = Instrumentacao()
+    armazem = ArmazemBandas(fich_recortados)
+    try:
+        _, extensao = processa.calcula_blocos(
+            armazem, indices, bandas, limiares, reclassificadas, {}, janelas, filtro=filtro, usar_scl=usar_scl,
+            instrumentacao=instrumentacao,
+        )
+    finally:
+        armazem.fecha()
+    for imagem in reclassificadas.values():
+        imagem.FlushCache()
+    return caminhos, extensao, instrumentacao.resumo()
+
+
+# Lê as máscaras das imagens reclassificadas e apaga-as da memória do GDAL
+def _le_mascaras(caminhos):
+    mascaras = {}
+    for indice, caminho in caminhos.items():
+        mascaras[indice] = gdal.Open(caminho).GetRasterBand(1).ReadAsArray()
+        gdal.Unlink(caminho)
+    return mascaras
+
+
+def _poligoniza(caminhos, extensao, pasta):
+    janela = processa.janela_da_extensao(extensao)
+    return {
+        indice: processa.poligoniza(caminho, Path(pasta) / f"desempenho_{indice}.shp", janela=janela)
+        for indice, caminho in caminhos.items()
+    }
+
+
+# Máscara (0/1) com os polígonos da camada vetorial na grelha indicada
+# Os polígonos do gdal.Polygonize seguem as margens dos pixeis, por isso a máscara é a imagem reclassificada
+def _rasteriza(caminho_vetorial, grelha):
+    caminho = f"/vsimem/desempenho_rasterizada_{Path(caminho_vetorial).stem}.tif"
+    imagem = processa.cria_imagem_geo(caminho, grelha, tipo=gdal.GDT_Byte, nodata=None)
+    vetorial = gdal.OpenEx(str(caminho_vetorial), gdal.OF_VECTOR)
+    gdal.RasterizeLayer(imagem, [1], vetorial.GetLayer(), burn_values=[1])
+    mascara = imagem.GetRasterBand(1).ReadAsArray()
+    imagem = vetorial = None
+    gdal.Unlink(caminho)
+    return mascara
+
+
+# Corre o processo completo (processa.processa), normal ou no modo rápido, sobre os produtos sintéticos
+# Devolve ({índice: máscara na grelha de 10 m, a partir da shapefile criada}, relatório da execução)
+# Não toca no estado do processo real: sem a cache dos recortes (para medir sempre o recorte), com os resultados
+# e o relatório na pasta indicada e sem atualizar os pesos das fases da barra de progresso
+def _processo(zips_pre, zips_pos, shapefile, indices, filtro, modo_rapido, pasta):
+    prefixo = f"desempenho_{'rapido' if modo_rapido else 'normal'}"
+    grelha = refinamento.grelha_do_recorte(shapefile)
+    vetoriais = processa.processa(
+        zips_pre, zips_pos, prefixo, shapefile, indices=indices, filtro=filtro, relatorio=True, modo_rapido=modo_rapido,
+        usar_cache=False, pasta_saida=pasta, aprende_pesos=False,
+    )
+    mascaras = {indice: _rasteriza(caminho, grelha) for indice, caminho in vetoriais.items()}
+    relatorio = json.loads((Path(pasta) / f"{prefixo}_relatorio.json").read_text(encoding="utf-8"))
+    return mascaras, relatorio
+
+
+# Fração da grelha de 10 m refinada no modo rápido, a partir das janelas registadas no relatório da execução
+def area_refinada(relatorio):
+    refinada = sum(
+        registo["colunas"] * registo["linhas"] for registo in relatorio["fases"] if registo["fase"] == "refinamento"
+    )
+    return refinada / max(relatorio["colunas"] * relatorio["linhas"], 1)
+
+
+# Fração dos pixeis ardidos do processo normal em que a máscara do modo rápido é diferente
+def diferenca_modo_rapido(mascaras, mascaras_rapido):
+    diferencas = {}
+    for indice, mascara in mascaras.items():
+        rapida = mascaras_rapido[indice]
+        if rapida.shape != mascara.shape:
+            diferencas[indice] = 1.0
+            continue
+        diferencas[indice] = float(np.count_nonzero(rapida != mascara) / max(np.count_nonzero(mascara), 1))
+    return diferencas
+
+
+# Identificador dos parâmetros do cenário, usado no nome das máscaras de referência
+def assinatura_cenario(colunas, linhas, n_quadriculas, formato, semente):
+    return f"{colunas}x{linhas}_q{n_quadriculas}_{formato}_s{semente}"
+
+
+# Compara as máscaras com as de referência (guardadas na primeira execução ou com atualizar=True)
+# Devolve {índice: True/False}
+def verifica_mascaras(mascaras, caminho_referencia, atualizar=False):
+    if atualizar or not caminho_referencia.exists():
+        np.savez_compressed(caminho_referencia, **mascaras)
+        print(f"Máscaras de referência guardadas em {caminho_referencia}")
+        return {indice: True for indice in mascaras}
+    referencia = np.load(caminho_referencia)
+    return {
+        indice: indice in referencia.files and np.array_equal(referencia[indice], mascara)
+        for indice, mascara in mascaras.items()
+    }
+
+
+# Cria o cenário sintético (se ainda não existir), mede cada fase e grava o relatório em JSON
+# Devolve o relatório; "mascaras_iguais" é False se alguma máscara mudou em relação à referência
+def executa(colunas=2048, linhas=2048, n_quadriculas=1, formato="gtiff", semente=0, filtro=FILTRO_RECLASSIFICACAO,
+            atualizar_referencia=False, pasta=pasta_desempenho):
+    pasta = Path(pasta)
+    assinatura = assinatura_cenario(colunas, linhas, n_quadriculas, formato, semente)
+    # Os produtos sintéticos de cada cenário são criados uma vez e reaproveitados nas execuções seguintes
+    zips_pre, zips_pos, shapefile = safe_sintetico.cria_cenario(
+        pasta / assinatura, colunas, linhas, n_quadriculas, formato, semente
+    )
+    temporarios = pasta / "temporarios"
+    shutil.rmtree(temporarios, ignore_errors=True)
+    temporarios.mkdir(parents=True)
+
+    # As mesmas bandas do processo: as dos índices (e a SCL, se os produtos a tiverem) e as das composições RGB
+    usar_scl = processa.produtos_tem_banda(zips_pre, BANDA_SCL) and processa.produtos_tem_banda(zips_pos, BANDA_SCL)
+    bandas_pre = bandas_necessarias(INDICES_DESEMPENHO) + ([BANDA_SCL] if usar_scl else [])
+    bandas_pos = bandas_pre + sorted({2, 3, 4, 8, 12} - set(bandas_pre))
+    medicoes = []
+    try:
+        _, medicao = mede("extracao", _extrai, zips_pos, bandas_pos, temporarios)
+        medicoes.append(medicao)
+        # Sem a cache dos recortes, para medir sempre o recorte
+        fich_recortados, medicao = mede(
+            "recorte", processa.realiza_recorte, zips_pre, zips_pos, shapefile, bandas_pre, bandas_pos, temporarios,
+            usar_cache=False,
+        )
+        medicoes.append(medicao)
+        referencia = processa.obtem_georreferencia(fich_recortados["pre"][bandas_pre[0]])
+        _, medicao = mede(
+            "composicao_rgb", processa.composicao_rgb, fich_recortados["pos"], f"desempenho_{assinatura}", referencia,
+            pasta_saida=temporarios,
+        )
+        medicoes.append(medicao)
+        (caminhos, extensao, passos_indices), medicao = mede(
+            "indices", _indices, fich_recortados, INDICES_DESEMPENHO, filtro, usar_scl, "processo"
+        )
+        medicao["passos"] = passos_indices
+        medicoes.append(medicao)
+        _, medicao = mede("poligonizacao", _poligoniza, caminhos, extensao, temporarios)
+        medicoes.append(medicao)
+        mascaras = _le_mascaras(caminhos)
+        # O filtro por contagem tem de dar exatamente as mesmas máscaras que o filtro mediana
+        outro_filtro = "mediana" if filtro != "mediana" else "contagem"
+        mascaras_outro_filtro = _le_mascaras(
+            _indices(fich_recortados, INDICES_DESEMPENHO, outro_filtro, usar_scl, outro_filtro)[0]
+        )
+        (mascaras_normal, _), medicao = mede(
+            "processo", _processo, zips_pre, zips_pos, shapefile, INDICES_DESEMPENHO, filtro, False, temporarios
+        )
+        medicoes.append(medicao)
+        (mascaras_rapido, relatorio_rapido), medicao = mede(
+            "modo_rapido", _processo, zips_pre, zips_pos, shapefile, INDICES_DESEMPENHO, filtro, True, temporarios
+        )
+        medicoes.append(medicao)
+    finally:
+        shutil.rmtree(temporarios, ignore_errors=True)
+
+    iguais = verifica_mascaras(mascaras, pasta / f"referencia_{assinatura}.npz", atualizar_referencia)
+    equivalentes = {
+        indice: np.array_equal(mascara, mascaras_outro_filtro[indice]) for indice, mascara in mascaras.items()
+    }
+    diferencas_rapido = diferenca_modo_rapido(mascaras_normal, mascaras_rapido)
+    # As máscaras medidas fase a fase têm de ser as mesmas do processo completo
+    iguais_processo = {
+        indice: np.array_equal(mascara, mascaras_normal[indice]) for indice, mascara in mascaras.items()
+    }
+    relatorio = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "cenario": assinatura,
+        "gdal": gdal.__version__,
+        "filtro": filtro,
+        "mascara_scl": usar_scl,
+        "fases": medicoes,
+        # O processo completo e o modo rápido repetem as fases de recorte a poligonização, por isso não entram no total
+        "total_segundos": round(
+            sum(medicao["segundos"] for medicao in medicoes if medicao["fase"] not in ("processo", "modo_rapido")), 3
+        ),
+        "mascaras": {
+            indice: hashlib.sha256(np.ascontiguousarray(mascara).tobytes()).hexdigest()[:16]
+            for indice, mascara in mascaras.items()
+        },
+        "mascaras_iguais": all(iguais.values()),
+        "filtros_equivalentes": all(equivalentes.values()),
+        "mascaras_iguais_ao_processo": all(iguais_processo.values()),
+        "modo_rapido": {
+            "resolucao_triagem": relatorio_rapido["resolucao_triagem"],
+            "area_refinada": round(area_refinada(relatorio_rapido), 4),
+            "diferencas": diferencas_rapido,
+            "dentro_da_tolerancia": all(valor <= refinamento.TOLERANCIA_REFINAMENTO for valor in diferencas_rapido.values()),
+        },
+    }
+    caminho_relatorio = pasta / f"relatorio_{assinatura}_{datetime.now():%Y%m%d%H%M%S}.json"
+    caminho_relatorio.write_text(json.dumps(relatorio, indent=2), encoding="utf-8")
+    print(f"Total {relatorio['total_segundos']:.2f} s - máscaras iguais à referência: {relatorio['mascaras_iguais']}"
+          f" - filtros equivalentes: {relatorio['filtros_equivalentes']}"
+          f" - iguais ao processo completo: {relatorio['mascaras_iguais_ao_processo']}"
+          f" - modo rápido dentro da tolerância: {relatorio['modo_rapido']['dentro_da_tolerancia']}"
+          f" ({relatorio['modo_rapido']['area_refinada']:.1%} da área refinada) - relatório em {caminho_relatorio}")
+    return relatorio
+
+
+# Linha de comandos: python -m sentinel desempenho [--colunas N] [--linhas N] [--quadriculas N] [--formato jp2|gtiff]
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(prog="sentinel desempenho", description="Medição do desempenho com produtos sintéticos")
+    parser.add_argument("--colunas", type=int, default=2048, help="colunas de cada quadrícula a 10 m")
+    parser.add_argument("--linhas", type=int, default=2048, help="linhas de cada quadrícula a 10 m")
+    parser.add_argument("--quadriculas", type=int, default=1, help="número de quadrículas (produtos) por data")
+    parser.add_argument("--formato", choices=sorted(safe_sintetico.FORMATOS_BANDAS), default="gtiff")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--filtro", choices=sorted(FILTROS), default=FILTRO_RECLASSIFICACAO)
+    parser.add_argument("--atualizar-referencia", action="store_true", help="guarda as máscaras como nova referência")
+    parser.add_argument("--pasta", default=str(pasta_desempenho))
+    args = parser.parse_args(argumentos)
+    relatorio = executa(
+        args.colunas, args.linhas, args.quadriculas, args.formato, args.semente, args.filtro,
+        args.atualizar_referencia, args.pasta,
+    )
+    correto = relatorio["mascaras_iguais"] and relatorio["filtros_equivalentes"] and relatorio["mascaras_iguais_ao_processo"]
+    return 0 if correto and relatorio["modo_rapido"]["dentro_da_tolerancia"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Importar as bibliotecas
+import numpy as np
+from scipy import ndimage
+
+# Tamanho da janela do filtro mediana (5x5)
+TAMANHO_FILTRO = 5
+
+
+# Aplica o filtro mediana 5x5 à diferença e reclassifica: 1 onde a mediana é superior ao limiar
+def reclassifica_mediana(diferenca, limiar, tamanho=TAMANHO_FILTRO):
+    return ndimage.median_filter(diferenca, tamanho) > limiar
+
+
+# Dá exatamente o mesmo resultado que reclassifica_mediana, sem ordenar os 25 valores de cada janela:
+# a mediana de n = tamanho x tamanho valores é o valor de ordem n // 2 (a contar de 0), por isso é superior
+# ao limiar se e só se pelo menos n // 2 + 1 valores da janela forem superiores ao limiar.
+# Basta então contar, em cada janela, os pixeis acima do limiar com duas somas 1D (mesma margem "reflect" do median_filter)
+def reclassifica_contagem(diferenca, limiar, tamanho=TAMANHO_FILTRO):
+    acima = (diferenca > limiar).astype(np.uint8)
+    pesos = np.ones(tamanho, dtype=np.uint8)
+    contagem = ndimage.correlate1d(acima, pesos, axis=0, mode="reflect")
+    contagem = ndimage.correlate1d(contagem, pesos, axis=1, mode="reflect")
+    return contagem > (tamanho * tamanho) // 2
+
+
+# Métodos disponíveis para o filtro mediana seguido da reclassificação
+FILTROS = {
+    "mediana": reclassifica_mediana,
+    "contagem": reclassifica_contagem,
+}
+
+# Método usado por defeito
+FILTRO_RECLASSIFICACAO = "contagem"
@@ -12,10 +12,16 @@
 #-------------------------------------------------------------------------------
 
 #Importar bibliotecas
+from datetime import datetime, timedelta
 from pathlib import Path
 
 from sentinelsat import SentinelAPI
 
+from sentinel import cache_pesquisas, catalogo
+from sentinel.descarregamentos import DOWNLOADS_SIMULTANEOS, GestorDescarregamentos
+from sentinel.indices import INDICES
+from sentinel.mascara_scl import BANDA_SCL
+
 # Definição dos caminhos das pastas imagens na raiz e se não existir cria a pasta
 caminhoimagoriginais= Path(__file__).parent.parent
 pasta_imagens_satelite = caminhoimagoriginais / "imagens"
@@ -23,49 +29,102 @@ pasta_imagens_satelite.mkdir(exist_ok=True)
 
 # Ligação API do sentinelsat, em que sentinel_2 é o username e a password
 api = SentinelAPI('sentinel_2', 'sentinel_2', 'https://scihub.copernicus.eu/dhus',show_progressbars=True)
-def lerimagens(bbox,dtin,dtfim, cobertura_maxima=10):
+
+# Critérios fixos das pesquisas; a cobertura de nuvens é filtrada localmente sobre os resultados guardados
+CRITERIOS_PESQUISA = {"platformname": "Sentinel-2", "processinglevel": "Level-2A"}
+
+# Sem ligação ao Copernicus: as pesquisas usam só os resultados já guardados na cache
+MODO_OFFLINE = False
+
+# Download parcial: de cada produto (~1 GB) só são descarregadas as bandas usadas pelo processo, na melhor resolução
+# e na resolução da triagem do modo rápido
+DOWNLOAD_PARCIAL = True
+
+# Bandas usadas pelos índices disponíveis e pelas composições RGB [4 3 2], [8 4 3] e [12 8 4],
+# e a classificação da cena (SCL) usada para mascarar as nuvens, as sombras e a água
+BANDAS_DOWNLOAD_PARCIAL = sorted(
+    {banda for definicao in INDICES.values() for banda in definicao.get("bandas", ())} | {2, 3, 4, 8, 12}
+) + [BANDA_SCL]
+
+
+def lerimagens(bbox,dtin,dtfim, cobertura_maxima=10, offline=None):
      # Pesquisa de imagens do Sentinel 2 comprocessamento do Nivel 2A, pelos limites do Municipio (DICO), no intervalo de tempo e com uma cobertura de nuvem inferior ao defenido que por defeito é 5%
-    products = api.query(bbox, date =(dtin,dtfim), platformname = 'Sentinel-2', cloudcoverpercentage = f'[0 TO {cobertura_maxima}]', processinglevel='Level-2A')
+    # Só são pedidos ao Copernicus os dias do intervalo que ainda não estão na cache (ou já fora de validade)
+    offline = MODO_OFFLINE if offline is None else offline
+    chave = cache_pesquisas.chave_pesquisa(bbox, **CRITERIOS_PESQUISA)
+    if not offline:
+        for dia_inicio, dia_fim in cache_pesquisas.intervalos_em_falta(chave, dtin, dtfim):
+            # do início do primeiro dia ao fim do último dia
+            inicio = datetime.strptime(dia_inicio, "%Y%m%d")
+            fim = datetime.strptime(dia_fim, "%Y%m%d") + timedelta(days=1) - timedelta(milliseconds=1)
+            products = api.query(bbox, date=(inicio, fim), **CRITERIOS_PESQUISA)
+            cache_pesquisas.guarda(chave, dia_inicio, dia_fim, api.to_geojson(products)["features"])
     # Visualizar as imagens disponiveis
-    img=api.to_geojson(products)
+    img = {"type": "FeatureCollection", "features": cache_pesquisas.procura(chave, dtin, dtfim, cobertura_maxima)}
     return(img)
 
 
 # Retorna o caminho para o ficheiro de imagem do satélite, se já está disponível a imagem na pasta "imagens", ou se tem que ser descarregada
 def imagem_ja_descarregada(uuid):
-    fich_descarregados = (pasta_imagens_satelite/ "ficheiros_descarregados.txt")
-    if not fich_descarregados.exists():
-        fich_descarregados.write_text("")
+    return catalogo.ficheiro_do_produto(uuid)
 
-    descarregados = fich_descarregados.read_text().split("\n")
-    for linha in descarregados:
-        if not "=" in linha:
-            continue
-        uuid_imagem, nome_ficheiro = linha.split("=")
-        ficheiro_imagem = pasta_imagens_satelite/nome_ficheiro
-        if uuid_imagem == uuid and ficheiro_imagem.exists():
-            return ficheiro_imagem
-    return None
+
+# Regista no catálogo o ficheiro descarregado do produto com o uuid, com os metadados do produto
+def regista_descarregado(uuid, ficheiro, metadados=None):
+    metadados = metadados or {}
+    catalogo.regista(
+        uuid, ficheiro, titulo=metadados.get("title"), tamanho=metadados.get("size"), md5=metadados.get("md5"),
+        footprint=metadados.get("footprint"), data_aquisicao=metadados.get("data_aquisicao"),
+        cobertura_nuvens=metadados.get("cobertura_nuvens"),
+    )
 
 
-# Descarregar as imagens e adicionar ao ficheiro descarregados.txt o nome da imagem para em seguida visualizar no tkinter
+# Descarregar as imagens e registá-las no catálogo local para em seguida visualizar no tkinter
 def download(uuid, title, update):
+    return bool(download_varios([uuid], update))
+
+
+# Escolhe, dentro do ZIP do produto, os ficheiros .jp2 de cada banda que o processo vai usar (os mesmos que
+# processa.acha_melhor_imagem escolhe), para o download parcial: o da melhor resolução e o da triagem do
+# modo rápido (refinamento.RESOLUCAO_TRIAGEM), que só é diferente nas bandas que existem a 20 m
+# A SCL é opcional: se o produto não a tiver, o processo só exclui os pixeis sem dados
+def bandas_do_produto(dados):
+    from sentinel.processa import acha_melhor_imagem, imagens_da_banda
+    from sentinel.refinamento import RESOLUCAO_TRIAGEM
+
+    membros = []
+    for banda in BANDAS_DOWNLOAD_PARCIAL:
+        if banda == BANDA_SCL and not imagens_da_banda(banda, dados):
+            continue
+        for resolucao in (None, RESOLUCAO_TRIAGEM):
+            membro = acha_melhor_imagem(banda, dados, resolucao)
+            if membro not in membros:
+                membros.append(membro)
+    return membros
 
-    if imagem_ja_descarregada(uuid):
-        print("Imagem com uuid f{uuid} já existe - não é necessario efetuar o Download ")
-        return False
 
-    fich_descarregados = (pasta_imagens_satelite/ "ficheiros_descarregados.txt")
-    ficheiros_antes = set(pasta_imagens_satelite.iterdir())
-    api.download(uuid, str(pasta_imagens_satelite))
-    ficheiros_depois = set(pasta_imagens_satelite.iterdir())
-    ficheiro_descarregado = (ficheiros_depois - ficheiros_antes)
-    if ficheiro_descarregado:
-        descarregados = fich_descarregados.read_text().split("\n")
-        ficheiro_descarregado = ficheiro_descarregado.pop()
-        descarregados.append(f"{uuid}={ficheiro_descarregado.name}")
-        fich_descarregados.write_text("\n".join(descarregados))
-    return True
+# Descarrega vários produtos em simultâneo (até DOWNLOADS_SIMULTANEOS), retomando downloads interrompidos
+# e verificando o MD5; update(valor, mensagem) recebe o progresso total dos produtos
+# Com o download parcial, só as bandas necessárias são descarregadas (ver BANDAS_DOWNLOAD_PARCIAL)
+# Devolve os uuid dos produtos que foram descarregados (os que já existiam não são descarregados de novo)
+def download_varios(uuids, update=None, n_simultaneos=DOWNLOADS_SIMULTANEOS, parcial=None):
+    novos = []
+    for uuid in uuids:
+        if imagem_ja_descarregada(uuid):
+            print(f"Imagem com uuid {uuid} já existe - não é necessario efetuar o Download ")
+        elif uuid not in novos:
+            novos.append(uuid)
+    if not novos:
+        return []
 
+    parcial = DOWNLOAD_PARCIAL if parcial is None else parcial
+    gestor = GestorDescarregamentos(
+        pasta_imagens_satelite, api, n_simultaneos, escolhe_membros=bandas_do_produto if parcial else None
+    )
 
+    def _progresso(uuid, descarregado, total):
+        if update is not None:
+            update(gestor.percentagem(), f"A realizar o download de {len(novos)} imagens")
 
+    gestor.descarrega(novos, _progresso, regista_descarregado)
+    return novos
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Importar as bibliotecas
+import numpy as np
+
+# Valor atribuído aos pixeis sem dados
+NODATA = -9999
+
+# Fator para converter os valores das bandas do Sentinel2 (nível 2A) em refletância
+ESCALA_REFLECTANCIA = 10000.0
+
+
+# Tipo numérico usado nos cálculos; o float32 chega para a precisão dos índices e usa metade da memória do float64
+TIPO_CALCULO = np.float32
+
+
+# Devolve um array reutilizável com o nome, a forma e o tipo pedidos, guardado no dicionário "buffers"
+# Os blocos têm quase sempre a mesma forma, por isso os mesmos arrays são reaproveitados de bloco para bloco
+def obtem_buffer(buffers, nome, forma, tipo):
+    if buffers is None:
+        return np.empty(forma, dtype=tipo)
+    chave = (nome, forma, np.dtype(tipo))
+    if chave not in buffers:
+        buffers[chave] = np.empty(forma, dtype=tipo)
+    return buffers[chave]
+
+
+# Diferença normalizada (b_a - b_b) / (b_a + b_b), usada no NDVI, NBR e NBR2
+# O resultado é escrito em "out" (se indicado) sem criar arrays intermédios do tamanho do bloco além da soma
+def diferenca_normalizada(banda_a, banda_b):
+    def _calcula(bandas, out=None, buffers=None):
+        b_a = bandas[banda_a]
+        b_b = bandas[banda_b]
+        soma = np.add(b_a, b_b, out=obtem_buffer(buffers, "soma", b_a.shape, b_a.dtype))
+        if out is None:
+            out = np.empty_like(soma)
+        np.subtract(b_a, b_b, out=out)
+        np.divide(out, soma, out=out, where=soma != 0)
+        out[soma == 0] = NODATA
+        return out
+    return _calcula
+
+
+# Burned Area Index: 1 / ((0.1 - vermelho)^2 + (0.06 - nir)^2), com as bandas em refletância
+def calcula_bai(bandas, out=None, buffers=None):
+    vermelho = bandas[4]
+    nir = bandas[8]
+    auxiliar = obtem_buffer(buffers, "auxiliar", nir.shape, nir.dtype)
+    if out is None:
+        out = np.empty_like(nir)
+    # (0.06 - nir / escala)^2
+    np.divide(nir, -ESCALA_REFLECTANCIA, out=auxiliar)
+    auxiliar += 0.06
+    np.square(auxiliar, out=auxiliar)
+    # (0.1 - vermelho / escala)^2
+    np.divide(vermelho, -ESCALA_REFLECTANCIA, out=out)
+    out += 0.1
+    np.square(out, out=out)
+    out += auxiliar
+    np.divide(1.0, out, out=auxiliar, where=out != 0)
+    auxiliar[out == 0] = NODATA
+    out[...] = auxiliar
+    return out
+
+
+# Mid-Infrared Burn Index: 10 * SWIR2 - 9.8 * SWIR1 + 2, com as bandas em refletância
+def calcula_mirbi(bandas, out=None, buffers=None):
+    swir2 = bandas[12]
+    swir1 = bandas[11]
+    auxiliar = obtem_buffer(buffers, "auxiliar", swir1.shape, swir1.dtype)
+    if out is None:
+        out = np.empty_like(swir2)
+    np.multiply(swir2, 10 / ESCALA_REFLECTANCIA, out=out)
+    np.multiply(swir1, 9.8 / ESCALA_REFLECTANCIA, out=auxiliar)
+    out -= auxiliar
+    out += 2
+    return out
+
+
+# Relativized dNBR (Miller & Thode, 2007): dNBR / sqrt(|NBR antes|)
+def calcula_rdnbr(diferenca, pre, out=None, buffers=None):
+    raiz = np.abs(pre, out=obtem_buffer(buffers, "auxiliar", pre.shape, pre.dtype))
+    np.sqrt(raiz, out=raiz)
+    if out is None:
+        out = np.empty_like(diferenca)
+    np.divide(diferenca, raiz, out=out, where=raiz != 0)
+    out[raiz == 0] = NODATA
+    return out
+
+
+# Relativized Burn Ratio (Parks et al., 2014): dNBR / (NBR antes + 1.001)
+def calcula_rbr(diferenca, pre, out=None, buffers=None):
+    denominador = np.add(pre, 1.001, out=obtem_buffer(buffers, "auxiliar", pre.shape, pre.dtype))
+    if out is None:
+        out = np.empty_like(diferenca)
+    return np.divide(diferenca, denominador, out=out)
+
+
+# Registo dos índices espectrais disponíveis:
+#  - "bandas": bandas do Sentinel2 necessárias para calcular o índice em cada época
+#  - "calculo": função que recebe {banda: array} e devolve o índice
+#  - "sentido": 1 se o índice desce depois do incêndio (diferença = antes - depois), -1 se sobe (depois - antes)
+#  - "limiar": valor da diferença a partir do qual o pixel é considerado ardido; None para não criar a shapefile
+#  - os índices relativos ("base" e "relativo") usam a diferença e o valor antes do incêndio de outro índice
+INDICES = {
+    "ndvi": {"bandas": (8, 4), "calculo": diferenca_normalizada(8, 4), "sentido": 1, "limiar": 0.17767},
+    "nbr": {"bandas": (8, 12), "calculo": diferenca_normalizada(8, 12), "sentido": 1, "limiar": 0.100},
+    "nbr2": {"bandas": (11, 12), "calculo": diferenca_normalizada(11, 12), "sentido": 1, "limiar": 0.100},
+    "bai": {"bandas": (4, 8), "calculo": calcula_bai, "sentido": -1, "limiar": None},
+    "mirbi": {"bandas": (11, 12), "calculo": calcula_mirbi, "sentido": -1, "limiar": None},
+    "rdnbr": {"base": "nbr", "relativo": calcula_rdnbr, "limiar": 0.069},
+    "rbr": {"base": "nbr", "relativo": calcula_rbr, "limiar": 0.035},
+}
+
+
+# Devolve os índices que é preciso calcular em cada época (incluindo a base dos índices relativos)
+def indices_base(indices):
+    base = []
+    for indice in indices:
+        if indice not in INDICES:
+            raise ValueError(f"Índice desconhecido: {indice}. Disponíveis: {', '.join(INDICES)}")
+        indice = INDICES[indice].get("base", indice)
+        if indice not in base:
+            base.append(indice)
+    return base
+
+
+# Devolve as bandas necessárias para calcular os índices pedidos, sem repetições
+def bandas_necessarias(indices):
+    bandas = []
+    for indice in indices_base(indices):
+        for banda in INDICES[indice]["bandas"]:
+            if banda not in bandas:
+                bandas.append(banda)
+    return bandas
+
+
+# Calcula a diferença de cada índice pedido entre antes e depois do incêndio
+# Recebe as bandas já lidas de cada época ({banda: array}), para que cada banda seja lida uma única vez
+# Se for indicado o dicionário "buffers", os resultados são escritos em arrays reaproveitados entre chamadas:
+# os arrays devolvidos só são válidos até à chamada seguinte com os mesmos buffers
+def calcula_diferencas(indices, bandas_pre, bandas_pos, buffers=None):
+    valores_pre = {}
+    diferencas_base = {}
+    for indice in indices_base(indices):
+        definicao = INDICES[indice]
+        forma = bandas_pre[definicao["bandas"][0]].shape
+        tipo = bandas_pre[definicao["bandas"][0]].dtype
+        valor_pre = definicao["calculo"](bandas_pre, obtem_buffer(buffers, f"pre_{indice}", forma, tipo), buffers)
+        valor_pos = definicao["calculo"](bandas_pos, obtem_buffer(buffers, f"pos_{indice}", forma, tipo), buffers)
+        # Diferença calculada no lugar do valor depois do incêndio, para não criar outro array
+        if definicao["sentido"] > 0:
+            diferencas_base[indice] = np.subtract(valor_pre, valor_pos, out=valor_pos)
+        else:
+            diferencas_base[indice] = np.subtract(valor_pos, valor_pre, out=valor_pos)
+        valores_pre[indice] = valor_pre
+
+    diferencas = {}
+    for indice in indices:
+        definicao = INDICES[indice]
+        if "base" in definicao:
+            base = definicao["base"]
+            diferenca_base = diferencas_base[base]
+            diferencas[indice] = definicao["relativo"](
+                diferenca_base,
+                valores_pre[base],
+                obtem_buffer(buffers, f"dif_{indice}", diferenca_base.shape, diferenca_base.dtype),
+                buffers,
+            )
+        else:
+            diferencas[indice] = diferencas_base[indice]
+    return diferencas
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Instrumentação das fases do processo: para cada fase (extração, recorte de cada banda, RGB, índices,
+# filtro, reclassificação, vetorial, limpeza) regista o tempo real, o tempo de CPU, a memória, os bytes
+# lidos e escritos e as dimensões dos rasters. No fim grava um relatório JSON e, opcionalmente, um ficheiro
+# de trace do Chrome (abrir em chrome://tracing ou https://ui.perfetto.dev).
+# A barra de progresso usa o peso medido de cada fase principal nas execuções anteriores, em vez de
+# percentagens fixas
+
+# Importar as bibliotecas
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from sentinel.pastas import pasta_cache
+
+# Pesos das fases principais medidos nas execuções anteriores (fração do tempo total de cada fase)
+ficheiro_pesos = pasta_cache / "pesos_fases.json"
+
+# Peso de cada nova execução na média dos pesos guardados
+PESO_NOVA_EXECUCAO = 0.3
+
+# Intervalo (em segundos) entre as medições da memória residente enquanto há fases a decorrer
+INTERVALO_MEMORIA = 0.05
+
+
+# Bytes lidos e escritos pelo processo até agora (Linux: /proc/self/io, incluindo os lidos da cache do sistema)
+# Tal como o tempo de CPU (que inclui as threads do GDAL), os valores são do processo inteiro:
+# numa fase com várias threads incluem o que as outras threads fizeram
+def bytes_io():
+    try:
+        with open("/proc/self/io") as ficheiro:
+            valores = dict(linha.split(":") for linha in ficheiro.read().splitlines())
+        return int(valores["rchar"]), int(valores["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+# Memória residente atual (MB), ou None se não for possível lê-la (só em Linux)
+def memoria_residente():
+    try:
+        with open("/proc/self/statm") as ficheiro:
+            return int(ficheiro.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Pico da memória residente desde o início do processo (MB); não serve para uma fase, porque depois da fase
+# com mais memória todas as fases seguintes teriam o mesmo pico
+def pico_memoria_vida_processo():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Instrumentacao:
+
+    # update(valor, mensagem): a função de progresso; fases: {nome da fase principal: mensagem}, pela ordem do processo
+    # pesos_iniciais: peso de cada fase principal enquanto ainda não houver medições guardadas
+    def __init__(self, update=None, fases=None, pesos_iniciais=None):
+        self.update = update or (lambda valor, mensagem: None)
+        self.fases = dict(fases or {})
+        self.pesos = self._le_pesos(pesos_iniciais or {})
+        self.registos = []
+        self.inicio = time.perf_counter()
+        self._trinco = threading.Lock()
+        # Pico da memória residente de cada fase a decorrer ({identificador: MB}), atualizado por uma thread
+        # que mede a memória enquanto houver fases abertas
+        self._picos = {}
+        self._contador_fases = 0
+        self._amostragem = None
+
+    def _le_pesos(self, pesos_iniciais):
+        pesos = {fase: pesos_iniciais.get(fase, 1.0) for fase in self.fases}
+        try:
+            guardados = json.loads(ficheiro_pesos.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            guardados = {}
+        pesos.update({fase: peso for fase, peso in guardados.items() if fase in pesos and peso > 0})
+        total = sum(pesos.values()) or 1
+        return {fase: peso / total for fase, peso in pesos.items()}
+
+    # Percentagem (0 a 99) no ponto "fracao" (0 a 1) da fase principal; 100 fica para o fim do processo
+    def percentagem(self, fase, fracao=0.0):
+        anteriores = 0.0
+        for nome in self.fases:
+            if nome == fase:
+                break
+            anteriores += self.pesos[nome]
+        return int(99 * (anteriores + self.pesos.get(fase, 0) * min(max(fracao, 0.0), 1.0)))
+
+    # Atualiza a barra de progresso a meio de uma fase principal (ex: a cada bloco dos índices)
+    def avanca(self, fase, fracao, mensagem=None):
+        self.update(self.percentagem(fase, fracao), mensagem or self.fases.get(fase, fase))
+
+    # Mede a memória residente a cada INTERVALO_MEMORIA e atualiza o pico das fases abertas; termina quando
+    # não houver nenhuma fase aberta (é iniciada de novo pela fase seguinte)
+    def _amostra_memoria(self):
+        while True:
+            atual = memoria_residente()
+            with self._trinco:
+                if not self._picos or atual is None:
+                    self._amostragem = None
+                    return
+                for identificador, pico in self._picos.items():
+                    self._picos[identificador] = max(pico, atual)
+            time.sleep(INTERVALO_MEMORIA)
+
+    # Começa a medir o pico de memória de uma fase (a partir da memória atual) e devolve o seu identificador
+    def _abre_pico(self):
+        atual = memoria_residente()
+        with self._trinco:
+            self._contador_fases += 1
+            identificador = self._contador_fases
+            if atual is None:
+                return identificador
+            self._picos[identificador] = atual
+            if self._amostragem is None:
+                self._amostragem = threading.Thread(target=self._amostra_memoria, name="instrumentacao_memoria", daemon=True)
+                self._amostragem.start()
+        return identificador
+
+    # Deixa de medir a fase e devolve o seu pico de memória (MB), incluindo a memória no fim, ou None
+    def _fecha_pico(self, identificador):
+        atual = memoria_residente()
+        with self._trinco:
+            pico = self._picos.pop(identificador, None)
+        if pico is None or atual is None:
+            return atual
+        return max(pico, atual)
+
+    # Regista uma fase; "info" são dados extra do registo (ex: banda, colunas, linhas)
+    # As fases principais (as de "fases") também atualizam a barra de progresso no início
+    # O pico de memória é o da fase: o máximo da memória residente do processo medida durante a fase
+    # (por amostragem, por isso um pico mais curto que INTERVALO_MEMORIA pode escapar)
+    @contextmanager
+    def fase(self, nome, **info):
+        if nome in self.fases:
+            self.avanca(nome, 0.0)
+        lidos, escritos = bytes_io()
+        identificador_pico = self._abre_pico()
+        inicio = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield info
+        finally:
+            duracao = time.perf_counter() - inicio
+            lidos_fim, escritos_fim = bytes_io()
+            pico = self._fecha_pico(identificador_pico)
+            atual = memoria_residente()
+            registo = {
+                "fase": nome,
+                "inicio": round(inicio - self.inicio, 6),
+                "segundos": round(duracao, 6),
+                "cpu_segundos": round(time.process_time() - cpu, 6),
+                "rss_mb": None if atual is None else round(atual, 1),
+                "pico_rss_mb": None if pico is None else round(pico, 1),
+                "bytes_lidos": None if lidos is None else lidos_fim - lidos,
+                "bytes_escritos": None if escritos is None else escritos_fim - escritos,
+                "thread": threading.get_ident(),
+                "principal": nome in self.fases,
+            }
+            registo.update(info)
+            with self._trinco:
+                self.registos.append(registo)
+
+    # Tempo total, número de vezes e bytes de cada fase (as fases repetidas, como os blocos, são somadas)
+    def resumo(self):
+        resumo = {}
+        for registo in self.registos:
+            total = resumo.setdefault(registo["fase"], {"vezes": 0, "segundos": 0.0, "cpu_segundos": 0.0,
+                                                         "bytes_lidos": 0, "bytes_escritos": 0})
+            total["vezes"] += 1
+            for campo in ("segundos", "cpu_segundos", "bytes_lidos", "bytes_escritos"):
+                total[campo] += registo[campo] or 0
+        for total in resumo.values():
+            total["segundos"] = round(total["segundos"], 3)
+            total["cpu_segundos"] = round(total["cpu_segundos"], 3)
+        return resumo
+
+    def relatorio(self, **info):
+        relatorio = {
+            "segundos": round(time.perf_counter() - self.inicio, 3),
+            "pico_rss_vida_processo_mb": pico_memoria_vida_processo(),
+            "pesos_usados": {fase: round(peso, 4) for fase, peso in self.pesos.items()},
+            "resumo": self.resumo(),
+            "fases": self.registos,
+        }
+        relatorio.update(info)
+        return relatorio
+
+    # Eventos no formato do Chrome trace ("X": evento com duração, em micro-segundos)
+    def trace(self):
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": registo["fase"],
+                    "ph": "X",
+                    "ts": int(registo["inicio"] * 1e6),
+                    "dur": max(1, int(registo["segundos"] * 1e6)),
+                    "pid": pid,
+                    "tid": registo["thread"],
+                    "args": {chave: valor for chave, valor in registo.items() if chave not in ("fase", "inicio", "thread")},
+                }
+                for registo in self.registos
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    # Grava o relatório (e o trace, se indicado) e, com aprende_pesos, atualiza os pesos das fases principais
+    # com os tempos desta execução
+    def guarda(self, caminho_relatorio, caminho_trace=None, aprende_pesos=True, **info):
+        Path(caminho_relatorio).write_text(json.dumps(self.relatorio(**info), indent=2, default=str), encoding="utf-8")
+        if caminho_trace is not None:
+            Path(caminho_trace).write_text(json.dumps(self.trace()), encoding="utf-8")
+        if aprende_pesos:
+            self.atualiza_pesos()
+
+    def atualiza_pesos(self):
+        tempos = {fase: 0.0 for fase in self.fases}
+        for registo in self.registos:
+            if registo["principal"]:
+                tempos[registo["fase"]] += registo["segundos"]
+        total = sum(tempos.values())
+        if not total or not all(tempos.values()):
+            # execução incompleta (cancelada ou com erro): não serve para os pesos
+            return
+        pesos = {
+            fase: (1 - PESO_NOVA_EXECUCAO) * self.pesos[fase] + PESO_NOVA_EXECUCAO * tempo / total
+            for fase, tempo in tempos.items()
+        }
+        ficheiro_pesos.parent.mkdir(parents=True, exist_ok=True)
+        caminho_temp = ficheiro_pesos.with_suffix(f".{os.getpid()}.tmp")
+        caminho_temp.write_text(json.dumps(pesos, indent=2), encoding="utf-8")
+        os.replace(caminho_temp, ficheiro_pesos)
@@ -12,31 +12,105 @@
 #-------------------------------------------------------------------------------
 
 # Importar as bibliotecas
+import os
+import pickle
 from pathlib import Path
 import osgeo.ogr as ogr
 
+from sentinel.pastas import pasta_cache
+
 # Caminho do ficheiro Carta Administrativa Oficial de Portugal (CAOP)
 entrada = str(Path(__file__).parent / 'CAOP.shp')
 
-def envelope(dico):
+# Caminho do índice DICO -> (envelope, geometria do município) criado a partir da CAOP
+ficheiro_indice = pasta_cache / "indice_caop.pkl"
+
+# Índice já carregado nesta execução, e a "assinatura" (tamanho e data) da CAOP a partir da qual foi criado
+_indice = None
+_assinatura = None
+
+
+# Assinatura da CAOP: se o ficheiro for alterado, o índice tem de ser criado de novo
+def assinatura_caop():
+    estado = os.stat(entrada)
+    return (entrada, estado.st_size, estado.st_mtime_ns)
+
+
+# Percorre a CAOP uma única vez e junta as freguesias de cada município (DICO):
+# o envelope (Xmin, Xmax, Ymin, Ymax) de todas as freguesias e a geometria dissolvida do município em WKB
+def cria_indice():
     driver = ogr.GetDriverByName('ESRI Shapefile')
     # abrir a Shapefile da CAOP com o SRC 4326
     inDataSet = driver.Open(entrada)
     inLayer = inDataSet.GetLayer()
-    # Selecionar o Municipio pretendido da pesquisa atraves do código DICO
-    str="SELECT * FROM %s WHERE DICO = '%s' " %(inLayer.GetName(),dico)
-    inDataSet.ExecuteSQL(str)
-    #  recursos de entrada
+    envelopes = {}
+    geometrias = {}
     inFeature = inLayer.GetNextFeature()
     while inFeature:
-         # obter a geometria de entrada
-         geom = inFeature.GetGeometryRef()
-         # Obter as coordendas dos pontos do poligono do Municipio selecionado
-         bb=geom.GetEnvelope()
-         inFeature = inLayer.GetNextFeature()
+        dico = inFeature.GetField("DICO")
+        geom = inFeature.GetGeometryRef()
+        if geom is not None:
+            bb = geom.GetEnvelope()
+            if dico in envelopes:
+                atual = envelopes[dico]
+                bb = (min(atual[0], bb[0]), max(atual[1], bb[1]), min(atual[2], bb[2]), max(atual[3], bb[3]))
+            envelopes[dico] = bb
+            if dico not in geometrias:
+                geometrias[dico] = ogr.Geometry(ogr.wkbMultiPolygon)
+            if ogr.GT_Flatten(geom.GetGeometryType()) == ogr.wkbMultiPolygon:
+                partes = [geom.GetGeometryRef(i) for i in range(geom.GetGeometryCount())]
+            else:
+                partes = [geom]
+            for parte in partes:
+                geometrias[dico].AddGeometry(parte)
+        inFeature = inLayer.GetNextFeature()
     # Salvar e fechar os shapefiles
     inDataSet = None
-    # Obter os pontos do poligono Xmim, Xmax, Ymin, Ymax
+    return {
+        dico: (envelopes[dico], bytes(geometrias[dico].UnionCascaded().ExportToWkb()))
+        for dico in envelopes
+    }
+
+
+# Devolve o índice DICO -> (envelope, geometria em WKB), guardado em memória e em disco
+# Só é criado de novo quando a CAOP muda; caso contrário é lido do disco uma vez por execução
+def indice_dico():
+    global _indice, _assinatura
+    assinatura = assinatura_caop()
+    if _indice is not None and _assinatura == assinatura:
+        return _indice
+    if ficheiro_indice.exists():
+        with open(ficheiro_indice, "rb") as ficheiro:
+            guardado = pickle.load(ficheiro)
+        if guardado.get("assinatura") == assinatura:
+            _indice, _assinatura = guardado["indice"], assinatura
+            return _indice
+    indice = cria_indice()
+    pasta_cache.mkdir(exist_ok=True)
+    caminho_temp = ficheiro_indice.with_suffix(f".{os.getpid()}.tmp")
+    with open(caminho_temp, "wb") as ficheiro:
+        pickle.dump({"assinatura": assinatura, "indice": indice}, ficheiro)
+    os.replace(caminho_temp, ficheiro_indice)
+    _indice, _assinatura = indice, assinatura
+    return _indice
+
+
+# Devolve o envelope (Xmin, Xmax, Ymin, Ymax) e a geometria do município com o código DICO
+def procura_municipio(dico):
+    try:
+        return indice_dico()[dico]
+    except KeyError:
+        raise ValueError(f"O código DICO {dico} não existe na CAOP") from None
+
+
+# Devolve a geometria (dissolvida) do município com o código DICO, no SRC da CAOP (4326)
+def geometria(dico):
+    return ogr.CreateGeometryFromWkb(procura_municipio(dico)[1])
+
+
+def envelope(dico):
+    # Obter os pontos do poligono Xmim, Xmax, Ymin, Ymax do Municipio selecionado através do código DICO
+    bb = procura_municipio(dico)[0]
     ring = ogr.Geometry(ogr.wkbLinearRing)
     ring.AddPoint(bb[0], bb[2])
     ring.AddPoint(bb[1], bb[2])
@@ -47,7 +121,3 @@ def envelope(dico):
     poly.AddGeometry(ring)
     footprint=poly.ExportToWkt()
     return(footprint)
-
-
-
-
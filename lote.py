@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Processamento em lote, sem interface gráfica, de vários municípios e datas de incêndio
+#
+# O ficheiro de trabalhos pode ser CSV (com cabeçalho) ou JSONL (um objeto JSON por linha), com os campos:
+#   dico              - código DICO do município (obrigatório)
+#   data_incendio     - data do incêndio no formato AAAA-MM-DD (obrigatório)
+#   indices           - índices a calcular, separados por ";" (ex: "ndvi;nbr"); por defeito "ndvi"
+#   cobertura_maxima  - cobertura máxima de nuvens (%) na pesquisa de imagens; por defeito 5
+#   pre, pos          - ficheiros ZIP ou uuid dos produtos antes e depois do incêndio, separados por ";"
+#                       (se vazios, são escolhidos e descarregados automaticamente)
+#   prefixo           - início do nome dos resultados; por defeito "aap"
+#   shapefile         - shapefile de recorte; por defeito usa o limite do município na CAOP
+#   rapido            - "sim"/"1" para o modo rápido (triagem a 20 m e 10 m só nas áreas candidatas); por defeito não
+#                       (as composições RGB e os índices sem limiar ficam a 20 m, com "_20m" no nome)
+#   id                - identificador do trabalho; por defeito o número da linha
+#
+# Exemplo: python -m sentinel lote trabalhos.csv --processos 4 --tentativas 2
+
+# Importar as bibliotecas
+import argparse
+import csv
+import json
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Pasta onde ficam os registos (logs) de cada trabalho e o resumo do lote
+pasta_raiz = Path(__file__).parent.parent
+pasta_logs = pasta_raiz / "logs"
+
+# Número de trabalhos processados ao mesmo tempo e número de tentativas de cada trabalho
+NUMERO_DE_PROCESSOS = 2
+NUMERO_DE_TENTATIVAS = 2
+
+# Dias antes e depois do incêndio em que são procuradas imagens, como na interface gráfica
+DIAS_DE_PESQUISA = 60
+
+
+# Lê os trabalhos de um ficheiro CSV ou JSONL e devolve uma lista de dicionários normalizados
+def le_trabalhos(caminho):
+    caminho = Path(caminho)
+    with open(caminho, encoding="utf-8") as ficheiro:
+        if caminho.suffix.lower() in (".jsonl", ".json"):
+            linhas = [json.loads(linha) for linha in ficheiro if linha.strip()]
+        else:
+            linhas = list(csv.DictReader(ficheiro))
+    return [normaliza_trabalho(linha, numero) for numero, linha in enumerate(linhas, 1)]
+
+
+# Converte os campos de um trabalho para os tipos usados no processamento
+def normaliza_trabalho(linha, numero=0):
+    def _lista(valor):
+        if not valor:
+            return []
+        if isinstance(valor, str):
+            return [parte.strip() for parte in valor.split(";") if parte.strip()]
+        return list(valor)
+
+    if not linha.get("dico") or not linha.get("data_incendio"):
+        raise ValueError(f"Trabalho {numero}: os campos 'dico' e 'data_incendio' são obrigatórios")
+    data = linha["data_incendio"]
+    if isinstance(data, str):
+        data = datetime.strptime(data[:10], "%Y-%m-%d")
+    return {
+        "id": str(linha.get("id") or numero),
+        "dico": str(linha["dico"]).zfill(4),
+        "data_incendio": data,
+        "indices": _lista(linha.get("indices")) or ["ndvi"],
+        "cobertura_maxima": int(linha.get("cobertura_maxima") or 5),
+        "pre": _lista(linha.get("pre")),
+        "pos": _lista(linha.get("pos")),
+        "prefixo": linha.get("prefixo") or "aap",
+        "shapefile": linha.get("shapefile") or None,
+        "rapido": str(linha.get("rapido") or "").strip().lower() in ("1", "sim", "s", "true", "yes"),
+    }
+
+
+# Devolve os ficheiros ZIP dos produtos: os que já são ficheiros são usados diretamente,
+# os restantes são tratados como uuid de produtos já descarregados por prepara_produtos
+def obtem_ficheiros_produtos(produtos):
+    from sentinel import import_img
+
+    ficheiros = []
+    for produto in produtos:
+        if Path(produto).exists():
+            ficheiros.append(Path(produto))
+            continue
+        ficheiro = import_img.imagem_ja_descarregada(produto)
+        if ficheiro is None:
+            raise RuntimeError(f"Não foi possível obter o produto {produto}")
+        ficheiros.append(ficheiro)
+    return ficheiros
+
+
+# Corre no processo do lote, antes de distribuir os trabalhos pelos processos: escolhe os produtos dos trabalhos
+# que não os indicam e descarrega, uma única vez, cada produto em falta de todos os trabalhos
+# (dois trabalhos com o mesmo produto, em processos diferentes, partilhariam o .incomplete e a pasta .parcial)
+# Devolve {id: erro} dos trabalhos em que não foi possível escolher os produtos
+def prepara_produtos(trabalhos):
+    from sentinel import import_img
+
+    erros = {}
+    uuids = []
+    for trabalho in trabalhos:
+        if not trabalho["pre"] or not trabalho["pos"]:
+            try:
+                trabalho["pre"], trabalho["pos"] = seleciona_produtos(trabalho)
+            except Exception as erro:
+                traceback.print_exc()
+                erros[trabalho["id"]] = f"{type(erro).__name__}: {erro}"
+                continue
+        for produto in trabalho["pre"] + trabalho["pos"]:
+            if not Path(produto).exists() and produto not in uuids:
+                uuids.append(produto)
+    if uuids:
+        try:
+            import_img.download_varios(uuids, lambda valor, mensagem: print(f"{valor}% {mensagem}"))
+        except Exception:
+            # os trabalhos com produtos em falta falham em obtem_ficheiros_produtos e são repetidos
+            traceback.print_exc()
+    return erros
+
+
+# Escolhe, para a data mais próxima antes e depois do incêndio, o menor conjunto de produtos que cobre o município
+def seleciona_produtos(trabalho):
+    from sentinel import import_img, ler_envelope, selecao_cenas
+
+    data = trabalho["data_incendio"]
+    bbox = ler_envelope.envelope(trabalho["dico"])
+    data_inicio = (data - timedelta(days=DIAS_DE_PESQUISA)).strftime("%Y%m%d")
+    data_fim = (data + timedelta(days=DIAS_DE_PESQUISA)).strftime("%Y%m%d")
+    imagens = import_img.lerimagens(bbox, data_inicio, data_fim, trabalho["cobertura_maxima"])["features"]
+    antes, depois = selecao_cenas.seleciona_cenas(imagens, trabalho["dico"], data)
+    if not antes or not depois:
+        raise RuntimeError(f"Sem imagens que cubram o DICO {trabalho['dico']} antes e depois de {data:%d/%m/%Y}")
+    return [imagem["properties"]["uuid"] for imagem in antes], [imagem["properties"]["uuid"] for imagem in depois]
+
+
+# Executa um trabalho, com o registo (prints do processo e erros) no ficheiro de log do trabalho
+# Corre num processo separado do lote, com os produtos já escolhidos e descarregados (ver prepara_produtos);
+# devolve um dicionário com o estado e os resultados
+def executa_trabalho(trabalho, pasta=pasta_logs, tentativa=1):
+    from sentinel import processa
+
+    pasta = Path(pasta)
+    pasta.mkdir(parents=True, exist_ok=True)
+    caminho_log = pasta / f"trabalho_{trabalho['id']}.log"
+    inicio = time.time()
+    resultado = {"id": trabalho["id"], "tentativa": tentativa, "log": str(caminho_log)}
+    with open(caminho_log, "a", encoding="utf-8") as log, redirect_stdout(log), redirect_stderr(log):
+        print(f"==== {datetime.now():%Y-%m-%d %H:%M:%S} tentativa {tentativa} ====")
+        print(json.dumps(trabalho, default=str))
+        try:
+            pre, pos = trabalho["pre"], trabalho["pos"]
+            destino = f"{trabalho['prefixo']}_{trabalho['dico']}_{trabalho['data_incendio']:%Y%m%d}"
+            shapefile = Path(trabalho["shapefile"]) if trabalho["shapefile"] else None
+            resultados = processa.processa(
+                [str(f) for f in obtem_ficheiros_produtos(pre)],
+                [str(f) for f in obtem_ficheiros_produtos(pos)],
+                destino,
+                shapefile,
+                indices=trabalho["indices"],
+                update=lambda valor, mensagem: print(f"{valor}% {mensagem}"),
+                dico=trabalho["dico"],
+                modo_rapido=trabalho["rapido"],
+            )
+            resultado.update(estado="concluido", resultados=resultados)
+        except Exception as erro:
+            traceback.print_exc()
+            resultado.update(estado="erro", erro=f"{type(erro).__name__}: {erro}")
+        resultado["duracao"] = round(time.time() - inicio, 1)
+        print(f"==== {resultado['estado']} em {resultado['duracao']} s ====")
+    return resultado
+
+
+# Executa todos os trabalhos numa pool de processos, repetindo os que falham até ao número de tentativas,
+# e grava o resumo em <pasta>/resumo_<data>.json
+def executa_lote(trabalhos, n_processos=NUMERO_DE_PROCESSOS, tentativas=NUMERO_DE_TENTATIVAS, pasta=pasta_logs):
+    if isinstance(trabalhos, (str, Path)):
+        trabalhos = le_trabalhos(trabalhos)
+    pasta = Path(pasta)
+    pasta.mkdir(parents=True, exist_ok=True)
+    resumo = {}
+    pendentes = list(trabalhos)
+    for tentativa in range(1, tentativas + 1):
+        if not pendentes:
+            break
+        falhados = []
+        erros = prepara_produtos(pendentes)
+        for trabalho in pendentes:
+            if trabalho["id"] in erros:
+                resumo[trabalho["id"]] = {
+                    "id": trabalho["id"], "tentativa": tentativa, "estado": "erro", "erro": erros[trabalho["id"]]
+                }
+                print(f"Trabalho {trabalho['id']}: erro na escolha dos produtos (tentativa {tentativa})")
+                falhados.append(trabalho)
+        with ProcessPoolExecutor(max_workers=n_processos) as executor:
+            futuros = {
+                executor.submit(executa_trabalho, trabalho, pasta, tentativa): trabalho
+                for trabalho in pendentes
+                if trabalho["id"] not in erros
+            }
+            for futuro in as_completed(futuros):
+                trabalho = futuros[futuro]
+                try:
+                    resultado = futuro.result()
+                except Exception as erro:
+                    # o processo do trabalho terminou de forma inesperada
+                    resultado = {"id": trabalho["id"], "tentativa": tentativa, "estado": "erro", "erro": repr(erro)}
+                resumo[trabalho["id"]] = resultado
+                print(f"Trabalho {trabalho['id']}: {resultado['estado']} (tentativa {tentativa})")
+                if resultado["estado"] != "concluido":
+                    falhados.append(trabalho)
+        pendentes = falhados
+
+    caminho_resumo = pasta / f"resumo_{datetime.now():%Y%m%d%H%M%S}.json"
+    caminho_resumo.write_text(json.dumps(list(resumo.values()), indent=2, default=str), encoding="utf-8")
+    concluidos = sum(resultado["estado"] == "concluido" for resultado in resumo.values())
+    print(f"{concluidos} de {len(resumo)} trabalhos concluídos - resumo em {caminho_resumo}")
+    return resumo
+
+
+# Linha de comandos: python -m sentinel lote <ficheiro de trabalhos> [--processos N] [--tentativas N] [--logs pasta]
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(prog="sentinel lote", description="Processamento em lote das áreas ardidas")
+    parser.add_argument("ficheiro", help="ficheiro de trabalhos (CSV ou JSONL)")
+    parser.add_argument("--processos", type=int, default=NUMERO_DE_PROCESSOS, help="trabalhos em simultâneo")
+    parser.add_argument("--tentativas", type=int, default=NUMERO_DE_TENTATIVAS, help="tentativas por trabalho")
+    parser.add_argument("--logs", default=str(pasta_logs), help="pasta dos registos e do resumo")
+    args = parser.parse_args(argumentos)
+    resumo = executa_lote(args.ficheiro, args.processos, args.tentativas, args.logs)
+    return 0 if all(resultado["estado"] == "concluido" for resultado in resumo.values()) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
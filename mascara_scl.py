@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Máscara dos pixeis sem dados, nuvens, sombras e água a partir da classificação da cena (SCL) dos produtos L2A.
+# A SCL é recortada como se fosse mais uma banda (com o nome "SCL"), na mesma grelha das bandas dos índices;
+# fora da linha de corte do município fica com 0, a classe "sem dados", e por isso também fica mascarada
+
+# Importar as bibliotecas
+import numpy as np
+
+# Nome da camada da classificação da cena dentro do SAFE (ex: ..._SCL_20m.jp2), usado como "banda"
+BANDA_SCL = "SCL"
+
+# Classes da SCL excluídas do cálculo das áreas ardidas:
+# 0 sem dados, 1 saturado ou defeituoso, 3 sombra de nuvem, 6 água, 8 e 9 nuvem (probabilidade média e alta),
+# 10 cirros, 11 neve. As classes 2 (áreas escuras) e 7 (não classificado) não são excluídas,
+# porque o sen2cor classifica muitas vezes as áreas ardidas recentes nessas classes
+CLASSES_SCL_EXCLUIDAS = (0, 1, 3, 6, 8, 9, 10, 11)
+
+# Tabela de consulta: verdadeiro nas classes excluídas (a SCL só tem valores de 0 a 11)
+_EXCLUIDAS = np.zeros(256, dtype=bool)
+_EXCLUIDAS[list(CLASSES_SCL_EXCLUIDAS)] = True
+
+
+# Nome de uma banda nos ficheiros (B04, B8A...) ou da SCL
+def nome_banda(banda):
+    if isinstance(banda, str):
+        return banda
+    return f"B{banda:02d}"
+
+
+# Devolve verdadeiro nos pixeis que podem ser usados: com uma classe válida na SCL das duas épocas e,
+# se indicadas, com valor nas bandas de referência das duas épocas (0 é "sem dados" nas bandas do Sentinel2)
+def mascara_valida(scl_pre=None, scl_pos=None, banda_pre=None, banda_pos=None):
+    valida = None
+    for scl in (scl_pre, scl_pos):
+        if scl is not None:
+            excluida = np.take(_EXCLUIDAS, scl, mode="clip")
+            valida = ~excluida if valida is None else np.logical_and(valida, ~excluida, out=valida)
+    for banda in (banda_pre, banda_pos):
+        if banda is not None:
+            valida = banda != 0 if valida is None else np.logical_and(valida, banda != 0, out=valida)
+    return valida
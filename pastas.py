@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Pastas partilhadas pelos vários módulos da ferramenta
+
+# Importar as bibliotecas
+from pathlib import Path
+
+# Pasta acima do pacote, onde ficam as imagens, os resultados e a cache
+pasta_raiz = Path(__file__).parent.parent
+
+# Pasta das caches: índice da CAOP, pesquisas, limites municipais, bandas recortadas e pesos das fases
+pasta_cache = pasta_raiz / "cache"
@@ -16,15 +16,25 @@ import osgeo.gdal as gdal
 import osgeo.ogr as ogr
 
 import numpy as np
-from scipy import ndimage
 from PIL import Image
 import re
 import osr
 import zipfile
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from pathlib import Path
 import shutil
+import tempfile
+
+from sentinel import cache_recortes, recortes_municipais
+from sentinel.armazem_bandas import ArmazemBandas, MEMORIA_BANDAS_MB
+from sentinel.filtros import FILTROS, FILTRO_RECLASSIFICACAO, TAMANHO_FILTRO
+from sentinel.instrumentacao import Instrumentacao
+from sentinel.mascara_scl import BANDA_SCL, mascara_valida, nome_banda
+from sentinel.indices import INDICES, NODATA, TIPO_CALCULO, bandas_necessarias, calcula_diferencas
 
 
 #Define o EPSG de Portugal continental
@@ -36,95 +46,430 @@ pasta_resultados = caminhoimagoriginais / "resultados"
 temporarios = caminhoimagoriginais / "temporarios"
 pasta_resultados.mkdir(exist_ok=True)
 
-#Função de reamostragem das imagens de satélite para pixel de 10 metros e EPSG 3763 e recorte pelos limites Municipio
-def recorte(inptclip, outclip, shapefile):
+#Define o tamanho (em pixeis) dos blocos processados de cada vez
+#O halo é a margem à volta de cada bloco necessária para o filtro mediana 5x5 dar o mesmo resultado que na imagem inteira
+TAMANHO_BLOCO = 1024
+HALO_FILTRO = TAMANHO_FILTRO // 2
+
+#Se verdadeiro, as bandas são lidas pelo GDAL diretamente de dentro do ZIP (/vsizip/), sem serem extraídas para o disco
+LER_DIRETAMENTE_DO_ZIP = True
+
+#Se verdadeiro, as bandas de cada época são empilhadas num VRT e reamostradas com um único gdal.Warp
+RECORTE_NUMA_SO_PASSAGEM = True
+
+#Define a resolução (em metros) das imagens recortadas
+RESOLUCAO = 10
+
+#Número de recortes (épocas/bandas) reamostrados em paralelo e memória total (em MB) disponível para as reamostragens
+#Os núcleos do processador são divididos pelas tarefas em curso e usados pelo gdal.Warp em modo multithread
+NUMERO_DE_TAREFAS = os.cpu_count() or 1
+MEMORIA_RECORTE_MB = 2048
+
+#Se verdadeiro, a classificação da cena (SCL) dos produtos L2A é recortada com as bandas e usada para excluir
+#dos índices os pixeis sem dados, com nuvens, sombras de nuvens ou água (ver mascara_scl.py)
+#Os blocos sem nenhum pixel válido não são calculados, filtrados nem convertidos em vetorial
+USAR_MASCARA_SCL = True
+
+#Modo rápido: triagem a 20 m (ou 60 m) e recorte e filtro a 10 m só à volta dos pixeis candidatos a ardidos
+#O resultado pode perder uma pequena fração dos pixeis ardidos do modo normal (ver refinamento.py)
+MODO_RAPIDO = False
+
+#Se verdadeiro, as bandas recortadas são guardadas na cache e reutilizadas nas execuções seguintes
+USAR_CACHE_RECORTES = True
+
+#Formatos disponíveis para o ficheiro vetorial das áreas ardidas (extensão: driver do OGR) e formato usado por defeito
+FORMATOS_VETORIAIS = {"shp": "ESRI Shapefile", "gpkg": "GPKG"}
+FORMATO_VETORIAL = "shp"
+
+#Política para os ficheiros intermédios (diferenças sem filtro e imagens reclassificadas):
+# "nenhum" - só é criado o necessário para o vetorial, em memória (/vsimem/)
+# "memoria" - todos os intermédios são criados em memória (/vsimem/) e apagados no fim
+# "persistir" - todos os intermédios são gravados na pasta temporária, que não é apagada (para depuração)
+POLITICAS_INTERMEDIOS = ("nenhum", "memoria", "persistir")
+INTERMEDIOS = "nenhum"
+
+#Compressão das composições RGB, gravadas como Cloud-Optimized GeoTIFF de 8 bits ("DEFLATE" ou "ZSTD")
+COMPRESSAO_RGB = "DEFLATE"
+
+# Fases principais do processo, pela ordem em que correm, com a mensagem da barra de progresso, e o peso
+# (% do tempo) de cada uma enquanto não houver tempos medidos em execuções anteriores (ver instrumentacao.py)
+FASES_PROCESSO = {
+    "recorte": "A realizar os recortes das bandas do sentinel 2 pelos limites do munícipio ",
+    "rgb": "A guardar as composições RGB das bandas [4 3 2], [8 4 3] e [12 8 4]",
+    "indices": "A calcular as diferenças e a aplicar o filtro mediana 5x5",
+    "vetorial": "A transformar as imagens reclassificadas em vetorial",
+    "limpeza": "A remover os ficheiros temporários",
+}
+PESOS_FASES = {"recorte": 15, "rgb": 5, "indices": 45, "vetorial": 29, "limpeza": 1}
+
+# Grava o relatório JSON de cada execução (tempos, memória e I/O de cada fase) e o trace do Chrome
+RELATORIO_EXECUCAO = True
+TRACE_CHROME = False
+
+#Opções do gdal.Warp para reamostrar para pixel de 10 metros e EPSG 3763 e recortar pelos limites do Municipio
+#Se forem indicados os limites, a extensão de saída é fixa (a mesma para antes e depois do incêndio)
+#O número de threads e a memória (em MB) são os que cada gdal.Warp pode usar
+def opcoes_recorte(shapefile, limites=None, threads=1, memoria_mb=None, resolucao=RESOLUCAO):
     kw = {
         "dstAlpha": True,
         "cutlineDSName": str(shapefile),
-        "cropToCutline": True,
         "srcSRS": "EPSG:32629",
-        "dstSRS": "EPSG:3763",
-        "xRes": 10,
-        "yRes": 10,
+        "dstSRS": f"EPSG:{EPSG_PORTUGAL}",
+        "xRes": resolucao,
+        "yRes": resolucao,
+        "multithread": threads > 1,
+        "warpOptions": [f"NUM_THREADS={threads}"],
     }
+    if memoria_mb:
+        kw["warpMemoryLimit"] = memoria_mb
+    if limites is None:
+        kw["cropToCutline"] = True
+    else:
+        kw["outputBounds"] = limites
+    return kw
+
+#Função de reamostragem das imagens de satélite para pixel de 10 metros e EPSG 3763 e recorte pelos limites Municipio
+#O NUM_THREADS do warp só paraleliza a reamostragem; a descodificação dos JPEG2000 (o passo mais lento) usa o
+#GDAL_NUM_THREADS, definido só para a thread deste recorte, porque vários recortes correm ao mesmo tempo
+def recorte(inptclip, outclip, shapefile, limites=None, threads=1, memoria_mb=None, resolucao=RESOLUCAO):
+    kw = opcoes_recorte(shapefile, limites, threads, memoria_mb, resolucao)
     if not isinstance(inptclip, list):
         inptclip = str(inptclip)
     else:
         inptclip = [str(caminho) for caminho in inptclip]
-    gdal.Warp(str(outclip), inptclip, **kw)
+    anterior = gdal.GetThreadLocalConfigOption("GDAL_NUM_THREADS", None)
+    gdal.SetThreadLocalConfigOption("GDAL_NUM_THREADS", str(threads))
+    try:
+        gdal.Warp(str(outclip), inptclip, **kw)
+    finally:
+        gdal.SetThreadLocalConfigOption("GDAL_NUM_THREADS", anterior)
     return outclip
 
 
-#Procura dentro do ZIP das imagens do sentinel2, as imagens jp2 com melhor resulução para cada banda
-def acha_melhor_imagem(banda, ficheiro_zip):
-    imagens_na_banda = [
+#Calcula a extensão (xmin, ymin, xmax, ymax) da shapefile de recorte no EPSG 3763, alinhada à grelha de pixeis de 10 metros
+#Usar a mesma extensão nas duas épocas garante que as imagens antes e depois do incêndio têm exatamente a mesma grelha
+def extensao_do_recorte(shapefile, resolucao=RESOLUCAO):
+    fonte = ogr.Open(str(shapefile))
+    camada = fonte.GetLayer()
+    xmin, xmax, ymin, ymax = camada.GetExtent()
+    srs_origem = camada.GetSpatialRef()
+    srs_destino = osr.SpatialReference()
+    srs_destino.ImportFromEPSG(EPSG_PORTUGAL)
+    if srs_origem is not None and not srs_origem.IsSame(srs_destino):
+        if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+            srs_origem.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            srs_destino.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transformacao = osr.CoordinateTransformation(srs_origem, srs_destino)
+        cantos = [transformacao.TransformPoint(x, y)[:2] for x in (xmin, xmax) for y in (ymin, ymax)]
+        xmin = min(x for x, y in cantos)
+        xmax = max(x for x, y in cantos)
+        ymin = min(y for x, y in cantos)
+        ymax = max(y for x, y in cantos)
+    fonte = None
+    return (
+        np.floor(xmin / resolucao) * resolucao,
+        np.floor(ymin / resolucao) * resolucao,
+        np.ceil(xmax / resolucao) * resolucao,
+        np.ceil(ymax / resolucao) * resolucao,
+    )
+
+
+#Procura dentro do ZIP das imagens do sentinel2, as imagens jp2 de uma banda (ou da SCL) em todas as resoluções
+def imagens_da_banda(banda, ficheiro_zip):
+    return [
         nome
         for nome in ficheiro_zip.namelist()
-        if re.search(fr"B{banda:02d}_\d\dm\.jp2$", nome)
+        if re.search(fr"{nome_banda(banda)}_\d\dm\.jp2$", nome)
     ]
+
+
+#Procura dentro do ZIP das imagens do sentinel2, as imagens jp2 com melhor resulução para cada banda
+#Com "resolucao", escolhe a imagem nativa mais grosseira que não seja pior do que essa resolução
+#(ex: a 20 m, a banda 12 vem do R20m e a banda 8, que só existe a 10 m, do R10m), para ler menos dados
+def acha_melhor_imagem(banda, ficheiro_zip, resolucao=None):
+    imagens_na_banda = imagens_da_banda(banda, ficheiro_zip)
     imagens_na_banda.sort(key=lambda nome: int(nome.split("_")[-1].split("m")[0]))
+    if resolucao is not None:
+        suficientes = [nome for nome in imagens_na_banda if int(nome.split("_")[-1].split("m")[0]) <= resolucao]
+        if suficientes:
+            return suficientes[-1]
     return imagens_na_banda[0]
 
 
+#Verifica se todos os ficheiros do satélite têm a banda (ex: a SCL só existe nos produtos L2A completos)
+def produtos_tem_banda(ficheiros_de_satelite, banda):
+    if not isinstance(ficheiros_de_satelite, list):
+        ficheiros_de_satelite = [ficheiros_de_satelite]
+    for ficheiro_satelite in ficheiros_de_satelite:
+        with zipfile.ZipFile(ficheiro_satelite) as dados:
+            if not imagens_da_banda(banda, dados):
+                return False
+    return True
+
+
 #Realiza o recorte pelo shapefile do munícipio das bandas pretendidas antes e depois do incêndio e colocas no ficheiro temporario
-def realiza_recorte(zip_pre, zip_pos, shapefile, bandas_pre, bandas_pos, temporarios):
+#progresso(fracao) é chamado antes de cada banda extraída e de cada reamostragem; é também aí que um trabalho
+#cancelado é interrompido (o "update" da fila de trabalhos lança TrabalhoCancelado), sem esperar pelo fim do recorte
+def realiza_recorte(
+    zip_pre,
+    zip_pos,
+    shapefile,
+    bandas_pre,
+    bandas_pos,
+    temporarios,
+    ler_do_zip=LER_DIRETAMENTE_DO_ZIP,
+    uma_passagem=RECORTE_NUMA_SO_PASSAGEM,
+    n_tarefas=NUMERO_DE_TAREFAS,
+    memoria_mb=MEMORIA_RECORTE_MB,
+    usar_cache=USAR_CACHE_RECORTES,
+    instrumentacao=None,
+    resolucao=RESOLUCAO,
+    limites=None,
+    progresso=None,
+):
+    # Sem instrumentação, as fases não são registadas
+    if instrumentacao is None:
+        instrumentacao = Instrumentacao()
     # ficheiros antes do incendio -
     if not isinstance(zip_pre, list):
         zip_pre = [zip_pre]
         zip_pos = [zip_pos]
 
-    ficheiros_recortados = {}
+    # A mesma extensão para as duas épocas, para que as imagens fiquem na mesma grelha
+    # Com limites indicados (ex: uma janela do refinamento), é essa a extensão recortada
+    # A cache só guarda recortes do município inteiro, porque a chave não inclui a extensão
+    if limites is None:
+        limites = extensao_do_recorte(shapefile, resolucao)
+    else:
+        usar_cache = False
+    funcao_recorte = realiza_recorte_multibanda if uma_passagem else realiza_recorte_com_mosaico
+
+    # Procura na cache as bandas já recortadas; só as que faltam são extraídas e reamostradas
+    ficheiros_recortados = {"pre": {}, "pos": {}}
+    chaves = {}
+    bandas_em_falta = {}
+    hash_shapefile = cache_recortes.hash_do_recorte(shapefile) if usar_cache else None
+    for prefixo, zips, bandas in (("pre", zip_pre, bandas_pre), ("pos", zip_pos, bandas_pos)):
+        for banda in bandas:
+            if usar_cache:
+                chave = chaves[prefixo, banda] = cache_recortes.chave_recorte(
+                    zips, banda, hash_shapefile, EPSG_PORTUGAL, resolucao, uma_passagem, ler_do_zip
+                )
+                # Ligado à pasta temporária, para que não desapareça se outro processo limitar a cache
+                em_cache = cache_recortes.obtem(chave, temporarios / f"cache_{prefixo}_{nome_banda(banda)}.tif")
+                if em_cache is not None:
+                    ficheiros_recortados[prefixo][banda] = em_cache
+                    continue
+            bandas_em_falta.setdefault(prefixo, []).append(banda)
+
+    # Uma tarefa por época (recorte numa só passagem) ou por banda de cada época
+    if uma_passagem:
+        tarefas = [(prefixo, bandas) for prefixo, bandas in bandas_em_falta.items()]
+    else:
+        tarefas = [(prefixo, [banda]) for prefixo, bandas in bandas_em_falta.items() for banda in bandas]
+    em_paralelo = max(1, min(n_tarefas, len(tarefas)))
+    threads = max(1, (os.cpu_count() or 1) // em_paralelo)
+    memoria_mb = max(1, memoria_mb // em_paralelo)
+
+    # Progresso por passos: cada banda extraída de cada produto e cada reamostragem contam um passo
+    passos_extracao = {
+        prefixo: len(zip_pre if prefixo == "pre" else zip_pos) * len(bandas) for prefixo, bandas in bandas_em_falta.items()
+    }
+    total_passos = max(sum(passos_extracao.values()) + len(tarefas), 1)
+    passos_feitos = [0]
+    trinco_progresso = threading.Lock()
+
+    def _avanca():
+        if progresso is None:
+            return
+        with trinco_progresso:
+            fracao = passos_feitos[0] / total_passos
+            passos_feitos[0] += 1
+        progresso(fracao)
+
+    epocas = {}
+    for prefixo, bandas in bandas_em_falta.items():
+        with instrumentacao.fase("extracao", epoca=prefixo, bandas=list(bandas)):
+            epocas[prefixo] = extrai_bandas_do_zip_do_satelite(
+                zip_pre if prefixo == "pre" else zip_pos, bandas, temporarios, ler_do_zip, resolucao, _avanca
+            )
+
+    # O gdal.Warp liberta o GIL, por isso as tarefas correm em paralelo numa pool de threads
+    def _executa(tarefa):
+        _avanca()
+        prefixo, bandas_tarefa = tarefa
+        with instrumentacao.fase("warp", epoca=prefixo, bandas=list(bandas_tarefa)) as info:
+            recortados = funcao_recorte(
+                epocas[prefixo], shapefile, bandas_tarefa, temporarios, prefixo, limites, threads, memoria_mb, resolucao
+            )
+            georreferencia = obtem_georreferencia(next(iter(recortados.values())))
+            info.update(colunas=georreferencia["colunas"], linhas=georreferencia["linhas"])
+        # A execução continua a ler os recortes da pasta temporária: os da cache podem ser apagados a qualquer
+        # momento por limita_tamanho, desta ou de outra execução (ex: os trabalhos do processamento em lote)
+        if usar_cache:
+            for banda, caminho in recortados.items():
+                cache_recortes.guarda(chaves[prefixo, banda], caminho)
+        return prefixo, recortados
+
+    if tarefas:
+        executor = ThreadPoolExecutor(max_workers=em_paralelo)
+        try:
+            for prefixo, recortados in executor.map(_executa, tarefas):
+                ficheiros_recortados[prefixo].update(recortados)
+        except BaseException:
+            # Cancelado ou com erro: as reamostragens ainda na fila não chegam a começar
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    if usar_cache:
+        cache_recortes.limita_tamanho()
 
-    ficheiros_recortados["pre"] = realiza_recorte_com_mosaico(
-        extrai_bandas_do_zip_do_satelite(zip_pre, bandas_pre, temporarios),
-        shapefile, bandas_pre, temporarios, "pre"
-    )
+    return ficheiros_recortados
 
-    ficheiros_recortados["pos"] = realiza_recorte_com_mosaico(
-        extrai_bandas_do_zip_do_satelite(zip_pos, bandas_pos, temporarios),
-        shapefile, bandas_pos, temporarios, "pos"
-    )
 
-    return ficheiros_recortados
+# Devolve o caminho virtual do GDAL (/vsizip/) para um ficheiro dentro do ZIP do satélite
+# É devolvido como texto, porque o Path reduziria as duas barras de "/vsizip//caminho/absoluto"
+def caminho_vsizip(ficheiro_satelite, caminho_no_zip):
+    return f"/vsizip/{Path(ficheiro_satelite).resolve().as_posix()}/{caminho_no_zip}"
 
 
-# De cada ficheiro do satelite2, extrai as bandas desejadas na melhor resolução .jp2 para a pasta temporarios
-def extrai_bandas_do_zip_do_satelite(ficheiros_de_satelite, bandas, temporarios):
+# De cada ficheiro do satelite2, obtém as bandas desejadas na melhor resolução .jp2
+# Por defeito o GDAL lê as bandas diretamente do ZIP; só se não as conseguir abrir é que são extraídas para a pasta temporarios
+# antes_de_cada_banda() é chamada antes de cada banda de cada ficheiro (ex: para interromper um trabalho cancelado)
+def extrai_bandas_do_zip_do_satelite(
+    ficheiros_de_satelite, bandas, temporarios, ler_do_zip=LER_DIRETAMENTE_DO_ZIP, resolucao=None, antes_de_cada_banda=None
+):
     imagens_de_bandas = {}
     for ficheiro_satelite in ficheiros_de_satelite:
-        dados = zipfile.ZipFile(ficheiro_satelite)
-        for banda in bandas:
-            if banda not in imagens_de_bandas:
-                imagens_de_bandas[banda] = []
-            caminho_no_zip = acha_melhor_imagem(banda, dados)
-            caminho_imagem = Path(dados.extract(caminho_no_zip, temporarios))
-            imagens_de_bandas[banda].append(temporarios / caminho_no_zip)
+        with zipfile.ZipFile(ficheiro_satelite) as dados:
+            for banda in bandas:
+                if antes_de_cada_banda is not None:
+                    antes_de_cada_banda()
+                if banda not in imagens_de_bandas:
+                    imagens_de_bandas[banda] = []
+                caminho_no_zip = acha_melhor_imagem(banda, dados, resolucao)
+                if ler_do_zip:
+                    caminho_virtual = caminho_vsizip(ficheiro_satelite, caminho_no_zip)
+                    if gdal.Open(caminho_virtual) is not None:
+                        imagens_de_bandas[banda].append(caminho_virtual)
+                        continue
+                    print(f"Não foi possível ler {caminho_virtual} - a extrair para {temporarios}")
+                dados.extract(caminho_no_zip, temporarios)
+                imagens_de_bandas[banda].append(temporarios / caminho_no_zip)
     return imagens_de_bandas
 
 
 # Realiza o recorte das bandas pela shapefile do municipio
-def realiza_recorte_com_mosaico(imagens_de_bandas, shapefile, bandas, temporarios, prefixo):
+def realiza_recorte_com_mosaico(
+    imagens_de_bandas, shapefile, bandas, temporarios, prefixo, limites=None, threads=1, memoria_mb=None, resolucao=RESOLUCAO
+):
     ficheiros_recortados = {}
     for banda in bandas:
-        outclip = temporarios / f"{prefixo}_B{banda:02d}_10m_clip.tif"
-        recorte(imagens_de_bandas[banda], outclip, shapefile)
+        outclip = temporarios / f"{prefixo}_{nome_banda(banda)}_{resolucao}m_clip.tif"
+        recorte(imagens_de_bandas[banda], outclip, shapefile, limites, threads, memoria_mb, resolucao)
         ficheiros_recortados[banda] = outclip
     return ficheiros_recortados
 
 
+# Realiza o recorte de todas as bandas de uma época com um único gdal.Warp:
+# cria um VRT de mosaico por banda, empilha-os num VRT multibanda e reamostra essa pilha de uma só vez.
+# Devolve para cada banda um VRT que aponta para a banda correspondente do raster multibanda,
+# para que o resto do processo continue a receber um ficheiro por banda
+def realiza_recorte_multibanda(
+    imagens_de_bandas, shapefile, bandas, temporarios, prefixo, limites=None, threads=1, memoria_mb=None, resolucao=RESOLUCAO
+):
+    mosaicos = []
+    for banda in bandas:
+        caminho_mosaico = temporarios / f"{prefixo}_{nome_banda(banda)}_mosaico.vrt"
+        gdal.BuildVRT(str(caminho_mosaico), [str(caminho) for caminho in imagens_de_bandas[banda]])
+        mosaicos.append(str(caminho_mosaico))
+    caminho_pilha = temporarios / f"{prefixo}_pilha.vrt"
+    gdal.BuildVRT(str(caminho_pilha), mosaicos, separate=True, resolution="highest")
+
+    outclip = temporarios / f"{prefixo}_{resolucao}m_clip.tif"
+    recorte(caminho_pilha, outclip, shapefile, limites, threads, memoria_mb, resolucao)
+
+    ficheiros_recortados = {}
+    for indice, banda in enumerate(bandas):
+        caminho_banda = temporarios / f"{prefixo}_{nome_banda(banda)}_{resolucao}m_clip.vrt"
+        gdal.Translate(str(caminho_banda), str(outclip), format="VRT", bandList=[indice + 1])
+        ficheiros_recortados[banda] = caminho_banda
+    return ficheiros_recortados
+
+
 #Cria as composições coloridas RGB com as bandas (4 3 2), (8 4 3) e (12 8 4) com resolução de 10 metros 
-def composicao_rgb(ficheiros, prefixo_saida, referencia):
-    resultados = []
-    for composicoes in [(4, 3, 2), (8, 4, 3), (12, 8, 4)]:
-        canais = []
-        for banda in composicoes:
-            openb = gdal.Open(str(ficheiros[banda]))
-            canais.append(openb.GetRasterBand(1).ReadAsArray().astype(np.float))
-        caminho = pasta_resultados / (prefixo_saida + f"_RGB_{'_'.join(str(c) for c in composicoes)}.tif")
-        guarda_imagem_geo(caminho, np.dstack(canais), referencia)
-        resultados.append(caminho)
+#Cada banda é esticada para 1-255 (pelo seu valor máximo; 0 é o nodata, fora do recorte) e escrita bloco a bloco
+#numa imagem de 8 bits em memória, que é depois copiada para um Cloud-Optimized GeoTIFF comprimido e com pirâmides
+#Em cada bloco, cada banda é lida uma única vez e escrita em todas as composições em que entra
+#Os blocos são os do cálculo dos índices (com o halo do filtro), para que o armazém receba sempre as mesmas janelas
+#As bandas podem vir de ficheiros ({banda: caminho}) ou de um ArmazemBandas já partilhado com o resto do processo
+#"sufixo" é acrescentado ao nome de cada composição (ex: "_20m" no modo rápido, em que não ficam a 10 metros)
+#As composições são gravadas em "pasta_saida" (por defeito a pasta resultados)
+def composicao_rgb(
+    ficheiros, prefixo_saida, referencia, tamanho_bloco=TAMANHO_BLOCO, compressao=COMPRESSAO_RGB, armazem=None, prefixo="pos",
+    sufixo="", pasta_saida=None,
+):
+    pasta_saida = Path(pasta_saida or pasta_resultados)
+    armazem_proprio = armazem is None
+    if armazem_proprio:
+        armazem = ArmazemBandas({prefixo: ficheiros})
+    georreferencia = obtem_georreferencia(referencia)
+    composicoes = [(4, 3, 2), (8, 4, 3), (12, 8, 4)]
+    bandas = sorted({banda for composicao in composicoes for banda in composicao})
+    maximos = {banda: armazem.maximo(prefixo, banda) for banda in bandas}
+    resultados = [
+        pasta_saida / (prefixo_saida + f"_RGB_{'_'.join(str(c) for c in composicao)}{sufixo}.tif") for composicao in composicoes
+    ]
+    imagens = [
+        cria_imagem_geo(f"/vsimem/{caminho.name}", georreferencia, n_bandas=3, tipo=gdal.GDT_Byte, nodata=0)
+        for caminho in resultados
+    ]
+    janelas = janelas_de_blocos(georreferencia["colunas"], georreferencia["linhas"], tamanho_bloco, HALO_FILTRO)
+    for janela, janela_halo in janelas:
+        x0 = janela[0] - janela_halo[0]
+        y0 = janela[1] - janela_halo[1]
+        nucleo = (slice(y0, y0 + janela[3]), slice(x0, x0 + janela[2]))
+        canais = {
+            banda: estica_para_byte(armazem.janela(prefixo, banda, janela_halo, np.float32)[nucleo], maximos[banda])
+            for banda in bandas
+        }
+        for imagem, composicao in zip(imagens, composicoes):
+            for i, banda in enumerate(composicao):
+                imagem.GetRasterBand(i + 1).WriteArray(canais[banda], janela[0], janela[1])
+    for imagem, caminho in zip(imagens, resultados):
+        guarda_cog(imagem, caminho, compressao)
+    imagens = imagem = None
+    for caminho in resultados:
+        gdal.Unlink(f"/vsimem/{caminho.name}")
+    if armazem_proprio:
+        armazem.fecha()
     return resultados
 
+# Estica os valores de um canal para 1-255, dividindo pelo valor máximo do canal
+# O 0 fica reservado aos pixeis sem dados (fora do recorte), que é o nodata das composições: um pixel real muito
+# escuro (ex: água, área ardida) fica com 1 e não transparente
+def estica_para_byte(canal, max_val):
+    if max_val == 0:
+        max_val = 1
+    esticado = np.clip(1 + 254 * canal / max_val, 1, 255).astype(np.uint8)
+    esticado[canal <= 0] = 0
+    return esticado
+
+# Copia um dataset para um Cloud-Optimized GeoTIFF: em blocos de 512, comprimido e com pirâmides internas
+# Se o GDAL não tiver o driver COG (anterior à versão 3.1), cria um GeoTIFF em blocos com as pirâmides copiadas
+def guarda_cog(dataset, caminho, compressao=COMPRESSAO_RGB):
+    if gdal.GetDriverByName("COG") is not None:
+        opcoes = [f"COMPRESS={compressao}", "BLOCKSIZE=512", "OVERVIEWS=AUTO", "BIGTIFF=IF_SAFER"]
+        gdal.Translate(str(caminho), dataset, format="COG", creationOptions=opcoes)
+        return caminho
+    dataset.BuildOverviews("AVERAGE", [2, 4, 8, 16, 32])
+    opcoes = [
+        "TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", f"COMPRESS={compressao}", "COPY_SRC_OVERVIEWS=YES", "BIGTIFF=IF_SAFER",
+    ]
+    gdal.Translate(str(caminho), dataset, format="GTiff", creationOptions=opcoes)
+    return caminho
+
 # Guarda a composição colorida RGB de falsa cor em formato .tif mas sem ser georreferenciada
 def guarda_imagem_pil(resultado, canais, referencia):
     caminho_temp = temporarios / "imagem_nao_georefenciada_843.tif"
@@ -132,178 +477,429 @@ def guarda_imagem_pil(resultado, canais, referencia):
     for canal in (0, 1, 2):
         max_val = canais[:, :, canal].max()
         print(max_val)
-        if max_val == 0:
-            max_val = 1
-        dados[:, :, canal] = 255 * canais[:, :, canal] / max_val
+        dados[:, :, canal] = estica_para_byte(canais[:, :, canal], max_val)
     img = Image.fromarray(dados)
     img.save(caminho_temp)
 
-# Abre a composição colorida RGB de falsa cor não georreferenciada e cria a mesma mas já georreferencia na pasta resultados
-def guarda_imagem_geo(caminho_resultado, dados, referencia):
+# Lê uma única vez as dimensões, a georreferenciação e a projeção de um raster de referência
+# Se já receber estes dados (um dicionário), devolve-os sem voltar a abrir o raster
+def obtem_georreferencia(referencia):
+    if isinstance(referencia, dict):
+        return referencia
     dataset = gdal.Open(str(referencia), gdal.GA_ReadOnly)
+    return {
+        "colunas": dataset.RasterXSize,
+        "linhas": dataset.RasterYSize,
+        "geotransform": dataset.GetGeoTransform(),
+        "projecao": dataset.GetProjection(),
+    }
+
+# Cria um GeoTIFF vazio com as dimensões, a georreferenciação e a projeção da referência (ver obtem_georreferencia)
+# O caminho pode ser um ficheiro em memória do GDAL (/vsimem/)
+# "opcoes" são as opções de criação do GTiff (ex: SPARSE_OK=TRUE para não gravar os blocos que nunca são escritos)
+def cria_imagem_geo(caminho_resultado, referencia, n_bandas=1, tipo=gdal.GDT_Float32, nodata=NODATA, opcoes=None):
+    georreferencia = obtem_georreferencia(referencia)
     imgdriver = gdal.GetDriverByName("GTiff")
     imgdriver.Register()
-    nCols, nRows = dataset.RasterXSize, dataset.RasterYSize
-    reclassificada = imgdriver.Create(
-        str(caminho_resultado), nCols, nRows, 3, gdal.GDT_Float32
-    )
-    geoTransf = dataset.GetGeoTransform()
-    reclassificada.SetGeoTransform(geoTransf)
-    proj = dataset.GetProjection()
-    reclassificada.SetProjection(proj)
-    #No final do processo apresenta 100 "*"
-    print(dados.shape, "*" * 100)
-    for i in range(3):
-        banda = reclassificada.GetRasterBand(i + 1)
-        banda.WriteArray(dados[:, :, i])
-        banda.SetNoDataValue(-9999)
-    reclassificada.FlushCache()
-    reclassificada = None
-    banda = None
-
-# Função de calculo NDVI e DNBR (depende das bandas)
-def calcula(ficheiros, banda1, banda2):
-    openb = gdal.Open(str(ficheiros[banda1]))
-    b_a = openb.GetRasterBand(1).ReadAsArray().astype(np.float)
-    openb = gdal.Open(str(ficheiros[banda2]))
-    b_b = openb.GetRasterBand(1).ReadAsArray().astype(np.float)
-    # Calcular o pre NDVI/DNBR com a mascara e atribuir o valor -9999 aos valores de nulos
-    d1 = b_a - b_b
-    s1 = b_a + b_b
-    pre_calculado = np.divide(d1, s1, out=np.full_like(d1, -9999), where=s1 != 0)
-    return pre_calculado
-
-
+    nCols, nRows = georreferencia["colunas"], georreferencia["linhas"]
+    imagem = imgdriver.Create(str(caminho_resultado), nCols, nRows, n_bandas, tipo, options=opcoes or [])
+    imagem.SetGeoTransform(georreferencia["geotransform"])
+    imagem.SetProjection(georreferencia["projecao"])
+    if nodata is not None:
+        for i in range(n_bandas):
+            imagem.GetRasterBand(i + 1).SetNoDataValue(nodata)
+    return imagem
+
+# Devolve o caminho de um ficheiro intermédio de acordo com a política de intermédios, ou None se não for para criar
+# Com a política "nenhum" só são criados os intermédios obrigatórios (em memória)
+def caminho_intermedio(politica, temporarios, nome, obrigatorio=False):
+    if politica == "persistir":
+        return str(temporarios / nome)
+    if politica == "memoria" or obrigatorio:
+        return f"/vsimem/{temporarios.name}/{nome}"
+    return None
+
+# Divide um raster com n_colunas x n_linhas em blocos e devolve, para cada bloco, a janela (xoff, yoff, xsize, ysize)
+# e a mesma janela alargada pelo halo (limitada às margens da imagem)
+# Com "area" (xoff, yoff, xsize, ysize), só essa parte do raster é dividida; o halo pode sair da área, até às margens da imagem
+def janelas_de_blocos(n_colunas, n_linhas, tamanho_bloco=TAMANHO_BLOCO, halo=0, area=None):
+    area_x, area_y, area_colunas, area_linhas = area or (0, 0, n_colunas, n_linhas)
+    for yoff in range(area_y, area_y + area_linhas, tamanho_bloco):
+        ysize = min(tamanho_bloco, area_y + area_linhas - yoff)
+        for xoff in range(area_x, area_x + area_colunas, tamanho_bloco):
+            xsize = min(tamanho_bloco, area_x + area_colunas - xoff)
+            x_inicio = max(xoff - halo, 0)
+            y_inicio = max(yoff - halo, 0)
+            x_fim = min(xoff + xsize + halo, n_colunas)
+            y_fim = min(yoff + ysize + halo, n_linhas)
+            yield (xoff, yoff, xsize, ysize), (x_inicio, y_inicio, x_fim - x_inicio, y_fim - y_inicio)
+
+# Calcula, bloco a bloco, a diferença de cada índice, o filtro e a reclassificação e escreve-os nas imagens
+# "reclassificadas" e "nao_filtradas" ({índice: dataset}). As janelas (bloco, bloco com halo) são as do armazém;
+# na escrita são somadas ao deslocamento (dx, dy), para preencher uma parte de uma imagem maior (ver refinamento.py)
+# progresso(fracao) é chamado depois de cada bloco
+# Devolve o número de blocos sem nenhum pixel válido e a extensão (xmin, ymin, xmax, ymax) dos restantes, já deslocada
+def calcula_blocos(
+    armazem, indices, bandas, limiares, reclassificadas, nao_filtradas, janelas, tipo=TIPO_CALCULO,
+    filtro=FILTRO_RECLASSIFICACAO, usar_scl=False, instrumentacao=None, deslocamento=(0, 0), progresso=None,
+):
+    if instrumentacao is None:
+        instrumentacao = Instrumentacao()
+    dx, dy = deslocamento
+    # Arrays dos cálculos reaproveitados entre blocos, em vez de criar novos em cada bloco
+    buffers = {}
+    # Blocos sem nenhum pixel válido (fora da linha de corte, sem dados, nuvens ou água) e
+    # extensão dos restantes, a única que é convertida em vetorial
+    blocos_ignorados = 0
+    extensao_valida = None
+    for contador, (janela, janela_halo) in enumerate(janelas):
+        dimensoes = {"colunas": janela_halo[2], "linhas": janela_halo[3]}
+        # Retirar o halo e ficar apenas com o bloco
+        x0 = janela[0] - janela_halo[0]
+        y0 = janela[1] - janela_halo[1]
+        nucleo = (slice(y0, y0 + janela[3]), slice(x0, x0 + janela[2]))
+        xoff, yoff = janela[0] + dx, janela[1] + dy
+
+        # Ler cada banda uma única vez, na janela alargada pelo halo do filtro
+        with instrumentacao.fase("leitura", **dimensoes):
+            lidas_pre = {banda: armazem.janela("pre", banda, janela_halo, tipo) for banda in bandas}
+            lidas_pos = {banda: armazem.janela("pos", banda, janela_halo, tipo) for banda in bandas}
+            valida = mascara_valida(
+                armazem.janela("pre", BANDA_SCL, janela_halo) if usar_scl else None,
+                armazem.janela("pos", BANDA_SCL, janela_halo) if usar_scl else None,
+                lidas_pre[bandas[0]],
+                lidas_pos[bandas[0]],
+            )
+
+        # Bloco todo mascarado: a reclassificação seria toda 0, por isso não é calculado, filtrado nem escrito
+        if not valida[nucleo].any():
+            blocos_ignorados += 1
+            if progresso is not None:
+                progresso((contador + 1) / len(janelas))
+            continue
+        extensao_valida = junta_extensoes(extensao_valida, (xoff, yoff, xoff + janela[2], yoff + janela[3]))
+
+        # Calcular a diferenca de cada índice entre antes e depois do incêndio
+        # Os pixeis mascarados ficam com o valor de nodata, que é inferior a qualquer limiar:
+        # não são ardidos nem contam como ardidos no filtro dos vizinhos
+        with instrumentacao.fase("calculo", **dimensoes):
+            diferencas = calcula_diferencas(indices, lidas_pre, lidas_pos, buffers)
+            invalida = ~valida
+            for diferenca in diferencas.values():
+                diferenca[invalida] = NODATA
+
+        for indice, diferenca in diferencas.items():
+            if indice in nao_filtradas:
+                with instrumentacao.fase("escrita_diferenca", indice=indice, colunas=janela[2], linhas=janela[3]):
+                    nao_filtradas[indice].GetRasterBand(1).WriteArray(diferenca[nucleo], xoff, yoff)
+            if limiares[indice] is None:
+                continue
+            # Aplicar o filtro mediana de  5x5 e reclassificar o filtro em que:
+            # As celulas com valor igual ou superior ao valor do filtro passam a ter valor 1
+            with instrumentacao.fase("filtro", indice=indice, **dimensoes):
+                filtrada = FILTROS[filtro](diferenca, limiares[indice])
+            with instrumentacao.fase("reclassificacao", indice=indice, colunas=janela[2], linhas=janela[3]):
+                reclass = (filtrada[nucleo] & valida[nucleo]).astype(np.uint8)
+                reclassificadas[indice].GetRasterBand(1).WriteArray(reclass, xoff, yoff)
+        #Mensagem de indicação do que está a realizar na barra de progressos
+        if progresso is not None:
+            progresso((contador + 1) / len(janelas))
+    return blocos_ignorados, extensao_valida
+
+
+# União de duas extensões (xmin, ymin, xmax, ymax); a primeira pode ser None
+def junta_extensoes(extensao, outra):
+    if extensao is None:
+        return tuple(outra)
+    return (min(extensao[0], outra[0]), min(extensao[1], outra[1]), max(extensao[2], outra[2]), max(extensao[3], outra[3]))
+
+
+# Janela (xoff, yoff, xsize, ysize) de uma extensão em pixeis (xmin, ymin, xmax, ymax); (0, 0, 0, 0) se não houver extensão
+def janela_da_extensao(extensao):
+    if extensao is None:
+        return (0, 0, 0, 0)
+    return (extensao[0], extensao[1], extensao[2] - extensao[0], extensao[3] - extensao[1])
+
+
+#Processa as imagens antes e depois do incêndio e cria, para cada índice pedido (ver indices.INDICES),
+#recortadas pela shapefile indicada ou, se for None, pelo limite do município com o código "dico" na CAOP,
+#o raster da diferença e a shapefile das áreas ardidas com o nome "<prefixo_saida>_d<indice>"
+#ou, se indicado em "nomes_saida" ({índice: nome}), com outro nome (ex: só "<prefixo_saida>", como antes dos vários índices)
+#No modo rápido, as composições RGB e as diferenças dos índices sem limiar ficam à resolução da triagem,
+#com o sufixo "_<resolução>m" no nome (ex: "<prefixo_saida>_RGB_4_3_2_20m.tif", "<prefixo_saida>_dbai_20m.tif")
+#Cada banda é lida uma única vez por bloco, mesmo quando é usada por vários índices
+#Os resultados e o relatório são gravados em "pasta_saida" (por defeito a pasta resultados); com aprende_pesos=False
+#a execução não atualiza os pesos das fases da barra de progresso (ex: execuções com dados sintéticos, ver desempenho.py)
 def processa(
     zip_pre,
     zip_pos,
     prefixo_saida,
-    valor_filtro_reclass,
-    bandas,
     shape_recorte,
+    indices=("ndvi",),
     update=None,
+    tamanho_bloco=TAMANHO_BLOCO,
+    limiares=None,
+    tipo=TIPO_CALCULO,
+    filtro=FILTRO_RECLASSIFICACAO,
+    formato=FORMATO_VETORIAL,
+    intermedios=INTERMEDIOS,
+    memoria_bandas_mb=MEMORIA_BANDAS_MB,
+    dico=None,
+    relatorio=RELATORIO_EXECUCAO,
+    trace=TRACE_CHROME,
+    usar_scl=USAR_MASCARA_SCL,
+    modo_rapido=MODO_RAPIDO,
+    resolucao_triagem=None,
+    nomes_saida=None,
+    usar_cache=USAR_CACHE_RECORTES,
+    pasta_saida=None,
+    aprende_pesos=True,
 ):
+    pasta_saida = Path(pasta_saida or pasta_resultados)
     if not update:
         update = lambda msg, v: None
+    if intermedios not in POLITICAS_INTERMEDIOS:
+        raise ValueError(f"Política de intermédios desconhecida: {intermedios}")
+    # Sem shapefile de recorte escolhida, usa o limite do município (DICO) criado a partir da CAOP
+    if shape_recorte is None:
+        if dico is None:
+            raise ValueError("Indique a shapefile de recorte ou o código DICO do município")
+        shape_recorte = recortes_municipais.recorte_municipio(dico)
+    limiares_pedidos = limiares or {}
+    limiares = {indice: limiares_pedidos.get(indice, INDICES[indice]["limiar"]) for indice in indices}
+    nomes_saida = {indice: (nomes_saida or {}).get(indice, f"{prefixo_saida}_d{indice}") for indice in indices}
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    temporarios = caminhoimagoriginais / f"temporarios{timestamp}"
-    temporarios.mkdir(exist_ok=True)
-    #Mensagem de indicação do que está a realizar na barra de progressos
-    update(5, "A realizar os recortes das bandas do sentinel 2 pelos limites do munícipio ")
-
-    bandas_pre = bandas
-    bandas_pos = list(bandas)
-    for b in (12, 8, 4, 3, 2):
-        if b not in bandas_pos:
-            bandas_pos.append(b)
-    
-    fich_recortados = realiza_recorte(
-        zip_pre, zip_pos, shape_recorte, bandas_pre, bandas_pos, temporarios
-    )
-    #Mensagem de indicação do que está a realizar na barra de progressos
-    update(20, "A guardar as composições RGB das bandas [4 3 2], [8 4 3] e [12 8 4]")
-    caminho_anterior = fich_recortados["pre"][bandas[0]]
-    imagens_compostas = composicao_rgb(
-        fich_recortados["pos"], prefixo_saida, referencia=caminho_anterior
-    )
-    pre = calcula(fich_recortados["pre"], bandas[0], bandas[1])
-    pos = calcula(fich_recortados["pos"], bandas[0], bandas[1])
-
-    # Calcular a diferenca entre NDVI/NDBR
-    diferenca = pre - pos
-
+    # Pasta única por execução, para que vários processos em simultâneo (ex: processamento em lote) não partilhem ficheiros
+    temporarios = Path(tempfile.mkdtemp(prefix=f"temporarios{timestamp}_", dir=caminhoimagoriginais))
+    if modo_rapido:
+        from sentinel import refinamento
+
+        resolucao_triagem = resolucao_triagem or refinamento.RESOLUCAO_TRIAGEM
+        print(
+            f"Modo rápido: as composições RGB e as diferenças dos índices sem limiar ficam a {resolucao_triagem} m "
+            f"(com o sufixo _{resolucao_triagem}m no nome)"
+        )
+    sufixo_triagem = f"_{resolucao_triagem}m" if modo_rapido else ""
+    # Regista o tempo, a memória e o I/O de cada fase; a barra de progresso usa os pesos medidos das fases
+    instrumentacao = Instrumentacao(update, FASES_PROCESSO, PESOS_FASES)
+    armazem = None
+    try:
+        with instrumentacao.fase("recorte"):
+            bandas_pre = bandas_necessarias(indices)
+            bandas_pos = list(bandas_pre)
+            for b in (12, 8, 4, 3, 2):
+                if b not in bandas_pos:
+                    bandas_pos.append(b)
+            # A SCL só é usada se existir em todos os produtos das duas épocas (ex: não existe nos downloads parciais antigos)
+            usar_scl = usar_scl and produtos_tem_banda(zip_pre, BANDA_SCL) and produtos_tem_banda(zip_pos, BANDA_SCL)
+            if usar_scl:
+                bandas_mascara = [BANDA_SCL]
+            else:
+                bandas_mascara = []
+                print("Sem a classificação da cena (SCL) em todos os produtos - só são excluídos os pixeis sem dados")
+
+            # No modo rápido, este é o recorte da triagem, à resolução mais grosseira
+            fich_recortados = realiza_recorte(
+                zip_pre, zip_pos, shape_recorte, bandas_pre + bandas_mascara, bandas_pos + bandas_mascara, temporarios,
+                usar_cache=usar_cache, instrumentacao=instrumentacao, resolucao=resolucao_triagem if modo_rapido else RESOLUCAO,
+                progresso=lambda fracao: instrumentacao.avanca("recorte", fracao),
+            )
+        # A georreferenciação é lida uma única vez e usada em todas as imagens criadas
+        # (no modo rápido, as composições RGB ficam à resolução da triagem e os índices na grelha de 10 m)
+        georreferencia = georreferencia_recortes = obtem_georreferencia(fich_recortados["pre"][bandas_pre[0]])
+        if modo_rapido:
+            georreferencia = refinamento.grelha_do_recorte(shape_recorte)
+        n_colunas, n_linhas = georreferencia["colunas"], georreferencia["linhas"]
+        with instrumentacao.fase("rgb", colunas=georreferencia_recortes["colunas"], linhas=georreferencia_recortes["linhas"]):
+            # Cada banda recortada é lida uma única vez e partilhada pelas composições RGB e pelo cálculo dos índices
+            armazem = ArmazemBandas(fich_recortados, memoria_bandas_mb)
+            imagens_compostas = composicao_rgb(
+                fich_recortados["pos"], prefixo_saida, referencia=georreferencia_recortes, armazem=armazem,
+                tamanho_bloco=tamanho_bloco, sufixo=sufixo_triagem, pasta_saida=pasta_saida,
+            )
+        with instrumentacao.fase("indices", colunas=n_colunas, linhas=n_linhas, indices=list(indices)):
+            # Criar, para cada índice, o tif da reclassificacao e o da diferenca sem filtros, que são preenchidos bloco a bloco
+            # As imagens reclassificadas (0/1) são do tipo Byte e só servem para criar o vetorial
+            caminhos_tif = {
+                indice: caminho_intermedio(intermedios, temporarios, f"diferenca_reclassificada_{indice}.tif", obrigatorio=True)
+                for indice in indices
+                if limiares[indice] is not None
+            }
+            # Os blocos sem pixeis válidos não são escritos: ficam a 0 sem ocupar espaço (SPARSE_OK)
+            reclassificadas = {
+                indice: cria_imagem_geo(
+                    caminho, georreferencia, tipo=gdal.GDT_Byte, nodata=None,
+                    opcoes=["SPARSE_OK=TRUE", "TILED=YES", "COMPRESS=DEFLATE"],
+                )
+                for indice, caminho in caminhos_tif.items()
+            }
+            # A diferença sem filtros é um intermédio, exceto nos índices sem limiar, em que é o produto final
+            caminhos_nao_filtrados = {}
+            for indice in indices:
+                if limiares[indice] is None:
+                    caminhos_nao_filtrados[indice] = pasta_saida / f"{nomes_saida[indice]}{sufixo_triagem}.tif"
+                else:
+                    caminhos_nao_filtrados[indice] = caminho_intermedio(intermedios, temporarios, f"diferenca_sem_filtros_{indice}.tif")
+            # Nos blocos que não são escritos, o GTiff esparso devolve o valor de nodata
+            # No modo rápido, a diferença dos índices sem limiar é gravada na triagem
+            nao_filtradas = {
+                indice: cria_imagem_geo(caminho, georreferencia, opcoes=["SPARSE_OK=TRUE", "TILED=YES"])
+                for indice, caminho in caminhos_nao_filtrados.items()
+                if caminho is not None and not (modo_rapido and limiares[indice] is None)
+            }
+
+            progresso = lambda fracao: instrumentacao.avanca("indices", fracao, "A criar as imagens reclassificadas")
+            if modo_rapido:
+                with instrumentacao.fase("triagem", colunas=georreferencia_recortes["colunas"], linhas=georreferencia_recortes["linhas"]):
+                    candidatos = refinamento.candidatos_triagem(
+                        armazem, indices, bandas_pre, limiares, georreferencia_recortes,
+                        {indice: caminhos_nao_filtrados[indice] for indice in indices if limiares[indice] is None},
+                        usar_scl, tipo,
+                    )
+                    janelas_finas = refinamento.janelas_refinamento(candidatos, georreferencia_recortes, georreferencia)
+                print(
+                    f"Triagem a {resolucao_triagem} m: {int(candidatos.sum())} pixeis candidatos, "
+                    f"{len(janelas_finas)} janelas a refinar a {RESOLUCAO} m "
+                    f"({sum(janela[2] * janela[3] for janela in janelas_finas) / max(n_colunas * n_linhas, 1):.1%} da área)"
+                )
+                n_blocos, blocos_ignorados, extensao_valida = refinamento.refina_janelas(
+                    zip_pre, zip_pos, shape_recorte, indices, bandas_pre, bandas_pre + bandas_mascara, limiares,
+                    janelas_finas, georreferencia, reclassificadas, nao_filtradas, temporarios, tamanho_bloco, tipo, filtro,
+                    usar_scl, memoria_bandas_mb, instrumentacao, progresso,
+                )
+            else:
+                janelas = list(janelas_de_blocos(n_colunas, n_linhas, tamanho_bloco, HALO_FILTRO))
+                n_blocos = len(janelas)
+                blocos_ignorados, extensao_valida = calcula_blocos(
+                    armazem, indices, bandas_pre, limiares, reclassificadas, nao_filtradas, janelas, tipo, filtro, usar_scl,
+                    instrumentacao, progresso=progresso,
+                )
+
+            for imagem in list(reclassificadas.values()) + list(nao_filtradas.values()):
+                imagem.FlushCache()
+            reclassificadas = nao_filtradas = imagem = None
+
+        with instrumentacao.fase("vetorial"):
+            shapefiles = {}
+            for indice in indices:
+                if limiares[indice] is None:
+                    print(f"Sem limiar definido para o índice {indice} - só é criada a diferença {caminhos_nao_filtrados[indice]}")
+                    continue
+                ficheiro_destino = pasta_saida / f"{nomes_saida[indice]}.{formato}"
+                # Só a extensão dos blocos com pixeis válidos é percorrida pelo gdal.Polygonize
+                janela_valida = janela_da_extensao(extensao_valida)
+                with instrumentacao.fase("poligonizacao", indice=indice, colunas=janela_valida[2], linhas=janela_valida[3]):
+                    poligoniza(caminhos_tif[indice], ficheiro_destino, formato, janela_valida)
+                shapefiles[indice] = str(ficheiro_destino)
+
+        relatorio_armazem = armazem.relatorio()
+        print(f"Blocos sem pixeis válidos (não calculados): {blocos_ignorados} de {n_blocos}")
+        print(
+            f"Bandas lidas: {relatorio_armazem['leituras']} ({relatorio_armazem['bytes_lidos'] / 2**20:.1f} MB), "
+            f"leituras poupadas: {relatorio_armazem['leituras_poupadas']} ({relatorio_armazem['bytes_poupados'] / 2**20:.1f} MB)"
+        )
+        # Libertar as bandas e fechar os recortes antes de apagar a pasta temporária
+        armazem.fecha()
+    except BaseException:
+        # Processo cancelado ou com erro: liberta as bandas e não deixa intermédios em memória nem a pasta temporária
+        if armazem is not None:
+            armazem.fecha()
+        for nome in gdal.ReadDir(f"/vsimem/{temporarios.name}") or []:
+            gdal.Unlink(f"/vsimem/{temporarios.name}/{nome}")
+        if intermedios != "persistir":
+            shutil.rmtree(temporarios, ignore_errors=True)
+        if relatorio:
+            # Um erro a gravar o relatório não pode esconder o erro do processo
+            try:
+                guarda_relatorio(
+                    instrumentacao, prefixo_saida, trace, pasta_saida, aprende_pesos, estado="erro", indices=list(indices)
+                )
+            except OSError:
+                pass
+        raise
+
+    with instrumentacao.fase("limpeza"):
+        #Apaga os intermédios em memória e a pasta dos ficherios temporários (exceto se for para os manter para depuração)
+        for caminho in list(caminhos_tif.values()) + list(caminhos_nao_filtrados.values()):
+            if str(caminho).startswith("/vsimem/"):
+                gdal.Unlink(str(caminho))
+        if intermedios == "persistir":
+            print(f"Ficheiros intermédios mantidos em {temporarios}")
+        else:
+            shutil.rmtree(temporarios)
+    if relatorio:
+        guarda_relatorio(
+            instrumentacao, prefixo_saida, trace, pasta_saida, aprende_pesos, estado="concluido", indices=list(indices),
+            colunas=n_colunas, linhas=n_linhas, armazem_bandas=relatorio_armazem,
+            mascara_scl=usar_scl, blocos=n_blocos, blocos_ignorados=blocos_ignorados,
+            modo_rapido=modo_rapido, resolucao_triagem=resolucao_triagem if modo_rapido else None,
+        )
     #Mensagem de indicação do que está a realizar na barra de progressos
-    update(25, "A aplicar o filtro mediana 5x5")
-    # Aplicar o filtro mediana de  5x5
-    filtro = ndimage.median_filter(diferenca, 5)
+    update(100, "Processo Completo: As Shapefiles e as composições de falsa cor estão na pasta 'resultados'")
+    return shapefiles
 
-    # Reclassificar o filtro em que:
-    # As celulas com valor igual ou superior ao valor do filtro passam a ter valor 1
-    reclass = (filtro > valor_filtro_reclass) * 1
 
-    #Mensagem de indicação do que está a realizar na barra de progressos
-    update(25, "A criar a imagem reclassificada")
-    # Criar o tif da reclassificacao
-    caminho_tif = temporarios / "diferenca_reclassificada.tif"
-
-    georefencia_imagem(caminho_anterior, caminho_tif, reclass)
+# Grava o relatório da execução (e o trace do Chrome, se pedido) na pasta resultados, com o nome dos resultados
+def guarda_relatorio(instrumentacao, prefixo_saida, trace=False, pasta_saida=None, aprende_pesos=True, **info):
+    pasta_saida = Path(pasta_saida or pasta_resultados)
+    caminho_relatorio = pasta_saida / f"{prefixo_saida}_relatorio.json"
+    caminho_trace = pasta_saida / f"{prefixo_saida}_trace.json" if trace else None
+    instrumentacao.guarda(caminho_relatorio, caminho_trace, aprende_pesos, prefixo=prefixo_saida, **info)
+    print(f"Relatório da execução em {caminho_relatorio}")
 
-    caminho_nao_filtrado = temporarios / "diferenca_sem_filtros.tif"
-    georefencia_imagem(caminho_anterior, caminho_nao_filtrado, diferenca)
 
-    #Mensagem de indicação do que está a realizar na barra de progressos
-    update(70, "A transformar a imagem reclassificada em vetorial")
-    # Criar a Shapefile a partir do raster reclassificado só com os valores de 1
+#Cria o ficheiro vetorial (Shapefile ou GeoPackage) a partir do raster reclassificado só com os valores de 1
+#O sistema de referência é gravado pelo próprio OGR (.prj na shapefile, tabela de SRS no GeoPackage)
+def poligoniza(caminho_tif, ficheiro_destino, formato=FORMATO_VETORIAL, janela=None):
     # abrir o raster a converter em vetor
+    # Com uma janela (xoff, yoff, xsize, ysize), só essa parte do raster é convertida, através de um VRT em memória
     band = gdal.Open(str(caminho_tif))
-    srsband = band.GetRasterBand(1)
-    # criar a camada vetorial
-    drv = ogr.GetDriverByName("ESRI Shapefile")
-    ficheiro_destino = pasta_resultados / (prefixo_saida + ".shp")
-    ficheiro_destino.write_bytes(shape_recorte.read_bytes())
+    caminho_vrt = None
+    if janela is not None and tuple(janela) != (0, 0, band.RasterXSize, band.RasterYSize):
+        if janela[2] and janela[3]:
+            caminho_vrt = f"/vsimem/poligoniza_{Path(str(caminho_tif)).stem}_{id(band)}.vrt"
+            band = gdal.Translate(caminho_vrt, band, format="VRT", srcWin=list(janela))
+        else:
+            band = None
+    srsband = band.GetRasterBand(1) if band is not None else None
+    spatialRef = osr.SpatialReference()
+    spatialRef.ImportFromEPSG(EPSG_PORTUGAL)
+    # criar a camada vetorial, apagando o ficheiro se já existir de uma execução anterior
+    drv = ogr.GetDriverByName(FORMATOS_VETORIAIS[formato])
+    if ficheiro_destino.exists():
+        drv.DeleteDataSource(str(ficheiro_destino))
     dst_ds = drv.CreateDataSource(str(ficheiro_destino))
-    dst_layer = dst_ds.CreateLayer(str(ficheiro_destino), srs=None)
+    opcoes = ["SPATIAL_INDEX=YES"] if formato == "gpkg" else []
+    dst_layer = dst_ds.CreateLayer(ficheiro_destino.stem, srs=spatialRef, geom_type=ogr.wkbPolygon, options=opcoes)
     fd = ogr.FieldDefn("DN", ogr.OFTInteger)
     dst_layer.CreateField(fd)
-    # Criar a shapefile com os valores de 1 no campo DN
-    gdal.Polygonize(srsband, srsband, dst_layer, -0, [], callback=None)
-    # Criar o ficheiro do sistema de referencia PRJ
-    spatialRef = osr.SpatialReference()
-    spatialRef.ImportFromEPSG(EPSG_PORTUGAL)
-    spatialRef.MorphToESRI()
-
-    #Mensagem de indicação do que está a realizar na barra de progressos
-    update(95, "A criar o arquivo de projeto")
-    with open(str(pasta_resultados / (prefixo_saida + ".prj")), "w") as prj_file:
-        prj_file.write(spatialRef.ExportToWkt())
-    #Mensagem de indicação do que está a realizar na barra de progressos
-    update(99, "A remover os ficheiros temporários")
-    #Apaga a pasta dos ficherios temporários
-    shutil.rmtree(temporarios)
-    #Mensagem de indicação do que está a realizar na barra de progressos
-    update(100, "Processo Completo: A Shapefile e a composição de falsa cor está na pasta 'resultados'")
-    return str(pasta_resultados / (prefixo_saida + ".shp"))
-
-
-def georefencia_imagem(caminho_anterior, caminho_tif, dados):
-    # Criar o tif da reclassificacao
-    dataset = gdal.Open(str(caminho_anterior), gdal.GA_ReadOnly)
-    imgdriver = gdal.GetDriverByName("GTiff")
-    imgdriver.Register()
-    nCols = dataset.RasterXSize
-    nRows = dataset.RasterYSize
-    reclndvi = imgdriver.Create(str(caminho_tif), nCols, nRows, 1, gdal.GDT_Float32)
-    geoTransf = dataset.GetGeoTransform()
-    reclndvi.SetGeoTransform(geoTransf)
-    proj = dataset.GetProjection()
-    reclndvi.SetProjection(proj)
-    banda = reclndvi.GetRasterBand(1)
-    banda.WriteArray(dados)
-    banda.SetNoDataValue(-9999)
-    reclndvi.FlushCache()
-    reclndvi = None
-    banda = None
-
-#Função que define o processo do dndvi com a escolha das bandas e do valor para áreas ardidas da reclassificação
+    # Criar os polígonos com os valores de 1 no campo DN, numa única transação
+    # Sem janela válida (tudo mascarado), a camada fica vazia
+    dst_layer.StartTransaction()
+    if srsband is not None:
+        gdal.Polygonize(srsband, srsband, dst_layer, 0, [], callback=None)
+    dst_layer.CommitTransaction()
+    dst_ds = None
+    srsband = band = None
+    if caminho_vrt is not None:
+        gdal.Unlink(caminho_vrt)
+    return ficheiro_destino
+
+
+#Função que define o processo do dndvi (NDVI com as bandas 8 e 4 e o valor para áreas ardidas da reclassificação no registo de índices)
+#A shapefile mantém o nome "<prefixo>.shp"
 def processa_dndvi(zip_pre, zip_pos, prefixo, shape_recorte, update=None):
     return processa(
-        zip_pre,
-        zip_pos,
-        prefixo,
-        0.17767,
-        bandas=(8, 4),
-        shape_recorte=shape_recorte,
-        update=update,
-    )
+        zip_pre, zip_pos, prefixo, shape_recorte, indices=("ndvi",), update=update, nomes_saida={"ndvi": prefixo}
+    )["ndvi"]
 
-#Função que define o processo do dnbr com a escolha das bandas e do valor para áreas ardidas da reclassificação
+#Função que define o processo do dnbr (NBR com as bandas 8 e 12 e o valor para áreas ardidas da reclassificação no registo de índices)
+#A shapefile mantém o nome "<prefixo>.shp"
 def processa_dnbr(zip_pre, zip_pos, prefixo, shape_recorte, update=None):
     return processa(
-        zip_pre,
-        zip_pos,
-        prefixo,
-        0.100,
-        bandas=(8, 12),
-        shape_recorte=shape_recorte,
-        update=update,
-    )
+        zip_pre, zip_pos, prefixo, shape_recorte, indices=("nbr",), update=update, nomes_saida={"nbr": prefixo}
+    )["nbr"]
+
+#Cria o dNDVI e o dNBR numa só passagem pelas imagens
+def processa_dndvi_dnbr(zip_pre, zip_pos, prefixo, shape_recorte, update=None):
+    return processa(zip_pre, zip_pos, prefixo, shape_recorte, indices=("ndvi", "nbr"), update=update)
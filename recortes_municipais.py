@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Importar as bibliotecas
+import hashlib
+import os
+
+import osgeo.ogr as ogr
+import osgeo.osr as osr
+
+from sentinel import ler_envelope
+from sentinel.pastas import pasta_cache
+
+# EPSG de Portugal continental, o mesmo das imagens recortadas
+EPSG_PORTUGAL = 3763
+
+# Tolerância (em metros) da simplificação dos limites municipais: metade do pixel de 10 metros
+TOLERANCIA_SIMPLIFICACAO = 5
+
+# Pasta onde ficam os limites dos municípios já dissolvidos, projetados e simplificados (um ficheiro WKB por DICO)
+pasta_recortes = pasta_cache / "recortes_municipais"
+
+# Caminhos /vsimem/ dos recortes já criados nesta execução
+_recortes_em_memoria = {}
+
+
+# Versão dos recortes: muda quando a CAOP ou a tolerância da simplificação mudam
+def versao_recortes(tolerancia=TOLERANCIA_SIMPLIFICACAO):
+    return hashlib.sha256(repr((ler_envelope.assinatura_caop(), tolerancia)).encode()).hexdigest()[:16]
+
+
+# Devolve a geometria do município no EPSG 3763, simplificada, lendo-a da cache em disco se já existir
+def geometria_municipio(dico, tolerancia=TOLERANCIA_SIMPLIFICACAO):
+    caminho = pasta_recortes / f"{dico}_{versao_recortes(tolerancia)}.wkb"
+    if caminho.exists():
+        return ogr.CreateGeometryFromWkb(caminho.read_bytes())
+
+    geometria = ler_envelope.geometria(dico)
+    srs_origem = osr.SpatialReference()
+    srs_origem.ImportFromEPSG(4326)
+    srs_destino = osr.SpatialReference()
+    srs_destino.ImportFromEPSG(EPSG_PORTUGAL)
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        srs_origem.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        srs_destino.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    geometria.Transform(osr.CoordinateTransformation(srs_origem, srs_destino))
+    geometria = ogr.ForceToMultiPolygon(geometria.SimplifyPreserveTopology(tolerancia))
+
+    pasta_recortes.mkdir(parents=True, exist_ok=True)
+    caminho_temp = caminho.with_suffix(f".{os.getpid()}.tmp")
+    caminho_temp.write_bytes(bytes(geometria.ExportToWkb()))
+    os.replace(caminho_temp, caminho)
+    return geometria
+
+
+# Devolve o caminho de um ficheiro de recorte em memória (/vsimem/) com o limite do município,
+# pronto a usar como cutline no gdal.Warp, sem ser preciso escolher uma shapefile
+def recorte_municipio(dico, tolerancia=TOLERANCIA_SIMPLIFICACAO):
+    chave = (dico, versao_recortes(tolerancia))
+    if chave in _recortes_em_memoria:
+        return _recortes_em_memoria[chave]
+
+    caminho = f"/vsimem/recortes_municipais/{dico}_{chave[1]}.geojson"
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG_PORTUGAL)
+    drv = ogr.GetDriverByName("GeoJSON")
+    fonte = drv.CreateDataSource(caminho)
+    camada = fonte.CreateLayer(dico, srs=srs, geom_type=ogr.wkbMultiPolygon)
+    camada.CreateField(ogr.FieldDefn("DICO", ogr.OFTString))
+    elemento = ogr.Feature(camada.GetLayerDefn())
+    elemento.SetField("DICO", dico)
+    elemento.SetGeometry(geometria_municipio(dico, tolerancia))
+    camada.CreateFeature(elemento)
+    elemento = camada = fonte = None
+
+    _recortes_em_memoria[chave] = caminho
+    return caminho
+
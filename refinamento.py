@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Modo rápido do processo (processa(..., modo_rapido=True)): em vez de reamostrar e filtrar todo o município a 10 m,
+#  1. triagem: as bandas são recortadas a 20 m (ou 60 m), a partir das imagens nativas dessa resolução, e a diferença
+#     de cada índice é comparada com uma fração do limiar, para encontrar os pixeis candidatos a ardidos;
+#  2. refinamento: só as janelas à volta dos candidatos (com uma margem) são recortadas a 10 m e passam pelo
+#     cálculo, pelo filtro e pela reclassificação do processo normal, escritos na grelha de 10 m do município.
+# Dentro das janelas o resultado é exatamente o do processo normal (a mesma grelha, com o halo do filtro), por isso
+# o modo rápido nunca acrescenta pixeis ardidos: só pode perder os que ficam fora de todas as janelas.
+# A fração de pixeis ardidos perdidos, em relação ao processo normal, deve ficar abaixo de TOLERANCIA_REFINAMENTO
+# (verificado em desempenho.py). Os índices sem limiar não têm triagem e a sua diferença fica à resolução da triagem,
+# tal como as composições RGB; processa.processa acrescenta "_<resolução>m" ao nome desses ficheiros
+
+# Importar as bibliotecas
+import shutil
+
+import numpy as np
+import osgeo.osr as osr
+from scipy import ndimage
+
+from sentinel import processa
+from sentinel.armazem_bandas import ArmazemBandas
+from sentinel.filtros import FILTRO_RECLASSIFICACAO
+from sentinel.indices import NODATA, TIPO_CALCULO, calcula_diferencas
+from sentinel.instrumentacao import Instrumentacao
+from sentinel.mascara_scl import BANDA_SCL, mascara_valida
+
+# Resolução (em metros) da triagem: 20 ou 60, as resoluções nativas dos produtos L2A
+RESOLUCAO_TRIAGEM = 20
+
+# Na triagem, um pixel é candidato se a diferença for superior a esta fração do limiar do índice:
+# o limiar mais baixo compensa a mistura de ardido e não ardido nos pixeis maiores
+FATOR_LIMIAR_TRIAGEM = 0.5
+
+# Margem (em pixeis da triagem) acrescentada à volta dos candidatos
+MARGEM_TRIAGEM = 2
+
+# Lado (em pixeis de 10 m) das quadrículas em que a grelha fina é dividida; as quadrículas com candidatos
+# seguidas na mesma linha formam uma janela, recortada com um único gdal.Warp
+TAMANHO_JANELA_REFINAMENTO = 256
+
+# Fração máxima dos pixeis ardidos do processo normal que o modo rápido pode perder
+TOLERANCIA_REFINAMENTO = 0.005
+
+
+# Georreferenciação (como processa.obtem_georreferencia) da grelha do recorte numa resolução,
+# sem ter de recortar nenhuma banda: é a grelha que o gdal.Warp cria com os mesmos limites
+def grelha_do_recorte(shapefile, resolucao=processa.RESOLUCAO):
+    xmin, ymin, xmax, ymax = processa.extensao_do_recorte(shapefile, resolucao)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(processa.EPSG_PORTUGAL)
+    return {
+        "colunas": int(round((xmax - xmin) / resolucao)),
+        "linhas": int(round((ymax - ymin) / resolucao)),
+        "geotransform": (xmin, resolucao, 0.0, ymax, 0.0, -resolucao),
+        "projecao": srs.ExportToWkt(),
+    }
+
+
+# Calcula as diferenças dos índices com as bandas da triagem (a imagem inteira, que é 4 ou 36 vezes mais pequena)
+# e devolve os pixeis candidatos a ardidos, em qualquer dos índices com limiar
+# Os índices sem limiar são gravados nos caminhos indicados ({índice: caminho}), à resolução da triagem
+def candidatos_triagem(
+    armazem, indices, bandas, limiares, georreferencia, caminhos_sem_limiar=None, usar_scl=False, tipo=TIPO_CALCULO,
+    fator=FATOR_LIMIAR_TRIAGEM,
+):
+    janela = (0, 0, georreferencia["colunas"], georreferencia["linhas"])
+    lidas_pre = {banda: armazem.janela("pre", banda, janela, tipo) for banda in bandas}
+    lidas_pos = {banda: armazem.janela("pos", banda, janela, tipo) for banda in bandas}
+    valida = mascara_valida(
+        armazem.janela("pre", BANDA_SCL, janela) if usar_scl else None,
+        armazem.janela("pos", BANDA_SCL, janela) if usar_scl else None,
+        lidas_pre[bandas[0]],
+        lidas_pos[bandas[0]],
+    )
+    candidatos = np.zeros(valida.shape, dtype=bool)
+    for indice, diferenca in calcula_diferencas(indices, lidas_pre, lidas_pos).items():
+        diferenca[~valida] = NODATA
+        if limiares[indice] is None:
+            if caminhos_sem_limiar and indice in caminhos_sem_limiar:
+                imagem = processa.cria_imagem_geo(caminhos_sem_limiar[indice], georreferencia)
+                imagem.GetRasterBand(1).WriteArray(diferenca)
+                imagem = None
+            continue
+        candidatos |= diferenca > fator * limiares[indice]
+    return candidatos
+
+
+# Converte os candidatos da triagem em janelas (xoff, yoff, xsize, ysize) da grelha fina: os candidatos são
+# alargados pela margem, marcados nas quadrículas da grelha fina que tocam, e as quadrículas marcadas seguidas
+# na mesma linha são juntas numa janela (as janelas não se sobrepõem)
+def janelas_refinamento(
+    candidatos, georreferencia_grossa, georreferencia_fina, margem=MARGEM_TRIAGEM, tamanho=TAMANHO_JANELA_REFINAMENTO
+):
+    if margem:
+        candidatos = ndimage.binary_dilation(candidatos, iterations=margem)
+    linhas, colunas = np.nonzero(candidatos)
+    n_colunas, n_linhas = georreferencia_fina["colunas"], georreferencia_fina["linhas"]
+    if not len(linhas) or not n_colunas or not n_linhas:
+        return []
+    x_grosso, res_grossa, _, y_grosso, _, _ = georreferencia_grossa["geotransform"]
+    x_fino, res_fina, _, y_fino, _, _ = georreferencia_fina["geotransform"]
+    # Primeira e última coluna/linha da grelha fina cobertas por cada pixel candidato
+    coluna_inicio = np.floor((x_grosso + colunas * res_grossa - x_fino) / res_fina).astype(int)
+    coluna_fim = np.ceil((x_grosso + (colunas + 1) * res_grossa - x_fino) / res_fina).astype(int) - 1
+    linha_inicio = np.floor((y_fino - (y_grosso - linhas * res_grossa)) / res_fina).astype(int)
+    linha_fim = np.ceil((y_fino - (y_grosso - (linhas + 1) * res_grossa)) / res_fina).astype(int) - 1
+
+    n_quad_linhas = -(-n_linhas // tamanho)
+    n_quad_colunas = -(-n_colunas // tamanho)
+    marcadas = np.zeros((n_quad_linhas, n_quad_colunas), dtype=bool)
+    # Um pixel da triagem é mais pequeno do que uma quadrícula, por isso só pode tocar nas quadrículas dos seus cantos
+    for linha in (linha_inicio, linha_fim):
+        for coluna in (coluna_inicio, coluna_fim):
+            marcadas[
+                np.clip(linha // tamanho, 0, n_quad_linhas - 1), np.clip(coluna // tamanho, 0, n_quad_colunas - 1)
+            ] = True
+
+    janelas = []
+    for quad_linha, linha_marcadas in enumerate(marcadas):
+        quad_coluna = 0
+        while quad_coluna < n_quad_colunas:
+            if not linha_marcadas[quad_coluna]:
+                quad_coluna += 1
+                continue
+            inicio = quad_coluna
+            while quad_coluna < n_quad_colunas and linha_marcadas[quad_coluna]:
+                quad_coluna += 1
+            xoff, yoff = inicio * tamanho, quad_linha * tamanho
+            janelas.append((
+                xoff, yoff, min(quad_coluna * tamanho, n_colunas) - xoff, min(yoff + tamanho, n_linhas) - yoff
+            ))
+    return janelas
+
+
+# Recorta a 10 m cada janela (com o halo do filtro) e calcula nela as diferenças, o filtro e a reclassificação,
+# escritos nas imagens da grelha fina ({índice: dataset}) na posição da janela
+# Devolve (número de blocos, blocos sem pixeis válidos, extensão em pixeis dos blocos válidos)
+def refina_janelas(
+    zip_pre, zip_pos, shapefile, indices, bandas, bandas_recorte, limiares, janelas, georreferencia_fina,
+    reclassificadas, nao_filtradas, temporarios, tamanho_bloco=processa.TAMANHO_BLOCO, tipo=TIPO_CALCULO,
+    filtro=FILTRO_RECLASSIFICACAO, usar_scl=False, memoria_bandas_mb=None, instrumentacao=None, progresso=None,
+):
+    if instrumentacao is None:
+        instrumentacao = Instrumentacao()
+    x_fino, resolucao, _, y_fino, _, _ = georreferencia_fina["geotransform"]
+    n_colunas, n_linhas = georreferencia_fina["colunas"], georreferencia_fina["linhas"]
+    halo = processa.HALO_FILTRO
+    n_blocos = blocos_ignorados = 0
+    extensao_valida = None
+    for numero, (xoff, yoff, xsize, ysize) in enumerate(janelas):
+        # Janela alargada pelo halo do filtro (limitado às margens da grelha), nos pixeis e nas coordenadas
+        x_inicio, y_inicio = max(xoff - halo, 0), max(yoff - halo, 0)
+        x_fim, y_fim = min(xoff + xsize + halo, n_colunas), min(yoff + ysize + halo, n_linhas)
+        limites = (
+            x_fino + x_inicio * resolucao, y_fino - y_fim * resolucao,
+            x_fino + x_fim * resolucao, y_fino - y_inicio * resolucao,
+        )
+        pasta_janela = temporarios / f"refinamento_{numero}"
+        pasta_janela.mkdir()
+        with instrumentacao.fase("refinamento", janela=numero, colunas=xsize, linhas=ysize):
+            fich_recortados = processa.realiza_recorte(
+                zip_pre, zip_pos, shapefile, bandas_recorte, bandas_recorte, pasta_janela,
+                instrumentacao=instrumentacao, limites=limites,
+                progresso=None if progresso is None else lambda fracao: progresso(numero / len(janelas)),
+            )
+            armazem = ArmazemBandas(fich_recortados, memoria_bandas_mb or processa.MEMORIA_BANDAS_MB)
+            try:
+                # Blocos só da parte interior da janela; o halo à volta vem do recorte alargado
+                blocos = list(processa.janelas_de_blocos(
+                    x_fim - x_inicio, y_fim - y_inicio, tamanho_bloco, halo,
+                    area=(xoff - x_inicio, yoff - y_inicio, xsize, ysize),
+                ))
+                ignorados, extensao = processa.calcula_blocos(
+                    armazem, indices, bandas, limiares, reclassificadas, nao_filtradas, blocos, tipo, filtro, usar_scl,
+                    instrumentacao, deslocamento=(x_inicio, y_inicio),
+                )
+            finally:
+                armazem.fecha()
+                shutil.rmtree(pasta_janela, ignore_errors=True)
+        n_blocos += len(blocos)
+        blocos_ignorados += ignorados
+        if extensao is not None:
+            extensao_valida = processa.junta_extensoes(extensao_valida, extensao)
+        if progresso is not None:
+            progresso((numero + 1) / len(janelas))
+    return n_blocos, blocos_ignorados, extensao_valida
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Gerador de produtos Sentinel2 L2A sintéticos (ZIP com a estrutura do SAFE) e de uma shapefile de recorte
+# semelhante à CAOP, para medir o desempenho do processo sem descarregar imagens reais.
+# As imagens são reprodutíveis (semente fixa): uma vegetação com ruído e, depois do incêndio, uma elipse ardida
+# e uma nuvem assinalada na classificação da cena (SCL)
+# As bandas podem ser JPEG2000 (driver JP2OpenJPEG) ou GeoTIFF; têm sempre a extensão .jp2 do SAFE,
+# porque o GDAL reconhece o formato pelo conteúdo e acha_melhor_imagem procura os ficheiros .jp2
+
+# Importar as bibliotecas
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import osgeo.gdal as gdal
+import osgeo.ogr as ogr
+import osgeo.osr as osr
+
+# Sistema de referência das quadrículas sintéticas (UTM 29N, o das quadrículas Sentinel2 de Portugal continental)
+EPSG_QUADRICULAS = 32629
+
+# Canto superior esquerdo da primeira quadrícula, no sul de Portugal continental
+ORIGEM_QUADRICULAS = (500000.0, 4200000.0)
+
+# Sobreposição entre quadrículas vizinhas (fração da largura), como nas quadrículas reais, para obrigar ao mosaico
+SOBREPOSICAO = 0.1
+
+# Bandas de cada resolução de um produto L2A (a banda 8 só existe a 10 m; as 11 e 12 só a 20 e 60 m)
+BANDAS_POR_RESOLUCAO = {
+    10: (2, 3, 4, 8),
+    20: (2, 3, 4, 5, 6, 7, 11, 12),
+    60: (1, 2, 3, 4, 5, 6, 7, 9, 11, 12),
+}
+
+# Resoluções em que o L2A tem a classificação da cena (SCL) e classes usadas: vegetação e nuvem (probabilidade alta)
+RESOLUCOES_SCL = (20, 60)
+CLASSE_SCL_VEGETACAO = 4
+CLASSE_SCL_NUVEM = 9
+
+# Refletância (x 10000) da vegetação e da área ardida em cada banda
+REFLETANCIA_VEGETACAO = {1: 300, 2: 400, 3: 700, 4: 500, 5: 1200, 6: 2500, 7: 2900, 8: 3200, 9: 3000, 11: 1800, 12: 900}
+REFLETANCIA_ARDIDA = {1: 400, 2: 500, 3: 650, 4: 800, 5: 1000, 6: 1300, 7: 1400, 8: 1500, 9: 1500, 11: 2600, 12: 2500}
+
+# Desvio padrão do ruído (x 10000) somado a cada pixel
+RUIDO = 150
+
+# Formatos das bandas: nome do driver do GDAL
+FORMATOS_BANDAS = {"jp2": "JP2OpenJPEG", "gtiff": "GTiff"}
+
+# Datas dos produtos antes e depois do incêndio
+DATA_PRE = datetime(2020, 7, 1, 11, 21, 21)
+DATA_POS = DATA_PRE + timedelta(days=30)
+
+
+# Nome do produto à maneira do SAFE: S2A_MSIL2A_<data>_N0214_R037_T29S<quadrícula>_<data>.SAFE
+def nome_produto(data, quadricula):
+    return f"S2A_MSIL2A_{data:%Y%m%dT%H%M%S}_N0214_R037_T29SN{chr(ord('A') + quadricula)}_{data:%Y%m%dT%H%M%S}"
+
+
+# Extensão (xmin, ymin, xmax, ymax) da quadrícula no EPSG_QUADRICULAS; as quadrículas ficam lado a lado, com sobreposição
+def extensao_quadricula(quadricula, colunas, linhas, resolucao=10):
+    largura = colunas * resolucao
+    xmin = ORIGEM_QUADRICULAS[0] + quadricula * largura * (1 - SOBREPOSICAO)
+    ymax = ORIGEM_QUADRICULAS[1]
+    return xmin, ymax - linhas * resolucao, xmin + largura, ymax
+
+
+# Extensão da união das quadrículas
+def extensao_total(n_quadriculas, colunas, linhas):
+    primeira = extensao_quadricula(0, colunas, linhas)
+    ultima = extensao_quadricula(n_quadriculas - 1, colunas, linhas)
+    return primeira[0], primeira[1], ultima[2], ultima[3]
+
+
+# Máscara da área ardida (elipse no centro da união das quadrículas) para os centros dos pixeis indicados
+def mascara_ardida(x, y, extensao):
+    xmin, ymin, xmax, ymax = extensao
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    rx, ry = (xmax - xmin) / 5, (ymax - ymin) / 4
+    return ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2 <= 1
+
+
+# Máscara da nuvem do produto depois do incêndio: um círculo no quarto superior esquerdo, fora da área ardida
+def mascara_nuvem(x, y, extensao):
+    xmin, ymin, xmax, ymax = extensao
+    cx, cy = xmin + (xmax - xmin) * 0.15, ymax - (ymax - ymin) * 0.2
+    raio = (ymax - ymin) / 10
+    return (x - cx) ** 2 + (y - cy) ** 2 <= raio ** 2
+
+
+# Centros dos pixeis (x nas colunas, y nas linhas) de uma quadrícula numa resolução
+def centros_pixeis(extensao_quad, resolucao):
+    xmin, ymin, xmax, ymax = extensao_quad
+    colunas = int(round((xmax - xmin) / resolucao))
+    linhas = int(round((ymax - ymin) / resolucao))
+    x = xmin + (np.arange(colunas) + 0.5) * resolucao
+    y = ymax - (np.arange(linhas) + 0.5) * resolucao
+    return x[np.newaxis, :], y[:, np.newaxis]
+
+
+# Valores (uint8) da SCL numa quadrícula e resolução: vegetação e, depois do incêndio, uma nuvem
+def valores_scl(extensao_quad, resolucao, extensao_total_quad, ardida):
+    x, y = centros_pixeis(extensao_quad, resolucao)
+    valores = np.full((y.shape[0], x.shape[1]), CLASSE_SCL_VEGETACAO, dtype=np.uint8)
+    if ardida:
+        valores[mascara_nuvem(x, y, extensao_total_quad)] = CLASSE_SCL_NUVEM
+    return valores
+
+
+# Valores (uint16) de uma banda numa quadrícula e resolução, antes ou depois do incêndio
+def valores_banda(banda, extensao_quad, resolucao, extensao_ardida, ardida, gerador):
+    x, y = centros_pixeis(extensao_quad, resolucao)
+    valores = np.full((y.shape[0], x.shape[1]), REFLETANCIA_VEGETACAO[banda], dtype=np.float32)
+    if ardida:
+        mascara = mascara_ardida(x, y, extensao_ardida)
+        valores[mascara] = REFLETANCIA_ARDIDA[banda]
+    valores += gerador.normal(0, RUIDO, valores.shape).astype(np.float32)
+    return np.clip(valores, 1, 10000).astype(np.uint16)
+
+
+# Cria o ficheiro de uma banda (em memória) e devolve os seus bytes
+def bytes_banda(valores, extensao_quad, resolucao, formato, tipo=gdal.GDT_UInt16):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG_QUADRICULAS)
+    caminho_mem = f"/vsimem/safe_sintetico_{id(valores)}.tif"
+    mem = gdal.GetDriverByName("MEM").Create("", valores.shape[1], valores.shape[0], 1, tipo)
+    mem.SetGeoTransform((extensao_quad[0], resolucao, 0, extensao_quad[3], 0, -resolucao))
+    mem.SetProjection(srs.ExportToWkt())
+    mem.GetRasterBand(1).WriteArray(valores)
+    opcoes = ["QUALITY=100", "REVERSIBLE=YES"] if formato == "jp2" else ["COMPRESS=DEFLATE", "TILED=YES"]
+    gdal.GetDriverByName(FORMATOS_BANDAS[formato]).CreateCopy(caminho_mem, mem, options=opcoes)
+    mem = None
+    ficheiro = gdal.VSIFOpenL(caminho_mem, "rb")
+    gdal.VSIFSeekL(ficheiro, 0, 2)
+    tamanho = gdal.VSIFTellL(ficheiro)
+    gdal.VSIFSeekL(ficheiro, 0, 0)
+    dados = gdal.VSIFReadL(1, tamanho, ficheiro)
+    gdal.VSIFCloseL(ficheiro)
+    gdal.Unlink(caminho_mem)
+    return dados
+
+
+# Cria o ZIP de um produto L2A sintético, com as bandas em R10m, R20m e R60m, e devolve o seu caminho
+def cria_produto(pasta, data, quadricula, colunas, linhas, n_quadriculas, ardida, formato="gtiff", semente=0):
+    pasta = Path(pasta)
+    pasta.mkdir(parents=True, exist_ok=True)
+    nome = nome_produto(data, quadricula)
+    caminho = pasta / f"{nome}.zip"
+    if caminho.exists():
+        return caminho
+    gerador = np.random.default_rng([semente, quadricula, int(ardida)])
+    extensao_quad = extensao_quadricula(quadricula, colunas, linhas)
+    extensao_ardida = extensao_total(n_quadriculas, colunas, linhas)
+    tile = nome.split("_")[5]
+    granulo = f"{nome}.SAFE/GRANULE/L2A_{tile}_A000000_{data:%Y%m%dT%H%M%S}/IMG_DATA"
+    with zipfile.ZipFile(caminho, "w", zipfile.ZIP_STORED) as saida:
+        for resolucao, bandas in BANDAS_POR_RESOLUCAO.items():
+            for banda in bandas:
+                valores = valores_banda(banda, extensao_quad, resolucao, extensao_ardida, ardida, gerador)
+                nome_banda = f"{granulo}/R{resolucao}m/{tile}_{data:%Y%m%dT%H%M%S}_B{banda:02d}_{resolucao}m.jp2"
+                saida.writestr(nome_banda, bytes_banda(valores, extensao_quad, resolucao, formato))
+        for resolucao in RESOLUCOES_SCL:
+            valores = valores_scl(extensao_quad, resolucao, extensao_ardida, ardida)
+            nome_scl = f"{granulo}/R{resolucao}m/{tile}_{data:%Y%m%dT%H%M%S}_SCL_{resolucao}m.jp2"
+            saida.writestr(nome_scl, bytes_banda(valores, extensao_quad, resolucao, formato, gdal.GDT_Byte))
+    return caminho
+
+
+# Cria uma shapefile de recorte semelhante à CAOP (EPSG 4326, campo DICO) com um octógono inscrito na união das quadrículas
+def cria_recorte(caminho, n_quadriculas, colunas, linhas, dico="9999"):
+    caminho = Path(caminho)
+    xmin, ymin, xmax, ymax = extensao_total(n_quadriculas, colunas, linhas)
+    margem_x, margem_y = (xmax - xmin) * 0.05, (ymax - ymin) * 0.05
+    xmin, ymin, xmax, ymax = xmin + margem_x, ymin + margem_y, xmax - margem_x, ymax - margem_y
+    corte_x, corte_y = (xmax - xmin) * 0.2, (ymax - ymin) * 0.2
+    pontos = [
+        (xmin + corte_x, ymin), (xmax - corte_x, ymin), (xmax, ymin + corte_y), (xmax, ymax - corte_y),
+        (xmax - corte_x, ymax), (xmin + corte_x, ymax), (xmin, ymax - corte_y), (xmin, ymin + corte_y),
+    ]
+    anel = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in pontos + pontos[:1]:
+        anel.AddPoint_2D(x, y)
+    poligono = ogr.Geometry(ogr.wkbPolygon)
+    poligono.AddGeometry(anel)
+
+    srs_origem = osr.SpatialReference()
+    srs_origem.ImportFromEPSG(EPSG_QUADRICULAS)
+    srs_destino = osr.SpatialReference()
+    srs_destino.ImportFromEPSG(4326)
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        srs_origem.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        srs_destino.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    poligono.Transform(osr.CoordinateTransformation(srs_origem, srs_destino))
+
+    drv = ogr.GetDriverByName("ESRI Shapefile")
+    if caminho.exists():
+        drv.DeleteDataSource(str(caminho))
+    fonte = drv.CreateDataSource(str(caminho))
+    camada = fonte.CreateLayer(caminho.stem, srs=srs_destino, geom_type=ogr.wkbPolygon)
+    camada.CreateField(ogr.FieldDefn("DICO", ogr.OFTString))
+    elemento = ogr.Feature(camada.GetLayerDefn())
+    elemento.SetField("DICO", dico)
+    elemento.SetGeometry(poligono)
+    camada.CreateFeature(elemento)
+    elemento = camada = fonte = None
+    return caminho
+
+
+# Cria os produtos antes e depois do incêndio (um ZIP por quadrícula) e a shapefile de recorte;
+# os ficheiros que já existem na pasta (da mesma semente e tamanho) são reaproveitados
+# Devolve (zips antes, zips depois, shapefile)
+def cria_cenario(pasta, colunas=1024, linhas=1024, n_quadriculas=1, formato="gtiff", semente=0):
+    pasta = Path(pasta)
+    zips_pre = [
+        cria_produto(pasta, DATA_PRE, quadricula, colunas, linhas, n_quadriculas, False, formato, semente)
+        for quadricula in range(n_quadriculas)
+    ]
+    zips_pos = [
+        cria_produto(pasta, DATA_POS, quadricula, colunas, linhas, n_quadriculas, True, formato, semente)
+        for quadricula in range(n_quadriculas)
+    ]
+    shapefile = pasta / "recorte_sintetico.shp"
+    if not shapefile.exists():
+        cria_recorte(shapefile, n_quadriculas, colunas, linhas)
+    return zips_pre, zips_pos, shapefile
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Seleção automática das imagens a descarregar: em vez de escolher as imagens só pela data, cruza o
+# footprint de cada produto com o limite do município e escolhe, para a melhor data antes e a melhor
+# data depois do incêndio, o menor conjunto de produtos (quadrículas) que cobre o município
+
+# Importar as bibliotecas
+import json
+from datetime import datetime
+
+import osgeo.ogr as ogr
+
+from sentinel import ler_envelope
+
+# Fração mínima da área do município que os produtos de uma data têm de cobrir para a data ser escolhida
+COBERTURA_MINIMA = 0.99
+
+# Ganho mínimo de área (fração do município) para acrescentar mais um produto ao conjunto
+GANHO_MINIMO = 0.001
+
+
+# Data de aquisição do produto (início da observação, "beginposition"), e não a de arquivo ("ingestiondate"):
+# as quadrículas da mesma passagem podem ser arquivadas em dias diferentes e um produto reprocessado é arquivado
+# muito depois da aquisição, o que o poria do lado errado da data do incêndio
+def data_produto(produto):
+    return datetime.strptime(str(produto["properties"]["beginposition"])[:10], "%Y-%m-%d")
+
+
+# Footprint do produto (geometria GeoJSON da pesquisa, ou o WKT da propriedade "footprint"), no SRC 4326
+def footprint(produto):
+    if produto.get("geometry"):
+        return ogr.CreateGeometryFromJson(json.dumps(produto["geometry"]))
+    return ogr.CreateGeometryFromWkt(produto["properties"]["footprint"])
+
+
+# Escolhe, de forma gulosa, o menor conjunto de produtos que cobre a geometria: em cada passo junta o produto
+# que cobre mais área ainda por cobrir, até atingir a cobertura mínima ou nenhum produto acrescentar área
+# Devolve (produtos escolhidos, fração da área coberta)
+def conjunto_minimo(produtos, geometria, cobertura_minima=COBERTURA_MINIMA):
+    area_total = geometria.GetArea()
+    if not area_total:
+        return [], 0.0
+    por_cobrir = geometria.Clone()
+    candidatos = [(produto, footprint(produto).Intersection(geometria)) for produto in produtos]
+    escolhidos = []
+    coberta = 0.0
+    while candidatos and coberta < cobertura_minima:
+        ganhos = [por_cobrir.Intersection(parte).GetArea() for _, parte in candidatos]
+        melhor = max(range(len(candidatos)), key=ganhos.__getitem__)
+        if ganhos[melhor] / area_total < GANHO_MINIMO:
+            break
+        produto, parte = candidatos.pop(melhor)
+        escolhidos.append(produto)
+        por_cobrir = por_cobrir.Difference(parte)
+        coberta = 1 - por_cobrir.GetArea() / area_total
+    return escolhidos, coberta
+
+
+# Percorre as datas pela ordem dada e devolve o menor conjunto da primeira data que cobre o município
+def _melhor_data(por_data, datas, geometria, cobertura_minima):
+    for data in datas:
+        escolhidos, coberta = conjunto_minimo(por_data[data], geometria, cobertura_minima)
+        if coberta >= cobertura_minima:
+            return escolhidos
+    return []
+
+
+# Seleciona as imagens antes e depois do incêndio para o município com o código DICO:
+# a data mais próxima antes (e depois) do incêndio cujos produtos cobrem o município, e dessa data só os
+# produtos necessários. produtos: features da pesquisa (import_img.lerimagens)
+# Devolve (produtos antes, produtos depois); uma das listas fica vazia se nenhuma data cobrir o município
+def seleciona_cenas(produtos, dico, data_incendio, cobertura_maxima=None, cobertura_minima=COBERTURA_MINIMA):
+    geometria = ler_envelope.geometria(dico)
+    por_data = {}
+    for produto in produtos:
+        nuvens = produto["properties"].get("cloudcoverpercentage")
+        if cobertura_maxima is not None and nuvens is not None and nuvens > cobertura_maxima:
+            continue
+        por_data.setdefault(data_produto(produto), []).append(produto)
+    datas_antes = sorted((data for data in por_data if data <= data_incendio), reverse=True)
+    datas_depois = sorted(data for data in por_data if data > data_incendio)
+    return (
+        _melhor_data(por_data, datas_antes, geometria, cobertura_minima),
+        _melhor_data(por_data, datas_depois, geometria, cobertura_minima),
+    )
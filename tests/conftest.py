@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+# O pacote "sentinel" é a pasta do repositório, e o seu __init__.py é a interface gráfica (tkinter, GDAL).
+# Os testes só usam os módulos de cálculo, por isso o pacote é registado sem correr o __init__.py,
+# com o nome "sentinel" (usado nos imports) e com o nome da pasta (com que o pytest importa o __init__.py)
+import sys
+import types
+from pathlib import Path
+
+raiz = Path(__file__).resolve().parent.parent
+if "sentinel" not in sys.modules:
+    pacote = types.ModuleType("sentinel")
+    pacote.__path__ = [str(raiz)]
+    pacote.__file__ = str(raiz / "__init__.py")
+    sys.modules["sentinel"] = pacote
+sys.modules.setdefault(raiz.name, sys.modules["sentinel"])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# O cálculo por blocos com halo (processa.janelas_de_blocos e processa.calcula_blocos) tem de dar a mesma
+# diferença e a mesma reclassificação que o cálculo na imagem inteira
+# processa importa o GDAL, por isso o teste é ignorado se o osgeo não estiver instalado
+
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+
+from sentinel import processa  # noqa: E402
+from sentinel.filtros import FILTROS  # noqa: E402
+from sentinel.indices import INDICES, NODATA, bandas_necessarias, calcula_diferencas  # noqa: E402
+from sentinel.mascara_scl import mascara_valida  # noqa: E402
+
+FORMA = (301, 245)
+INDICES_TESTE = ["ndvi", "nbr", "bai"]
+
+
+# Armazém com as bandas em memória, com a mesma interface que o ArmazemBandas usada por calcula_blocos
+class ArmazemMemoria:
+
+    def __init__(self, bandas):
+        self.bandas = bandas
+
+    def janela(self, prefixo, banda, janela, tipo=None):
+        xoff, yoff, xsize, ysize = janela
+        dados = self.bandas[prefixo][banda][yoff:yoff + ysize, xoff:xoff + xsize]
+        return dados if tipo is None else dados.astype(tipo)
+
+
+# Imagem em memória com a interface do dataset do GDAL usada na escrita dos blocos
+class ImagemMemoria:
+
+    def __init__(self, forma, tipo):
+        self.dados = np.full(forma, -1, dtype=tipo)
+
+    def GetRasterBand(self, numero):
+        return self
+
+    def WriteArray(self, dados, xoff, yoff):
+        self.dados[yoff:yoff + dados.shape[0], xoff:xoff + dados.shape[1]] = dados
+
+
+@pytest.fixture(scope="module")
+def bandas():
+    gerador = np.random.default_rng(1)
+    necessarias = bandas_necessarias(INDICES_TESTE)
+    pre = {banda: gerador.integers(1, 10001, FORMA).astype(np.uint16) for banda in necessarias}
+    pos = {banda: valores.copy() for banda, valores in pre.items()}
+    pos[8][60:200, 40:180] //= 3
+    # Fora do recorte (sem dados) num canto, com blocos inteiros sem pixeis válidos
+    for valores in (pre[8], pos[8]):
+        valores[:70, :70] = 0
+    return {"pre": pre, "pos": pos}
+
+
+@pytest.mark.parametrize("tamanho_bloco", [32, 64, 1000])
+def test_janelas_cobrem_a_imagem_uma_vez(tamanho_bloco):
+    linhas, colunas = FORMA
+    cobertura = np.zeros(FORMA, dtype=int)
+    for (xoff, yoff, xsize, ysize), (hx, hy, hxsize, hysize) in processa.janelas_de_blocos(
+        colunas, linhas, tamanho_bloco, processa.HALO_FILTRO
+    ):
+        cobertura[yoff:yoff + ysize, xoff:xoff + xsize] += 1
+        assert hx <= xoff and hy <= yoff and hx + hxsize >= xoff + xsize and hy + hysize >= yoff + ysize
+        assert hx == max(xoff - processa.HALO_FILTRO, 0) and hx + hxsize == min(xoff + xsize + processa.HALO_FILTRO, colunas)
+    assert (cobertura == 1).all()
+
+
+@pytest.mark.parametrize("filtro", list(FILTROS))
+@pytest.mark.parametrize("tamanho_bloco", [32, 64])
+def test_blocos_com_halo_iguais_a_imagem_inteira(bandas, filtro, tamanho_bloco):
+    linhas, colunas = FORMA
+    limiares = {indice: INDICES[indice]["limiar"] for indice in INDICES_TESTE}
+    necessarias = bandas_necessarias(INDICES_TESTE)
+    reclassificadas = {
+        indice: ImagemMemoria(FORMA, np.int16) for indice in INDICES_TESTE if limiares[indice] is not None
+    }
+    nao_filtradas = {indice: ImagemMemoria(FORMA, np.float32) for indice in INDICES_TESTE}
+    janelas = list(processa.janelas_de_blocos(colunas, linhas, tamanho_bloco, processa.HALO_FILTRO))
+    processa.calcula_blocos(
+        ArmazemMemoria(bandas), INDICES_TESTE, necessarias, limiares, reclassificadas, nao_filtradas, janelas,
+        filtro=filtro,
+    )
+
+    pre = {banda: valores.astype(np.float32) for banda, valores in bandas["pre"].items()}
+    pos = {banda: valores.astype(np.float32) for banda, valores in bandas["pos"].items()}
+    valida = mascara_valida(None, None, pre[necessarias[0]], pos[necessarias[0]])
+    for indice, diferenca in calcula_diferencas(INDICES_TESTE, pre, pos).items():
+        diferenca[~valida] = NODATA
+        # Os blocos sem pixeis válidos não são escritos
+        escrita = nao_filtradas[indice].dados != -1
+        np.testing.assert_array_equal(nao_filtradas[indice].dados[escrita], diferenca[escrita])
+        assert (diferenca[~escrita] == NODATA).all()
+        if limiares[indice] is None:
+            continue
+        esperada = FILTROS[filtro](diferenca, limiares[indice]) & valida
+        reclassificada = reclassificadas[indice].dados
+        assert esperada.any()
+        np.testing.assert_array_equal(reclassificada[escrita], esperada[escrita])
+        assert not esperada[~escrita].any()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Cache das pesquisas de imagens (SQLite) numa pasta temporária
+
+import threading
+
+import pytest
+
+from sentinel import cache_pesquisas
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_pesquisas, "ficheiro_cache", tmp_path / "pesquisas.sqlite")
+    monkeypatch.setattr(cache_pesquisas, "_ligacoes", threading.local())
+
+
+def produto(uuid, dia, nuvens):
+    data = f"{dia[:4]}-{dia[4:6]}-{dia[6:]}T11:21:11.024Z"
+    return {
+        "type": "Feature",
+        "geometry": None,
+        "properties": {"uuid": uuid, "beginposition": data, "ingestiondate": data, "cloudcoverpercentage": nuvens},
+    }
+
+
+def test_procura_filtra_nuvens_e_mantem_produtos_sem_cobertura():
+    chave = cache_pesquisas.chave_pesquisa("POLYGON((0 0,1 0,1 1,0 0))", platformname="Sentinel-2")
+    cache_pesquisas.guarda(chave, "20200801", "20200805", [
+        produto("limpo", "20200801", 5.0),
+        produto("nublado", "20200802", 80.0),
+        produto("sem_cobertura", "20200803", None),
+    ])
+    uuids = {feature["properties"]["uuid"] for feature in cache_pesquisas.procura(chave, "20200801", "20200805", 30)}
+    assert uuids == {"limpo", "sem_cobertura"}
+
+
+def test_so_pede_os_dias_em_falta_ou_fora_de_validade(monkeypatch):
+    chave = cache_pesquisas.chave_pesquisa("POLYGON((0 0,1 0,1 1,0 0))", platformname="Sentinel-2")
+    agora = 1_600_000_000.0
+    monkeypatch.setattr(cache_pesquisas.time, "time", lambda: agora)
+    assert cache_pesquisas.intervalos_em_falta(chave, "20200801", "20200810") == [("20200801", "20200810")]
+
+    cache_pesquisas.guarda(chave, "20200803", "20200805", [produto("p1", "20200804", 1.0)])
+    assert cache_pesquisas.intervalos_em_falta(chave, "20200801", "20200810") == [
+        ("20200801", "20200802"), ("20200806", "20200810"),
+    ]
+
+    # Depois da validade, os dias consultados voltam a ser pedidos
+    agora += cache_pesquisas.VALIDADE_PESQUISA + 1
+    assert cache_pesquisas.intervalos_em_falta(chave, "20200801", "20200810") == [("20200801", "20200810")]
+    # mas os produtos guardados continuam disponíveis
+    assert [feature["properties"]["uuid"] for feature in cache_pesquisas.procura(chave, "20200801", "20200810")] == ["p1"]
+
+
+def test_modo_offline_usa_so_a_cache(monkeypatch):
+    pytest.importorskip("sentinelsat")
+    from sentinel import import_img
+
+    def sem_ligacao(*args, **kwargs):
+        raise AssertionError("o modo offline não pode pesquisar no Copernicus")
+
+    monkeypatch.setattr(import_img.api, "query", sem_ligacao)
+    bbox = "POLYGON((0 0,1 0,1 1,0 0))"
+    chave = cache_pesquisas.chave_pesquisa(bbox, **import_img.CRITERIOS_PESQUISA)
+    cache_pesquisas.guarda(chave, "20200801", "20200805", [produto("p1", "20200802", 1.0), produto("p2", "20200803", 50.0)])
+
+    imagens = import_img.lerimagens(bbox, "20200801", "20200810", cobertura_maxima=10, offline=True)
+    assert [feature["properties"]["uuid"] for feature in imagens["features"]] == ["p1"]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Catálogo SQLite dos produtos descarregados, numa pasta temporária: importação única do antigo
+# ficheiros_descarregados.txt e procura por uuid e por ficheiro
+
+import threading
+
+import pytest
+
+from sentinel import catalogo
+
+
+@pytest.fixture
+def pasta(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalogo, "ficheiro_catalogo", tmp_path / "catalogo.sqlite")
+    monkeypatch.setattr(catalogo, "ficheiro_texto_antigo", tmp_path / "ficheiros_descarregados.txt")
+    monkeypatch.setattr(catalogo, "_ligacoes", threading.local())
+    return tmp_path
+
+
+# Nova ligação, como noutra thread ou noutro processo
+def nova_ligacao(monkeypatch):
+    monkeypatch.setattr(catalogo, "_ligacoes", threading.local())
+    return catalogo.ligacao()
+
+
+def test_importa_o_ficheiro_de_texto_uma_unica_vez(pasta, monkeypatch):
+    (pasta / "S2A_antigo.zip").write_bytes(b"0" * 10)
+    catalogo.ficheiro_texto_antigo.write_text("uuid-1=S2A_antigo.zip\nuuid-2=S2B_apagado.zip\n")
+
+    assert catalogo.ficheiro_do_produto("uuid-1") == pasta / "S2A_antigo.zip"
+    assert catalogo.produto("uuid-1")["tamanho"] == 10
+    # O registo existe, mas o ficheiro já não
+    assert catalogo.produto("uuid-2") is not None
+    assert catalogo.ficheiro_do_produto("uuid-2") is None
+
+    # As linhas acrescentadas depois da importação já não são importadas
+    with open(catalogo.ficheiro_texto_antigo, "a") as ficheiro:
+        ficheiro.write("uuid-3=S2A_novo.zip\n")
+    con = nova_ligacao(monkeypatch)
+    assert catalogo.produto("uuid-3") is None
+    assert con.execute("SELECT valor FROM meta WHERE chave = 'importado_texto'").fetchone()["valor"] == "2"
+
+
+def test_regista_e_procura_pelo_ficheiro(pasta):
+    ficheiro = pasta / "S2A_MSIL2A.zip"
+    ficheiro.write_bytes(b"1" * 5)
+    catalogo.regista("uuid-9", ficheiro, md5="abc", cobertura_nuvens=3.5)
+
+    assert catalogo.ficheiro_do_produto("uuid-9") == ficheiro
+    assert catalogo.uuid_do_ficheiro(ficheiro) == "uuid-9"
+    assert catalogo.produto("uuid-9")["tamanho"] == 5
+    catalogo.remove("uuid-9")
+    assert catalogo.produto("uuid-9") is None
+    assert catalogo.uuid_do_ficheiro(ficheiro) is None
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Downloads contra um servidor HTTP local (http.server) que aceita pedidos "Range", no lugar do Copernicus:
+# retoma do ficheiro .incomplete, verificação do MD5, download parcial de ficheiros do ZIP e progresso total
+
+import hashlib
+import http.server
+import io
+import os
+import re
+import threading
+import zipfile
+
+import pytest
+
+from sentinel.descarregamentos import (
+    SUFIXO_INCOMPLETO,
+    ErroVerificacao,
+    GestorDescarregamentos,
+    descarrega_ficheiro,
+    descarrega_membros_zip,
+)
+
+
+# Serve os ficheiros de servidor.ficheiros ({caminho: bytes}), com respostas 206 aos pedidos "Range",
+# e guarda em servidor.pedidos o caminho e o "Range" de cada pedido
+class ServidorRange(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        dados = self.server.ficheiros.get(self.path)
+        intervalo = self.headers.get("Range")
+        self.server.pedidos.append((self.path, intervalo))
+        if dados is None:
+            self.send_error(404)
+            return
+        inicio, fim = 0, len(dados) - 1
+        if intervalo:
+            procura = re.fullmatch(r"bytes=(\d+)-(\d*)", intervalo)
+            inicio = int(procura.group(1))
+            fim = min(int(procura.group(2)), fim) if procura.group(2) else fim
+            if inicio >= len(dados):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(dados)}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {inicio}-{fim}/{len(dados)}")
+        else:
+            self.send_response(200)
+        corpo = dados[inicio:fim + 1]
+        self.server.bytes_enviados += len(corpo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor():
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ServidorRange)
+    servidor.ficheiros = {}
+    servidor.pedidos = []
+    servidor.bytes_enviados = 0
+    servidor.url = f"http://127.0.0.1:{servidor.server_address[1]}"
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_retoma_o_ficheiro_incompleto(servidor, tmp_path):
+    dados = os.urandom(3 * 1024 * 1024 + 17)
+    servidor.ficheiros["/produto.zip"] = dados
+    destino = tmp_path / "produto.zip"
+    ja_descarregado = 1024 * 1024
+    (tmp_path / ("produto.zip" + SUFIXO_INCOMPLETO)).write_bytes(dados[:ja_descarregado])
+
+    progresso = []
+    descarrega_ficheiro(
+        servidor.url + "/produto.zip", destino, len(dados), hashlib.md5(dados).hexdigest(),
+        progresso=lambda descarregado, total: progresso.append(descarregado), tamanho_bloco=256 * 1024,
+    )
+
+    assert destino.read_bytes() == dados
+    assert not (tmp_path / ("produto.zip" + SUFIXO_INCOMPLETO)).exists()
+    assert servidor.pedidos == [("/produto.zip", f"bytes={ja_descarregado}-")]
+    assert servidor.bytes_enviados == len(dados) - ja_descarregado
+    assert progresso[0] > ja_descarregado and progresso[-1] == len(dados)
+
+
+def test_md5_errado_apaga_o_ficheiro_incompleto(servidor, tmp_path):
+    dados = os.urandom(100 * 1024)
+    servidor.ficheiros["/produto.zip"] = dados
+    destino = tmp_path / "produto.zip"
+
+    with pytest.raises(ErroVerificacao):
+        descarrega_ficheiro(servidor.url + "/produto.zip", destino, len(dados), "0" * 32)
+
+    assert not destino.exists()
+    assert not (tmp_path / ("produto.zip" + SUFIXO_INCOMPLETO)).exists()
+
+
+def test_download_parcial_so_dos_ficheiros_escolhidos(servidor, tmp_path):
+    membros = {
+        f"S2A.SAFE/GRANULE/L2A/IMG_DATA/R{resolucao}/T29_B{banda:02d}_{resolucao}.jp2": os.urandom(200 * 1024)
+        for banda, resolucao in ((4, "10m"), (8, "10m"), (12, "20m"), (2, "10m"), (3, "10m"), (11, "20m"))
+    }
+    conteudo = io.BytesIO()
+    with zipfile.ZipFile(conteudo, "w", zipfile.ZIP_STORED) as produto:
+        for nome, dados in membros.items():
+            produto.writestr(nome, dados)
+    servidor.ficheiros["/produto.zip"] = conteudo.getvalue()
+    escolhidos = [nome for nome in membros if re.search(r"_B(04|08|12)_", nome)]
+    destino = tmp_path / "produto_bandas.zip"
+
+    progresso = []
+    descarrega_membros_zip(
+        servidor.url + "/produto.zip", destino, lambda dados: escolhidos,
+        progresso=lambda descarregado, total: progresso.append((descarregado, total)), tamanho_bloco=64 * 1024,
+    )
+
+    with zipfile.ZipFile(destino) as parcial:
+        assert sorted(parcial.namelist()) == sorted(escolhidos)
+        for nome in escolhidos:
+            assert parcial.read(nome) == membros[nome]
+    assert not (tmp_path / "produto_bandas.zip.parcial").exists()
+    assert servidor.bytes_enviados < len(conteudo.getvalue()) * 0.7
+    assert progresso[-1] == (sum(len(membros[nome]) for nome in escolhidos),) * 2
+
+
+def test_percentagem_conta_todos_os_produtos_e_nao_recua(servidor, tmp_path):
+    produtos = {}
+    for numero in range(4):
+        dados = os.urandom((numero + 1) * 300 * 1024)
+        servidor.ficheiros[f"/p{numero}.zip"] = dados
+        produtos[f"uuid{numero}"] = {
+            "title": f"p{numero}", "url": f"{servidor.url}/p{numero}.zip", "size": len(dados),
+            "md5": hashlib.md5(dados).hexdigest(),
+        }
+    # Um dos produtos já foi descarregado antes
+    (tmp_path / "p0.zip").write_bytes(servidor.ficheiros["/p0.zip"])
+
+    gestor = GestorDescarregamentos(tmp_path, n_simultaneos=1)
+    percentagens = []
+    gestor.descarrega(produtos, lambda uuid, descarregado, total: percentagens.append(gestor.percentagem()))
+
+    # No primeiro progresso só estão completos o produto já existente e, no máximo, o primeiro descarregado;
+    # contando só os produtos em curso, seria logo 100%
+    assert percentagens[0] <= 50
+    assert percentagens == sorted(percentagens)
+    assert gestor.percentagem() == 100
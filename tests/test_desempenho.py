@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# As máscaras calculadas fase a fase na medição do desempenho têm de ser as do processo completo
+# (processa.processa), iguais com os dois filtros e, no modo rápido, dentro da tolerância do refinamento
+# Precisa do GDAL, por isso o teste é ignorado se o osgeo não estiver instalado
+
+import pytest
+
+pytest.importorskip("osgeo")
+
+from sentinel import desempenho  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def relatorio(tmp_path_factory):
+    return desempenho.executa(colunas=512, linhas=512, n_quadriculas=2, pasta=tmp_path_factory.mktemp("desempenho"))
+
+
+def test_mascaras_iguais_ao_processo_completo(relatorio):
+    assert relatorio["mascaras_iguais_ao_processo"]
+
+
+def test_filtros_equivalentes(relatorio):
+    assert relatorio["filtros_equivalentes"]
+
+
+def test_modo_rapido_dentro_da_tolerancia(relatorio):
+    assert relatorio["modo_rapido"]["dentro_da_tolerancia"], relatorio["modo_rapido"]["diferencas"]
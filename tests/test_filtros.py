@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# O filtro por contagem (filtros.reclassifica_contagem) tem de dar exatamente a mesma reclassificação que o
+# filtro mediana 5x5 seguido do limiar, também com pixeis de nodata, valores iguais ao limiar e nas margens
+
+import numpy as np
+import pytest
+
+from sentinel.filtros import TAMANHO_FILTRO, reclassifica_contagem, reclassifica_mediana
+from sentinel.indices import NODATA
+
+FORMA = (203, 157)
+
+
+@pytest.fixture(scope="module")
+def diferenca():
+    gerador = np.random.default_rng(8)
+    diferenca = gerador.normal(0.1, 0.2, FORMA).astype(np.float32)
+    # Zonas sem dados (mascaradas), incluindo nas margens e em pixeis isolados
+    diferenca[40:90, 10:60] = NODATA
+    diferenca[:, -3:] = NODATA
+    diferenca[gerador.random(FORMA) < 0.05] = NODATA
+    return diferenca
+
+
+@pytest.mark.parametrize("limiar", [-0.5, 0.0, 0.1, 0.17767, 0.6])
+def test_contagem_igual_a_mediana(diferenca, limiar):
+    np.testing.assert_array_equal(reclassifica_contagem(diferenca, limiar), reclassifica_mediana(diferenca, limiar))
+
+
+def test_contagem_igual_a_mediana_com_empates():
+    # Valores inteiros, muitos iguais ao limiar: a mediana igual ao limiar não é ardida nos dois filtros
+    gerador = np.random.default_rng(9)
+    diferenca = gerador.integers(-2, 3, FORMA).astype(np.float32)
+    diferenca[gerador.random(FORMA) < 0.1] = NODATA
+    for limiar in (-1.0, 0.0, 1.0):
+        np.testing.assert_array_equal(reclassifica_contagem(diferenca, limiar), reclassifica_mediana(diferenca, limiar))
+
+
+def test_maioria_exata_na_janela():
+    # Com metade dos 25 pixeis mais um acima do limiar a mediana está acima; com metade, não
+    metade = TAMANHO_FILTRO * TAMANHO_FILTRO // 2
+    for acima, esperado in ((metade + 1, True), (metade, False)):
+        janela = np.zeros(TAMANHO_FILTRO * TAMANHO_FILTRO, dtype=np.float32)
+        janela[:acima] = 1
+        diferenca = np.full((15, 15), NODATA, dtype=np.float32)
+        diferenca[5:10, 5:10] = janela.reshape(TAMANHO_FILTRO, TAMANHO_FILTRO)
+        assert reclassifica_contagem(diferenca, 0.5)[7, 7] == esperado
+        assert reclassifica_mediana(diferenca, 0.5)[7, 7] == esperado
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Índice DICO -> (envelope, geometria do município) criado a partir da CAOP e guardado em disco:
+# é criado uma única vez e só volta a ser criado quando a CAOP muda
+# Precisa do GDAL/OGR, por isso o teste é ignorado se o osgeo não estiver instalado
+
+import os
+
+import pytest
+
+ogr = pytest.importorskip("osgeo.ogr")
+osr = pytest.importorskip("osgeo.osr")
+
+from sentinel import ler_envelope  # noqa: E402
+
+# Freguesias (DICO, retângulo xmin, xmax, ymin, ymax) de dois municípios
+FREGUESIAS = [
+    ("0101", (-8.6, -8.5, 40.5, 40.6)),
+    ("0101", (-8.5, -8.4, 40.5, 40.7)),
+    ("0202", (-8.0, -7.9, 41.0, 41.1)),
+]
+
+
+def cria_caop(caminho, freguesias):
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if caminho.exists():
+        driver.DeleteDataSource(str(caminho))
+    fonte = driver.CreateDataSource(str(caminho))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    camada = fonte.CreateLayer(caminho.stem, srs=srs, geom_type=ogr.wkbPolygon)
+    camada.CreateField(ogr.FieldDefn("DICO", ogr.OFTString))
+    for dico, (xmin, xmax, ymin, ymax) in freguesias:
+        elemento = ogr.Feature(camada.GetLayerDefn())
+        elemento.SetField("DICO", dico)
+        elemento.SetGeometry(ogr.CreateGeometryFromWkt(
+            f"POLYGON(({xmin} {ymin},{xmax} {ymin},{xmax} {ymax},{xmin} {ymax},{xmin} {ymin}))"
+        ))
+        camada.CreateFeature(elemento)
+    fonte = None
+
+
+@pytest.fixture
+def caop(tmp_path, monkeypatch):
+    caminho = tmp_path / "CAOP.shp"
+    cria_caop(caminho, FREGUESIAS)
+    monkeypatch.setattr(ler_envelope, "entrada", str(caminho))
+    monkeypatch.setattr(ler_envelope, "ficheiro_indice", tmp_path / "indice_caop.pkl")
+    monkeypatch.setattr(ler_envelope, "pasta_cache", tmp_path)
+    monkeypatch.setattr(ler_envelope, "_indice", None)
+    monkeypatch.setattr(ler_envelope, "_assinatura", None)
+    return caminho
+
+
+def test_envelope_e_geometria_do_municipio(caop):
+    assert ler_envelope.procura_municipio("0101")[0] == pytest.approx((-8.6, -8.4, 40.5, 40.7))
+    assert ler_envelope.geometria("0101").GetArea() == pytest.approx(0.01 + 0.02)
+    with pytest.raises(ValueError):
+        ler_envelope.procura_municipio("9999")
+
+
+def test_indice_criado_uma_vez_e_recriado_quando_a_caop_muda(caop, monkeypatch):
+    criacoes = []
+    cria_indice = ler_envelope.cria_indice
+    monkeypatch.setattr(ler_envelope, "cria_indice", lambda: criacoes.append(1) or cria_indice())
+
+    ler_envelope.indice_dico()
+    assert ler_envelope.ficheiro_indice.exists()
+    # Noutra execução, o índice é lido do disco
+    monkeypatch.setattr(ler_envelope, "_indice", None)
+    ler_envelope.indice_dico()
+    assert len(criacoes) == 1
+
+    cria_caop(caop, FREGUESIAS + [("0303", (-7.5, -7.4, 39.0, 39.1))])
+    os.utime(caop, ns=(os.stat(caop).st_atime_ns, os.stat(caop).st_mtime_ns + 10**9))
+    assert "0303" in ler_envelope.indice_dico()
+    assert len(criacoes) == 2
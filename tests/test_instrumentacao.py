@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# O pico de memória de cada fase é o da própria fase, e não o pico do processo desde o início
+
+import time
+
+import numpy as np
+import pytest
+
+from sentinel.instrumentacao import Instrumentacao, memoria_residente
+
+MB = 2**20
+
+pytestmark = pytest.mark.skipif(memoria_residente() is None, reason="sem /proc/self/statm")
+
+
+def test_pico_de_memoria_por_fase():
+    instrumentacao = Instrumentacao()
+    with instrumentacao.fase("grande"):
+        dados = np.ones(400 * MB, dtype=np.uint8)
+        time.sleep(0.2)
+        del dados
+    with instrumentacao.fase("pequena"):
+        time.sleep(0.2)
+
+    grande, pequena = instrumentacao.registos
+    assert grande["pico_rss_mb"] - pequena["pico_rss_mb"] > 300
+    assert pequena["pico_rss_mb"] <= pequena["rss_mb"] + 50
+
+
+def test_fases_encaixadas_e_amostragem_termina():
+    instrumentacao = Instrumentacao()
+    with instrumentacao.fase("exterior"):
+        with instrumentacao.fase("interior"):
+            dados = np.ones(200 * MB, dtype=np.uint8)
+            time.sleep(0.2)
+            del dados
+    interior, exterior = instrumentacao.registos
+    assert exterior["pico_rss_mb"] >= interior["pico_rss_mb"]
+    time.sleep(0.2)
+    assert instrumentacao._amostragem is None
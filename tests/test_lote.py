@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Processamento em lote: leitura dos trabalhos, repetição dos que falham e resumo
+# O processamento de cada trabalho é substituído por uma função do teste, que corre nos processos do lote
+
+import json
+from datetime import datetime
+
+import pytest
+
+from sentinel import lote
+
+
+# Trabalho "1" conclui à primeira, "2" falha na primeira tentativa e conclui na segunda, "3" falha sempre
+def executa_trabalho_teste(trabalho, pasta, tentativa=1):
+    concluido = trabalho["id"] == "1" or (trabalho["id"] == "2" and tentativa > 1)
+    resultado = {"id": trabalho["id"], "tentativa": tentativa, "estado": "concluido" if concluido else "erro"}
+    if not concluido:
+        resultado["erro"] = "RuntimeError: falhou"
+    return resultado
+
+
+@pytest.fixture
+def trabalhos(tmp_path):
+    caminho = tmp_path / "trabalhos.csv"
+    caminho.write_text(
+        "id,dico,data_incendio,indices,pre,pos,rapido\n"
+        "1,101,2020-08-01,ndvi;nbr,a.zip,b.zip,sim\n"
+        "2,1102,2020-08-02,,a.zip,b.zip,\n"
+        "3,1103,2020-08-03,,a.zip,b.zip,\n"
+        "4,1104,2020-08-04,,,,\n",
+        encoding="utf-8",
+    )
+    return caminho
+
+
+def test_le_trabalhos_csv(trabalhos):
+    primeiro, segundo, *_ = lote.le_trabalhos(trabalhos)
+    assert primeiro["dico"] == "0101" and primeiro["indices"] == ["ndvi", "nbr"] and primeiro["rapido"]
+    assert primeiro["data_incendio"] == datetime(2020, 8, 1)
+    assert segundo["indices"] == ["ndvi"] and not segundo["rapido"] and segundo["pre"] == ["a.zip"]
+
+
+def test_repete_os_trabalhos_falhados_e_grava_o_resumo(trabalhos, tmp_path, monkeypatch):
+    preparados = []
+
+    # O trabalho "4" não indica produtos e nenhum cobre o município
+    def prepara_produtos_teste(pendentes):
+        preparados.append(sorted(trabalho["id"] for trabalho in pendentes))
+        return {"4": "RuntimeError: sem imagens"}
+
+    monkeypatch.setattr(lote, "prepara_produtos", prepara_produtos_teste)
+    monkeypatch.setattr(lote, "executa_trabalho", executa_trabalho_teste)
+    pasta = tmp_path / "logs"
+
+    resumo = lote.executa_lote(trabalhos, n_processos=2, tentativas=2, pasta=pasta)
+
+    # Na segunda tentativa só entram os que falharam
+    assert preparados == [["1", "2", "3", "4"], ["2", "3", "4"]]
+    assert {id: (resultado["estado"], resultado["tentativa"]) for id, resultado in resumo.items()} == {
+        "1": ("concluido", 1), "2": ("concluido", 2), "3": ("erro", 2), "4": ("erro", 2),
+    }
+    assert resumo["4"]["erro"] == "RuntimeError: sem imagens"
+    guardado, = pasta.glob("resumo_*.json")
+    assert sorted(resultado["id"] for resultado in json.loads(guardado.read_text(encoding="utf-8"))) == ["1", "2", "3", "4"]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# O cálculo em float32 (indices.TIPO_CALCULO) tem de dar as mesmas diferenças e as mesmas áreas ardidas que o
+# cálculo original em float64, dentro de uma tolerância
+
+import numpy as np
+import pytest
+
+from sentinel.filtros import FILTROS
+from sentinel.indices import INDICES, NODATA, bandas_necessarias, calcula_diferencas
+
+# Erro máximo admitido nas diferenças, relativo a max(|valor em float64|, 1): o float32 tem cerca de 1e-7 de
+# precisão relativa; o BAI e o RBR dividem por valores próximos de zero e a diferença do BAI subtrai dois valores
+# muito grandes, por isso perdem mais alguns algarismos
+TOLERANCIA_RELATIVA = {"bai": 1e-3, "rbr": 1e-3}
+TOLERANCIA_RELATIVA_NORMAL = 1e-5
+
+# Fração máxima dos pixeis da reclassificação que podem mudar de classe (só os que ficam no limiar)
+TOLERANCIA_PIXEIS_TROCADOS = 1e-4
+
+FORMA = (512, 512)
+
+
+@pytest.fixture(scope="module")
+def bandas():
+    # Refletâncias do nível 2A (0 a 10000), com uma zona "ardida" no depois para haver pixeis acima dos limiares
+    gerador = np.random.default_rng(2020)
+    necessarias = bandas_necessarias(INDICES)
+    pre = {banda: gerador.integers(1, 10001, FORMA).astype(np.uint16) for banda in necessarias}
+    pos = {banda: valores.copy() for banda, valores in pre.items()}
+    ardida = (slice(100, 300), slice(150, 400))
+    pos[8][ardida] //= 3
+    pos[12][ardida] = np.minimum(pos[12][ardida].astype(np.uint32) * 2, 10000).astype(np.uint16)
+    ruido = {banda: gerador.integers(-300, 301, FORMA) for banda in necessarias}
+    pos = {banda: np.clip(valores + ruido[banda], 0, 10000).astype(np.uint16) for banda, valores in pos.items()}
+    return pre, pos
+
+
+def diferencas_no_tipo(bandas, tipo, buffers=None):
+    pre, pos = bandas
+    return calcula_diferencas(
+        list(INDICES),
+        {banda: valores.astype(tipo) for banda, valores in pre.items()},
+        {banda: valores.astype(tipo) for banda, valores in pos.items()},
+        buffers,
+    )
+
+
+@pytest.mark.parametrize("indice", list(INDICES))
+def test_diferencas_float32_dentro_da_tolerancia(bandas, indice):
+    referencia = diferencas_no_tipo(bandas, np.float64)[indice]
+    diferenca = diferencas_no_tipo(bandas, np.float32, buffers={})[indice]
+    assert diferenca.dtype == np.float32
+    np.testing.assert_array_equal(diferenca == NODATA, referencia == NODATA)
+    erro = np.abs(diferenca.astype(np.float64) - referencia) / np.maximum(np.abs(referencia), 1)
+    assert erro.max() <= TOLERANCIA_RELATIVA.get(indice, TOLERANCIA_RELATIVA_NORMAL)
+
+
+@pytest.mark.parametrize("filtro", list(FILTROS))
+@pytest.mark.parametrize("indice", [indice for indice, definicao in INDICES.items() if definicao["limiar"] is not None])
+def test_reclassificacao_float32_igual_a_float64(bandas, indice, filtro):
+    limiar = INDICES[indice]["limiar"]
+    referencia = FILTROS[filtro](diferencas_no_tipo(bandas, np.float64)[indice], limiar)
+    reclassificada = FILTROS[filtro](diferencas_no_tipo(bandas, np.float32)[indice], limiar)
+    trocados = int(np.count_nonzero(reclassificada != referencia))
+    assert referencia.any()
+    assert trocados <= TOLERANCIA_PIXEIS_TROCADOS * referencia.size, f"{trocados} pixeis mudaram de classe"
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Nome da Ferramenta: Determinação de Áreas Ardidas a Nível Municipal
+#
+# Proposito: Ferramenta que utiliza imagens Sentinel2 com resolução 10 metros
+#            para criar um shapefile das áreas ardidas
+#
+# Autor: Antonio Ângelo Candeias dos Santos
+#
+# Versão: 01/2020
+# Copyright:(c) Antonio A C Santos 2020
+#-------------------------------------------------------------------------------
+
+# Fila de trabalhos (processamentos e downloads) executados numa thread de fundo, para que a janela
+# do tkinter não fique bloqueada. O tkinter só pode ser usado na thread principal: a thread de fundo
+# não toca na janela e envia os eventos (início, progresso, fim, erro, cancelado) pela fila "eventos",
+# que a janela lê periodicamente com top.after
+
+# Importar as bibliotecas
+import itertools
+import queue
+import threading
+import traceback
+
+
+# Exceção lançada dentro do trabalho, na chamada seguinte ao "update", quando o trabalho é cancelado
+class TrabalhoCancelado(Exception):
+    pass
+
+
+class FilaTrabalhos:
+
+    def __init__(self):
+        self.eventos = queue.Queue()
+        self._pendentes = queue.Queue()
+        self._contador = itertools.count(1)
+        self._cancelados = set()
+        # Os trabalhos com identificador até este foram cancelados por cancela_todos, mesmo o que a thread
+        # de fundo já tirou da fila e ainda não começou (e que por isso não está na fila nem é o atual)
+        self._cancelados_ate = 0
+        self._ultimo = 0
+        self._atual = None
+        self._trinco = threading.Lock()
+        self._thread = threading.Thread(target=self._trabalha, name="fila_trabalhos", daemon=True)
+        self._thread.start()
+
+    # Acrescenta um trabalho à fila e devolve o seu identificador
+    # "funcao" é chamada na thread de fundo como funcao(update, *args, **kwargs), em que update(valor, mensagem)
+    # envia o progresso para a janela e lança TrabalhoCancelado se o trabalho foi cancelado
+    def adiciona(self, nome, funcao, *args, **kwargs):
+        with self._trinco:
+            identificador = self._ultimo = next(self._contador)
+            self._pendentes.put((identificador, nome, funcao, args, kwargs))
+        self.eventos.put(("fila", identificador, nome))
+        return identificador
+
+    # Cancela um trabalho (por defeito o que está a correr); o cancelamento só tem efeito no "update" seguinte
+    def cancela(self, identificador=None):
+        with self._trinco:
+            if identificador is None:
+                identificador = self._atual
+            if identificador is not None:
+                self._cancelados.add(identificador)
+
+    # Cancela o trabalho atual e todos os que estão à espera
+    def cancela_todos(self):
+        with self._trinco:
+            self._cancelados_ate = self._ultimo
+        while True:
+            try:
+                identificador, nome, *_ = self._pendentes.get_nowait()
+            except queue.Empty:
+                break
+            self.eventos.put(("cancelado", identificador, nome))
+        self.cancela()
+
+    # Número de trabalhos à espera (sem contar o que está a correr)
+    def pendentes(self):
+        return self._pendentes.qsize()
+
+    def ocupada(self):
+        return self._atual is not None or not self._pendentes.empty()
+
+    def _cancelado(self, identificador):
+        with self._trinco:
+            return identificador <= self._cancelados_ate or identificador in self._cancelados
+
+    def _trabalha(self):
+        while True:
+            identificador, nome, funcao, args, kwargs = self._pendentes.get()
+            if self._cancelado(identificador):
+                with self._trinco:
+                    self._cancelados.discard(identificador)
+                self.eventos.put(("cancelado", identificador, nome))
+                continue
+            with self._trinco:
+                self._atual = identificador
+
+            def update(valor, mensagem):
+                if self._cancelado(identificador):
+                    raise TrabalhoCancelado(nome)
+                self.eventos.put(("progresso", identificador, nome, valor, mensagem))
+
+            self.eventos.put(("inicio", identificador, nome))
+            try:
+                resultado = funcao(update, *args, **kwargs)
+            except TrabalhoCancelado:
+                self.eventos.put(("cancelado", identificador, nome))
+            except Exception as erro:
+                traceback.print_exc()
+                self.eventos.put(("erro", identificador, nome, f"{type(erro).__name__}: {erro}"))
+            else:
+                self.eventos.put(("fim", identificador, nome, resultado))
+            finally:
+                with self._trinco:
+                    self._atual = None
+                    self._cancelados.discard(identificador)